@@ -0,0 +1,218 @@
+from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.responses import PlainTextResponse
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import time
+import numpy as np
+
+# Puts the embedding service and the Diagnosing-API on the path, loads nothing yet
+from pipeline import load_pipeline
+from config import (
+    EMBED_BATCH_SIZE, DECODE_WORKERS, MAX_BATCH_FILES, MAX_IMAGE_BYTES, BATCH_WINDOW_MS, MAX_QUEUE_SIZE,
+    DECODE_QUEUE_SIZE, MODEL_QUEUE_SIZE,
+)
+from executors import ExecutorBusy, decode_executor, model_executor, render_executors_prometheus
+from preprocessing import is_image, load_image, try_load_image
+from response_formats import vector_fields
+from scheduler import BatchScheduler, QueueFull
+import metrics
+
+
+# Both models loaded and warmed before the first request
+pipeline = load_pipeline()
+
+# Decoding runs in worker processes, both models on one thread that owns them
+decoder = decode_executor(DECODE_WORKERS, DECODE_QUEUE_SIZE)
+model_thread = model_executor(MODEL_QUEUE_SIZE)
+
+
+def diagnose_images(images):
+    """Embed and classify a batch on the model thread, every image gets the batch timing and size"""
+    results, timing = pipeline.run(images)
+    return [(result, timing, len(images)) for result in results]
+
+
+# Concurrent /diagnose requests share one embed-and-classify call
+scheduler = BatchScheduler(
+    lambda images: model_thread.run(diagnose_images, images),
+    max_batch_size=EMBED_BATCH_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    max_queue_size=MAX_QUEUE_SIZE,
+    buckets=pipeline.infer.buckets,
+)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await scheduler.start()
+    yield
+    await scheduler.stop()
+    decoder.shutdown()
+    model_thread.shutdown()
+
+app = FastAPI(title="Medical Image Diagnosis Pipeline", lifespan=lifespan)
+
+EMBEDDING_FORMATS = ("json", "base64-float32", "base64-float16")
+
+
+def check_embedding_format(embedding):
+    if embedding is not None and embedding not in EMBEDDING_FORMATS:
+        raise HTTPException(status_code=406, detail=f"Unknown embedding format {embedding!r}, expected one of {EMBEDDING_FORMATS}")
+
+
+def milliseconds(timing):
+    return {stage: round(seconds * 1000.0, 3) for stage, seconds in timing.items()}
+
+
+@app.post("/diagnose")
+async def diagnose(file: UploadFile = File(...), embedding: Optional[str] = None):
+    """
+    Upload a medical image (JPEG, PNG, TIFF) and get its cancer prediction in one call
+
+    The image is decoded, embedded with Path Foundation and classified in this
+    process, batched with other concurrent requests. `timing_ms` breaks the
+    request down into decode, queue (waiting for the batch and the model
+    thread), embed and classify; embed and classify are those of the whole
+    batch of `batch_size` images. `?embedding=json`, `base64-float32` or
+    `base64-float16` also returns the embedding.
+    """
+    check_embedding_format(embedding)
+    if not is_image(file.filename, file.content_type):
+        raise HTTPException(status_code=400, detail="File must be an image (JPEG, PNG, BMP) or TIFF format")
+    data = await file.read()
+    if len(data) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+
+    started = time.perf_counter()
+    try:
+        image = await decoder.run(load_image, data)
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode image: {str(e)}")
+    decoded = time.perf_counter()
+
+    try:
+        (vector, prediction, confidence), batch_timing, batch_size = await scheduler.submit(image)
+    except (QueueFull, ExecutorBusy) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during diagnosis: {str(e)}")
+    finished = time.perf_counter()
+
+    timing = {
+        "decode": decoded - started,
+        "queue": max(0.0, finished - decoded - batch_timing["embed"] - batch_timing["classify"]),
+        **batch_timing,
+    }
+    pipeline.record(timing)
+    result = {
+        "filename": file.filename,
+        "prediction": prediction,
+        "confidence": confidence,
+        "model_version": pipeline.versions,
+        "batch_size": batch_size,
+        "timing_ms": milliseconds({**timing, "total": finished - started}),
+    }
+    if embedding is not None:
+        result.update(vector_fields(vector, embedding))
+    return result
+
+
+@app.post("/diagnose/batch")
+async def diagnose_batch(files: List[UploadFile] = File(...), embedding: Optional[str] = None):
+    """
+    Upload many medical images and get a prediction per image, in upload order
+
+    Images are decoded in parallel and embedded and classified EMBED_BATCH_SIZE
+    at a time. A file that cannot be decoded gets an `error` instead of a
+    prediction and does not fail the rest. `timing_ms` gives the wall time of
+    each stage for the whole request.
+    """
+    check_embedding_format(embedding)
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} images per request")
+
+    results = []
+    data = []
+    for index, file in enumerate(files):
+        content = await file.read()
+        results.append({"index": index, "filename": file.filename})
+        if not is_image(file.filename, file.content_type):
+            results[index]["error"] = "File must be an image (JPEG, PNG, BMP) or TIFF format"
+        elif len(content) > MAX_IMAGE_BYTES:
+            results[index]["error"] = f"Image is larger than {MAX_IMAGE_BYTES} bytes"
+        else:
+            data.append((index, content))
+
+    started = time.perf_counter()
+    try:
+        decoded = await decoder.map(try_load_image, [content for _, content in data])
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    images = []
+    for (index, _), (image, error) in zip(data, decoded):
+        if error is None:
+            images.append((index, image))
+        else:
+            results[index]["error"] = error
+    decoded_at = time.perf_counter()
+
+    timing = {"decode": decoded_at - started, "queue": 0.0, "embed": 0.0, "classify": 0.0}
+    for start in range(0, len(images), EMBED_BATCH_SIZE):
+        chunk = images[start:start + EMBED_BATCH_SIZE]
+        try:
+            chunk_results, chunk_timing = await model_thread.run(pipeline.run, np.stack([image for _, image in chunk]))
+        except ExecutorBusy as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            for index, _ in chunk:
+                results[index]["error"] = f"Error during diagnosis: {str(e)}"
+            continue
+        for stage, seconds in chunk_timing.items():
+            timing[stage] += seconds
+        for (index, _), (vector, prediction, confidence) in zip(chunk, chunk_results):
+            results[index].update(prediction=prediction, confidence=confidence)
+            if embedding is not None:
+                results[index].update(vector_fields(vector, embedding))
+    finished = time.perf_counter()
+
+    timing["queue"] = max(0.0, finished - decoded_at - timing["embed"] - timing["classify"])
+    pipeline.record(timing)
+    return {
+        "model_version": pipeline.versions,
+        "count": len(results),
+        "failed": sum("error" in result for result in results),
+        "results": results,
+        "timing_ms": milliseconds({**timing, "total": finished - started}),
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Batching, executor and per-stage counters of the pipeline"""
+    return {
+        "pipeline": pipeline.stats(),
+        "scheduler": scheduler.stats(),
+        "decoder": decoder.stats(),
+        "model": model_thread.stats(),
+        "inference": pipeline.infer.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    body = "".join([
+        pipeline.render_prometheus(),
+        scheduler.render_prometheus(),
+        render_executors_prometheus([decoder, model_thread]),
+        pipeline.infer.render_prometheus(),
+        # Tensor, forward and postprocess time of the classifier
+        metrics.render_prometheus(),
+    ])
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/")
+async def root():
+    return {"message": "Welcome to Medical Image Diagnosis Pipeline API. Use /diagnose endpoint to upload images."}
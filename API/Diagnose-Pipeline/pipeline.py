@@ -0,0 +1,153 @@
+"""Path Foundation and the cancer classifier in one process
+
+The embedding service and the Diagnosing-API are imported as libraries from
+their own directories, so preprocessing, runtimes, the classifier backends and
+their settings stay defined in one place. The (N, 384) float32 array Path
+Foundation returns goes straight into `classify_batch`, which wraps it as a
+torch tensor without copying: no JSON, no HTTP hop between the two models.
+"""
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Directories of the two services, siblings of this one in the repo and the image
+EMBEDDING_SERVICE_DIR = os.getenv("EMBEDDING_SERVICE_DIR", os.path.join(HERE, "..", "EmbeddingGenerator-Medical"))
+CLASSIFIER_SERVICE_DIR = os.getenv("CLASSIFIER_SERVICE_DIR", os.path.join(HERE, "..", "Diagnosing-API"))
+
+# Appended, so this directory's own main.py still wins over theirs
+for _service_dir in (EMBEDDING_SERVICE_DIR, CLASSIFIER_SERVICE_DIR):
+    _service_dir = os.path.abspath(_service_dir)
+    if _service_dir not in sys.path:
+        sys.path.append(_service_dir)
+
+import numpy as np  # noqa: E402
+
+from config import (  # noqa: E402
+    MODEL_BATCH_BUCKETS, XLA_JIT_COMPILE, EMBEDDING_RUNTIME, RUNTIME_ARTIFACTS_DIR, RUNTIME_INT8,
+    RUNTIME_NUM_THREADS, MODEL_VERSION, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS,
+)
+from constants import (  # noqa: E402
+    MODEL_PATH, MODEL_CACHE_DIR, MODEL_VARIANTS, STUDENT_MODEL_PATH, INFERENCE_BACKEND, ARTIFACTS_DIR, PRECISION,
+    TORCH_NUM_THREADS, TORCH_INTEROP_THREADS,
+)
+from executors import configure_tf_threads  # noqa: E402
+from executor import configure_torch_threads  # noqa: E402
+from model import EMBEDDING_DIM, backend_version, classify_batch, load_backend, weights_path  # noqa: E402
+from runtime import load_runtime  # noqa: E402
+
+# Stages timed for every diagnosis, in the order they run
+STAGES = ("decode", "queue", "embed", "classify")
+
+
+class DiagnosisPipeline:
+    """Embed and classify a batch of preprocessed images in one call
+
+    `run` takes uint8 (N, 224, 224, 3) images, as returned by
+    `preprocessing.load_image`, and returns one (embedding, prediction,
+    confidence) per image together with the time the batch spent in each
+    model. Call it from a single thread, it runs both models back to back.
+    Stage times of whole requests, decode and queue included, are added with
+    `record` and averaged per request by `stats`.
+    """
+
+    def __init__(self, infer, classifier, embedding_version, classifier_version):
+        self.infer = infer
+        self.classifier = classifier
+        self.versions = {"embedding": embedding_version, "classifier": classifier_version}
+        self._lock = threading.Lock()
+        self._seconds = dict.fromkeys(STAGES, 0.0)
+        self.batches = 0
+        self.images = 0
+        self.requests = 0
+
+    def run(self, images):
+        started = time.perf_counter()
+        embeddings = self.infer.embed(images)
+        embedded = time.perf_counter()
+        results = classify_batch(self.classifier, embeddings)
+        finished = time.perf_counter()
+        with self._lock:
+            self.batches += 1
+            self.images += len(images)
+        timing = {"embed": embedded - started, "classify": finished - embedded}
+        return [(embedding, prediction, confidence) for embedding, (prediction, confidence) in zip(embeddings, results)], timing
+
+    def warm_up(self):
+        """Classify every embedding bucket size once, the runtime warmed its own buckets while loading"""
+        for bucket in self.infer.buckets:
+            classify_batch(self.classifier, np.zeros((bucket, EMBEDDING_DIM), dtype=np.float32))
+
+    def record(self, timing):
+        """Add the stage times of a finished request"""
+        with self._lock:
+            self.requests += 1
+            for stage, seconds in timing.items():
+                self._seconds[stage] += seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                "versions": self.versions,
+                "batches": self.batches,
+                "images": self.images,
+                "requests": self.requests,
+                "mean_batch_size": self.images / self.batches if self.batches else None,
+                "stage_seconds": dict(self._seconds),
+                "mean_stage_ms": {
+                    stage: seconds * 1000.0 / self.requests if self.requests else None
+                    for stage, seconds in self._seconds.items()
+                },
+            }
+
+    def render_prometheus(self, prefix="diagnose"):
+        """Images, model calls and per-stage time in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = [
+            f"# HELP {prefix}_images_total Images embedded and classified",
+            f"# TYPE {prefix}_images_total counter",
+            f"{prefix}_images_total {stats['images']}",
+            f"# HELP {prefix}_batches_total Embed-and-classify calls",
+            f"# TYPE {prefix}_batches_total counter",
+            f"{prefix}_batches_total {stats['batches']}",
+            f"# HELP {prefix}_requests_total Diagnosis requests answered",
+            f"# TYPE {prefix}_requests_total counter",
+            f"{prefix}_requests_total {stats['requests']}",
+            f"# HELP {prefix}_stage_seconds_total Time requests spent in each stage",
+            f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+        lines.extend(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds}' for stage, seconds in stats["stage_seconds"].items())
+        return "\n".join(lines) + "\n"
+
+
+def load_pipeline():
+    """Load Path Foundation and the default classifier variant with each service's own settings
+
+    The embedding side reads config.py of the embedding service, the
+    classifier side constants.py of the Diagnosing-API, so both are configured
+    with the same environment variables as when they run apart.
+    """
+    # Both before their runtimes start, which fixes the thread pools
+    if EMBEDDING_RUNTIME == "tensorflow":
+        configure_tf_threads(TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS)
+    configure_torch_threads(TORCH_NUM_THREADS, TORCH_INTEROP_THREADS)
+
+    infer = load_runtime(
+        EMBEDDING_RUNTIME, MODEL_BATCH_BUCKETS, jit_compile=XLA_JIT_COMPILE,
+        artifacts_dir=RUNTIME_ARTIFACTS_DIR, int8=RUNTIME_INT8, num_threads=RUNTIME_NUM_THREADS,
+    )
+
+    variant = MODEL_VARIANTS[0]
+    print(f"Loading {variant} classifier...")
+    configured_path = {"teacher": MODEL_PATH, "student": STUDENT_MODEL_PATH}.get(variant)
+    model_path = weights_path(configured_path, MODEL_CACHE_DIR, variant) if INFERENCE_BACKEND == "eager" else None
+    classifier = load_backend(INFERENCE_BACKEND, model_path, ARTIFACTS_DIR, num_threads=TORCH_NUM_THREADS,
+                              precision=PRECISION, variant=variant)
+    classifier_version = backend_version(INFERENCE_BACKEND, model_path, ARTIFACTS_DIR, precision=PRECISION,
+                                         variant=variant)
+
+    pipeline = DiagnosisPipeline(infer, classifier, f"{MODEL_VERSION}/{infer.version}", classifier_version)
+    pipeline.warm_up()
+    print("Classifier loaded!")
+    return pipeline
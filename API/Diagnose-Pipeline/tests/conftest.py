@@ -0,0 +1,58 @@
+"""The pipeline under test runs a stand-in for Path Foundation and a real classifier on random weights
+
+The app is imported with `load_pipeline` replaced, so it starts without
+TensorFlow, the Path Foundation weights or network.
+"""
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+os.environ.update({"DECODE_WORKERS": "1", "EMBED_BATCH_SIZE": "4", "MAX_IMAGE_BYTES": str(2**20)})
+
+# Puts both services on sys.path, so the tests can import their modules too
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+import torch  # noqa: E402
+
+import pipeline  # noqa: E402
+from model import EMBEDDING_DIM, build_variant  # noqa: E402
+
+
+class FakeRuntime:
+    """Embeds an image as its first 384 pixel values, scaled to [0, 1]"""
+    buckets = [1, 2, 4]
+    version = "fake"
+
+    def __init__(self):
+        self.calls = []
+
+    def embed(self, images):
+        self.calls.append(len(images))
+        return images.reshape(len(images), -1)[:, :EMBEDDING_DIM].astype(np.float32) / 255.0
+
+    def stats(self):
+        return {"calls": len(self.calls)}
+
+    def render_prometheus(self):
+        return ""
+
+
+def make_pipeline():
+    torch.manual_seed(0)
+    return pipeline.DiagnosisPipeline(FakeRuntime(), build_variant("teacher").eval(), "path-foundation/fake", "test-teacher")
+
+
+@pytest.fixture(scope="session")
+def app():
+    pipeline.load_pipeline = make_pipeline
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as client:
+        yield client
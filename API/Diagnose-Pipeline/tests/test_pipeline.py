@@ -0,0 +1,101 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import make_pipeline
+from model import EMBEDDING_DIM, classify_batch
+from pipeline import STAGES
+
+
+@pytest.fixture
+def pipeline():
+    return make_pipeline()
+
+
+def images(n):
+    return np.random.default_rng(0).integers(0, 256, (n, 224, 224, 3), dtype=np.uint8)
+
+
+def test_run_embeds_and_classifies_in_one_call(pipeline):
+    batch = images(3)
+    results, timing = pipeline.run(batch)
+
+    assert pipeline.infer.calls == [3]
+    assert set(timing) == {"embed", "classify"}
+    expected = classify_batch(pipeline.classifier, pipeline.infer.embed(batch))
+    for (embedding, prediction, confidence), (expected_prediction, expected_confidence) in zip(results, expected):
+        assert embedding.shape == (EMBEDDING_DIM,)
+        assert prediction == expected_prediction
+        assert confidence == pytest.approx(expected_confidence, abs=1e-6)
+
+
+def test_warm_up_classifies_every_bucket(pipeline):
+    pipeline.warm_up()
+    assert pipeline.stats()["batches"] == 0
+
+
+def test_stats_average_recorded_stage_times_per_request(pipeline):
+    for size in (1, 3):
+        _, timing = pipeline.run(images(size))
+        pipeline.record({"decode": 0.01, "queue": 0.02, **timing})
+
+    stats = pipeline.stats()
+    assert stats["batches"] == 2 and stats["images"] == 4 and stats["requests"] == 2
+    assert stats["mean_batch_size"] == 2
+    assert stats["mean_stage_ms"]["decode"] == pytest.approx(10.0)
+    assert set(stats["stage_seconds"]) == set(STAGES)
+    assert stats["versions"] == {"embedding": "path-foundation/fake", "classifier": "test-teacher"}
+
+    text = pipeline.render_prometheus()
+    assert "diagnose_images_total 4" in text
+    assert 'diagnose_stage_seconds_total{stage="queue"} 0.04' in text
+
+
+def png(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (300, 300, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_diagnose_endpoint_returns_prediction_and_stage_timing(client):
+    response = client.post("/diagnose?embedding=json", files={"file": ("patch.png", png(0), "image/png")})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["prediction"] in ("positive", "negative")
+    assert set(body["timing_ms"]) == set(STAGES) | {"total"}
+    assert body["model_version"] == {"embedding": "path-foundation/fake", "classifier": "test-teacher"}
+    assert len(body["embedding"]) == EMBEDDING_DIM
+
+
+def test_diagnose_endpoint_rejects_bad_uploads(client):
+    response = client.post("/diagnose", files={"file": ("notes.txt", b"text", "text/plain")})
+    assert response.status_code == 400
+    response = client.post("/diagnose", files={"file": ("big.png", b"\0" * (2**20 + 1), "image/png")})
+    assert response.status_code == 413
+    response = client.post("/diagnose?embedding=xml", files={"file": ("patch.png", png(0), "image/png")})
+    assert response.status_code == 406
+
+
+def test_diagnose_batch_keeps_upload_order_and_reports_failures(client):
+    files = [("files", (f"patch{i}.png", png(i), "image/png")) for i in range(5)]
+    files.insert(2, ("files", ("broken.png", b"not a png", "image/png")))
+    response = client.post("/diagnose/batch", files=files)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["count"] == 6 and body["failed"] == 1
+    assert [result["index"] for result in body["results"]] == list(range(6))
+    assert "error" in body["results"][2]
+    assert all("prediction" in result for i, result in enumerate(body["results"]) if i != 2)
+
+    single = client.post("/diagnose", files={"file": ("patch.png", png(0), "image/png")}).json()
+    assert body["results"][0]["prediction"] == single["prediction"]
+    assert body["results"][0]["confidence"] == pytest.approx(single["confidence"], abs=1e-5)
+
+
+def test_metrics_endpoint_includes_pipeline_and_classifier(client):
+    text = client.get("/metrics").text
+    assert "# TYPE diagnose_images_total counter" in text
+    assert "diagnose_stage_seconds_total" in text
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import numpy as np
+
+import metrics
+from executor import ExecutorSaturated
+
+batch_size_histogram = metrics.histogram(
+    "classify_batch_size",
+    [1, 2, 4, 8, 16, 32, 64, 128, 256],
+    "Number of /classify requests coalesced into one forward pass",
+)
+queue_wait_histogram = metrics.histogram(
+    "classify_queue_wait_seconds",
+    [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0],
+    "Time a /classify request waited before its batch started",
+)
+last_batch_size_gauge = metrics.gauge("classify_last_batch_size", "Size of the most recently dispatched batch")
+
+
+class MicroBatcher:
+    """Coalesce concurrent single-embedding requests into batched forward passes
+
+    Requests are queued by `submit`. A background task takes the oldest request,
+    keeps collecting until either `max_batch_size` requests are pending or
+    `window_ms` has passed since the oldest one arrived, awaits the coroutine
+    `predict_batch` once on the stacked embeddings and resolves every caller
+    with its own result. While `max_concurrent_batches` batches are already
+    running, new requests keep accumulating into the next batch.
+
+    At most `max_queue_size` requests may be waiting or in a running batch,
+    beyond that `submit` raises ExecutorSaturated straight away.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=32, window_ms=5.0, max_concurrent_batches=1, max_queue_size=64):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_concurrent_batches = max(1, max_concurrent_batches)
+        self.max_queue_size = max(1, max_queue_size)
+        # Requests admitted by submit and not yet dropped or answered
+        self.pending = 0
+        self._queue = None
+        self._task = None
+        self._inflight = set()
+        self._dispatch_slots = None
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._dispatch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def queue_depth(self):
+        """Requests waiting to be picked into a batch"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, embedding):
+        """Queue one embedding of shape (384,) and wait for its (prediction, confidence)"""
+        if self.pending >= self.max_queue_size:
+            raise ExecutorSaturated(f"Batching queue is full ({self.max_queue_size} pending)")
+        self.pending += 1
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((embedding, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.window
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already waiting before sleeping on the window
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._dispatch_slots.acquire()
+            batch = await self._collect()
+            # Callers that went away (e.g. client disconnect) are not worth computing
+            live = [item for item in batch if not item[1].done()]
+            self.pending -= len(batch) - len(live)
+            batch = live
+            if not batch:
+                self._dispatch_slots.release()
+                continue
+
+            started = time.perf_counter()
+            batch_size_histogram.observe(len(batch))
+            last_batch_size_gauge.set(len(batch))
+            for _, _, enqueued in batch:
+                queue_wait_histogram.observe(started - enqueued)
+
+            # Dispatch without waiting so the next batch can form while this one runs
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            results = await self.predict_batch(np.stack([embedding for embedding, _, _ in batch]))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.pending -= len(batch)
+            self._dispatch_slots.release()
@@ -0,0 +1,199 @@
+"""Reproducible offline benchmark of classify() throughput
+
+Sweeps backend, batch size and torch thread count. Each configuration runs in
+its own subprocess so its peak RSS is measured in isolation. Results are JSON,
+so runs can be diffed in CI. No network is needed: without --weights a random
+state dict of the right shape is used, and TorchScript / ONNX artifacts are
+exported from it into a temporary directory.
+
+With --http the same sweep also drives the FastAPI app in-process (no socket)
+through /classify and /classify_batch, so framework overhead can be read off
+against the model-only numbers.
+
+    python benchmarks/classifier.py --backends eager onnx --batch-sizes 1 8 32 \\
+        --threads 1 4 --http --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from common import SERVICE_DIR, build_model, random_embeddings, percentiles, peak_rss_mb
+from model import (
+    BACKENDS, artifact_filename, classify_batch, export_onnx, export_torchscript, load_backend,
+)
+
+
+def time_calls(call, warmup, repeats):
+    for _ in range(warmup):
+        call()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples, batch_size):
+    return {
+        **percentiles(samples),
+        "mean_ms": round(float(np.mean(samples)) * 1000.0, 3),
+        "throughput_per_s": round(batch_size / float(np.mean(samples)), 2),
+    }
+
+
+def run_model(config):
+    torch.set_num_threads(config["threads"])
+    model = load_backend(config["backend"], config["weights"], config["artifacts"], num_threads=config["threads"],
+                         precision=config["precision"])
+    embeddings = random_embeddings(config["batch_size"])
+    samples = time_calls(lambda: classify_batch(model, embeddings), config["warmup"], config["repeats"])
+    return summarize(samples, config["batch_size"])
+
+
+def run_http(config):
+    """Drive the app in-process through httpx's ASGI transport, with no network in between"""
+    import asyncio
+    import httpx
+
+    os.environ.update({
+        "MODEL_PATH": config["weights"],
+        "ARTIFACTS_DIR": config["artifacts"],
+        "INFERENCE_BACKEND": config["backend"],
+        "PRECISION": config["precision"],
+        "TORCH_NUM_THREADS": str(config["threads"]),
+        # Measure the model every time, not the prediction cache
+        "PREDICTION_CACHE_BYTES": "0",
+        "STREAM_THRESHOLD": str(max(config["batch_size"], 256)),
+        "CLASSIFY_CHUNK_SIZE": str(config["batch_size"]),
+    })
+    # constants was already imported through model.py, re-read it before main picks its values up
+    import importlib
+    import constants
+    importlib.reload(constants)
+    import main
+
+    embeddings = random_embeddings(config["batch_size"])
+    if config["batch_size"] == 1:
+        path, body = "/classify", embeddings[0].tobytes()
+    else:
+        path, body = "/classify_batch", embeddings.tobytes()
+    headers = {"content-type": "application/octet-stream"}
+
+    async def drive():
+        async with main.app.router.lifespan_context(main.app):
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                while (ready := await client.get("/ready")).status_code != 200:
+                    if ready.json()["status"] == "failed":
+                        raise RuntimeError(ready.json()["error"])
+                    await asyncio.sleep(0.1)
+                for _ in range(config["warmup"]):
+                    (await client.post(path, content=body, headers=headers)).raise_for_status()
+                samples = []
+                for _ in range(config["repeats"]):
+                    start = time.perf_counter()
+                    (await client.post(path, content=body, headers=headers)).raise_for_status()
+                    samples.append(time.perf_counter() - start)
+                return samples
+
+    return summarize(asyncio.run(drive()), config["batch_size"])
+
+
+def run_one(config):
+    runner = run_http if config["mode"] == "http" else run_model
+    try:
+        result = runner(config)
+    except Exception as e:
+        result = {"error": f"{type(e).__name__}: {e}"}
+    return {**{k: config[k] for k in ("mode", "backend", "precision", "batch_size", "threads")},
+            **result, "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def export_artifacts(weights, artifacts, backends):
+    model = build_model(weights)
+    if "torchscript" in backends:
+        export_torchscript(model, os.path.join(artifacts, artifact_filename("torchscript")))
+    if "onnx" in backends:
+        export_onnx(model, os.path.join(artifacts, artifact_filename("onnx")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", help="Local state dict, random weights are used when omitted")
+    parser.add_argument("--artifacts", help="Directory with exported artifacts, exported to a temp dir when omitted")
+    parser.add_argument("--backends", nargs="+", default=["eager"], choices=BACKENDS)
+    parser.add_argument("--precision", default="fp32")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--threads", type=int, nargs="+", default=[os.cpu_count() or 1])
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--http", action="store_true", help="Also measure through the FastAPI app in-process")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        weights = args.weights
+        if weights is None:
+            weights = os.path.join(tmp, "random_weights.pth")
+            torch.save(build_model().state_dict(), weights)
+        artifacts = args.artifacts
+        if artifacts is None:
+            artifacts = tmp
+            export_artifacts(weights, artifacts, args.backends)
+
+        modes = ["model", "http"] if args.http else ["model"]
+        results = []
+        for mode in modes:
+            for backend in args.backends:
+                for threads in args.threads:
+                    for batch_size in args.batch_sizes:
+                        config = {
+                            "mode": mode, "backend": backend, "precision": args.precision,
+                            "batch_size": batch_size, "threads": threads,
+                            "weights": weights, "artifacts": artifacts,
+                            "warmup": args.warmup, "repeats": args.repeats,
+                        }
+                        # A fresh process per configuration keeps peak RSS and thread settings independent
+                        completed = subprocess.run(
+                            [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(config)],
+                            cwd=SERVICE_DIR, capture_output=True, text=True,
+                        )
+                        lines = completed.stdout.strip().splitlines()
+                        if completed.returncode != 0 or not lines:
+                            results.append({**config, "error": completed.stderr.strip().splitlines()[-1:]})
+                        else:
+                            results.append(json.loads(lines[-1]))
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "cpu_count": os.cpu_count(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
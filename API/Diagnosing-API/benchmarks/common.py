@@ -0,0 +1,61 @@
+"""Shared helpers for the offline benchmarks in this directory"""
+import os
+import sys
+
+import numpy as np
+import torch
+
+# Benchmarks are run as scripts from anywhere, the service modules live one level up
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from model import SelfSupervisedCancerModel, EMBEDDING_DIM  # noqa: E402
+
+
+def build_model(weights=None, seed=0):
+    """Build the classifier from a local state dict, or with random weights of the same shape"""
+    torch.manual_seed(seed)
+    model = SelfSupervisedCancerModel(num_classes=2)
+    if weights:
+        model.load_state_dict(torch.load(weights, map_location="cpu", weights_only=True))
+    return model.eval()
+
+
+def random_embeddings(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, EMBEDDING_DIM), dtype=np.float32)
+
+
+def percentiles(samples, qs=(50, 90, 99)):
+    """Latency percentiles in milliseconds from samples in seconds"""
+    if not samples:
+        return {}
+    values = np.percentile(np.asarray(samples) * 1000.0, qs)
+    return {f"p{q}_ms": round(float(v), 3) for q, v in zip(qs, values)}
+
+
+def load_embeddings(paths, limit=None):
+    """Stack embeddings from .npy files or preprocessing HDF5 shards (`embeddings` dataset)"""
+    arrays, total = [], 0
+    for path in paths:
+        if path.endswith(".npy"):
+            array = np.load(path, mmap_mode="r")
+        else:
+            import h5py
+
+            with h5py.File(path, "r") as h5f:
+                array = h5f["embeddings"][: None if limit is None else limit - total]
+        if limit is not None:
+            array = array[: limit - total]
+        arrays.append(np.asarray(array, dtype=np.float32))
+        total += len(arrays[-1])
+        if limit is not None and total >= limit:
+            break
+    return np.concatenate(arrays).reshape(-1, EMBEDDING_DIM)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
@@ -0,0 +1,91 @@
+"""Event-loop responsiveness while /classify-style inference is under load
+
+Compares running `classify_batch` inline in the coroutine (how `classify_data`
+used to work) against handing it to the InferenceExecutor. A probe task sleeps
+for a fixed tick and records how late it wakes up, which is the delay every
+other connection on the worker, health checks included, would see.
+
+    python benchmarks/event_loop.py --concurrency 8 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from common import build_model, random_embeddings, percentiles
+from executor import InferenceExecutor, ExecutorSaturated, configure_torch_threads
+from model import classify_batch
+
+
+async def probe(lags, tick, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(tick)
+        lags.append(time.perf_counter() - start - tick)
+
+
+async def client(run, embeddings, latencies, rejected, stop):
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            await run(embeddings[i % len(embeddings)][None, :])
+            latencies.append(time.perf_counter() - start)
+        except ExecutorSaturated:
+            rejected.append(1)
+        i += 1
+        # A new request arriving is a point where the loop gets control back
+        await asyncio.sleep(0)
+
+
+async def measure(mode, model, args):
+    embeddings = random_embeddings(64)
+    executor = InferenceExecutor(max_workers=args.workers, max_pending=args.queue_size)
+
+    async def inline(batch):
+        return classify_batch(model, batch)
+
+    async def offloaded(batch):
+        return await executor.run(classify_batch, model, batch)
+
+    run = inline if mode == "inline" else offloaded
+    lags, latencies, rejected = [], [], []
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(probe(lags, args.tick / 1000.0, stop))]
+    tasks += [
+        asyncio.create_task(client(run, embeddings, latencies, rejected, stop))
+        for _ in range(args.concurrency)
+    ]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    executor.shutdown()
+
+    return {
+        "mode": mode,
+        "probe_lag": {**percentiles(lags), "max_ms": round(max(lags) * 1000.0, 3) if lags else None},
+        "request_latency": percentiles(latencies),
+        "completed": len(latencies),
+        "rejected_503": len(rejected),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", help="Local state dict, random weights are used when omitted")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per mode")
+    parser.add_argument("--tick", type=float, default=10.0, help="Probe interval in milliseconds")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    configure_torch_threads(args.threads)
+    model = build_model(args.weights)
+    results = [asyncio.run(measure(mode, model, args)) for mode in ("inline", "executor")]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Latency and recall of the /neighbors index, exact versus IVF
+
+Builds an index in a temporary directory, then times top-k queries with an
+exact scan and with IVF at several `nprobe` values. Recall is the share of the
+exact top-k that IVF also returns. Without --embeddings the vectors are drawn
+around random cluster centres, which is closer to real embeddings than plain
+noise, where no partitioning can help.
+
+    python benchmarks/neighbors.py --count 1000000 --ivf-lists 1024 --nprobe 8 16 32
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from common import load_embeddings, percentiles
+from model import EMBEDDING_DIM
+from neighbors import NeighborIndex, build_index
+
+
+def clustered_embeddings(n, clusters=2000, spread=0.5, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, EMBEDDING_DIM), dtype=np.float32)
+    vectors = np.empty((n, EMBEDDING_DIM), dtype=np.float32)
+    for start in range(0, n, 100_000):
+        stop = min(start + 100_000, n)
+        vectors[start:stop] = centres[rng.integers(0, clusters, stop - start)]
+        vectors[start:stop] += spread * rng.standard_normal((stop - start, EMBEDDING_DIM), dtype=np.float32)
+    return vectors
+
+
+def time_queries(index, queries, k, nprobe):
+    results, samples = [], []
+    index.search(queries[0], k, nprobe)
+    for query in queries:
+        start = time.perf_counter()
+        results.append({hit["file_id"] for hit in index.search(query, k, nprobe)})
+        samples.append(time.perf_counter() - start)
+    return results, samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", nargs="+", help=".npy or .h5 files to index instead of synthetic vectors")
+    parser.add_argument("--count", type=int, default=1_000_000)
+    parser.add_argument("--ivf-lists", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, torch's default when 0")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.embeddings:
+        vectors = load_embeddings(args.embeddings, args.count)
+    else:
+        vectors = clustered_embeddings(args.count)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        build_index(vectors, [str(i) for i in range(len(vectors))], np.zeros(len(vectors)), tmp,
+                    ivf_lists=args.ivf_lists)
+        build_s = time.perf_counter() - started
+        index = NeighborIndex(tmp)
+
+        exact, samples = time_queries(index, queries, args.k, 0)
+        report = {"vectors": len(vectors), "ivf_lists": args.ivf_lists, "k": args.k, "build_s": round(build_s, 1),
+                  "exact": percentiles(samples)}
+        if args.ivf_lists:
+            for nprobe in args.nprobe:
+                found, samples = time_queries(index, queries, args.k, nprobe)
+                recall = np.mean([len(a & b) / len(a) for a, b in zip(exact, found)])
+                report[f"ivf_nprobe_{nprobe}"] = {**percentiles(samples), "recall": round(float(recall), 4)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Latency, memory and agreement with fp32 for each precision mode
+
+Every mode in model.PRECISIONS is applied to a fresh copy of the classifier
+and run over the same held-out embeddings. Agreement is measured against the
+fp32 model: the flip rate is the share of embeddings whose predicted class
+changes, the confidence delta is the change in positive-class probability,
+both over the rows the mode returned finite. bf16 is measured raw, without
+the fp32 fallback the service uses, and `non_finite_rate` is the share of rows
+it returned as NaN or inf.
+The fp32 reference and each mode run in their own process, so peak RSS is
+that of the mode alone.
+
+    python benchmarks/precision.py --weights cancer_detector_model.pth \
+        --embeddings embeddings/batch_00042.h5 --limit 2000
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from common import build_model, load_embeddings, random_embeddings, percentiles, peak_rss_mb
+from model import PRECISIONS, EMBEDDING_DIM, AutocastModel, apply_precision
+
+
+def serialized_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def positive_probs(model, embeddings, batch_size):
+    probs = []
+    with torch.no_grad():
+        for start in range(0, len(embeddings), batch_size):
+            x = torch.from_numpy(embeddings[start:start + batch_size]).view(-1, 1, EMBEDDING_DIM, 1)
+            probs.append(torch.softmax(model(x), dim=1)[:, 1])
+    return torch.cat(probs).numpy()
+
+
+def latency(model, batch_size, repeats):
+    x = torch.from_numpy(random_embeddings(batch_size, seed=1)).view(-1, 1, EMBEDDING_DIM, 1)
+    samples = []
+    with torch.no_grad():
+        model(x)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model(x)
+            samples.append(time.perf_counter() - start)
+    return percentiles(samples)
+
+
+def run_one(mode, args, reference_path):
+    """Benchmark one precision mode against the fp32 probabilities saved at `reference_path`"""
+    embeddings = load_embeddings(args.embeddings, args.limit) if args.embeddings else random_embeddings(args.limit)
+    reference = np.load(reference_path)
+    model = apply_precision(build_model(args.weights), mode)
+    if isinstance(model, AutocastModel):
+        # Measure what bf16 itself returns, not the fp32 rerun the service falls back to
+        model.fallback = False
+    probs = positive_probs(model, embeddings, 64)
+    finite = np.isfinite(probs)
+    delta = np.abs(probs[finite] - reference[finite])
+    return {
+        "precision": mode,
+        "samples": len(embeddings),
+        "non_finite_rate": float(np.mean(~finite)),
+        "flip_rate": float(np.mean((probs[finite] >= 0.5) != (reference[finite] >= 0.5))) if finite.any() else None,
+        "confidence_delta_mean": float(delta.mean()) if finite.any() else None,
+        "confidence_delta_max": float(delta.max()) if finite.any() else None,
+        "weights_mb": round(serialized_mb(model), 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "latency": {str(bs): latency(model, bs, args.repeats) for bs in args.batch_sizes},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", help="Local state dict, random weights are used when omitted")
+    parser.add_argument("--embeddings", nargs="*", default=[], help=".npy or .h5 files with held-out embeddings")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--modes", nargs="+", default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--write-reference", help=argparse.SUPPRESS)
+    args, _ = parser.parse_known_args()
+
+    if args.write_reference:
+        embeddings = load_embeddings(args.embeddings, args.limit) if args.embeddings else random_embeddings(args.limit)
+        np.save(args.write_reference, positive_probs(build_model(args.weights), embeddings, 64))
+        return
+
+    if args.run_one:
+        config = json.loads(args.run_one)
+        print(json.dumps(run_one(config["mode"], args, config["reference"])))
+        return
+
+    # The children get the same arguments, the parent never loads a model
+    child = [sys.executable, os.path.abspath(__file__)] + sys.argv[1:]
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = os.path.join(tmp, "reference.npy")
+        subprocess.run(child + ["--write-reference", reference], check=True)
+
+        report = []
+        for mode in args.modes:
+            # A fresh process per mode: peak RSS only grows within a process, and
+            # kernels or caches left by one mode cannot affect the next
+            completed = subprocess.run(
+                child + ["--run-one", json.dumps({"mode": mode, "reference": reference})], capture_output=True, text=True,
+            )
+            lines = completed.stdout.strip().splitlines()
+            if completed.returncode != 0 or not lines:
+                report.append({"precision": mode, "error": completed.stderr.strip().splitlines()[-1:]})
+            else:
+                report.append(json.loads(lines[-1]))
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
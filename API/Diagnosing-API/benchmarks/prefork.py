@@ -0,0 +1,150 @@
+"""Memory and throughput of serve.py across worker counts
+
+For each worker count the pre-fork server is started on a local port, then
+memory is read from /proc (RSS and PSS per process, so shared weight pages are
+only counted once in the PSS total) and /classify is driven by a pool of
+client threads for a fixed duration.
+
+    python benchmarks/prefork.py --workers 1 2 4 8 --duration 15
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from common import SERVICE_DIR, build_model, random_embeddings, percentiles
+
+
+def read_memory_kb(pid):
+    """RSS, PSS and private (unshared) memory of one process from smaps_rollup"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def ready_pid(url):
+    """PID of the worker that answered /ready, or None while it is not ready"""
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return json.load(response)["pid"]
+    except OSError:
+        return None
+
+
+def wait_ready(url, server_pid, workers, timeout=300):
+    """Poll /ready until every worker process of the server has answered ready
+
+    Each connection lands on whichever worker accepts it, so /ready is asked in
+    bursts of parallel requests until the PIDs that reported ready cover all
+    current children of `server_pid`.
+    """
+    deadline = time.time() + timeout
+    ready, pids = set(), set()
+    with ThreadPoolExecutor(max_workers=workers * 4) as pool:
+        while time.time() < deadline:
+            ready.update(pid for pid in pool.map(ready_pid, [url] * workers * 4) if pid is not None)
+            try:
+                pids = set(child_pids(server_pid))
+            except OSError:
+                pids = set()
+            if len(pids) == workers and pids <= ready:
+                return
+            time.sleep(0.2)
+    raise TimeoutError(f"{url}: workers {sorted(pids - ready)} did not report ready within {timeout}s")
+
+
+def post_classify(url, body):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def drive(url, concurrency, duration):
+    bodies = [json.dumps({"features": row.tolist()}).encode() for row in random_embeddings(64)]
+    deadline = time.time() + duration
+
+    def client(i):
+        latencies = []
+        while time.time() < deadline:
+            latencies.append(post_classify(url, bodies[(i + len(latencies)) % len(bodies)]))
+        return latencies
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = [lat for result in pool.map(client, range(concurrency)) for lat in result]
+    return {"requests": len(latencies), "throughput_rps": round(len(latencies) / duration, 2), **percentiles(latencies)}
+
+
+def measure(workers, weights, args):
+    # Measure pre-fork inference, not hits of the prediction cache on the repeated bodies
+    env = {**os.environ, "MODEL_PATH": weights, "PREDICTION_CACHE_BYTES": "0"}
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(args.port), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env=env,
+    )
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base + "/ready", server.pid, workers)
+        # One warm-up request per worker so every process has touched the weights
+        for _ in range(workers * 2):
+            post_classify(base + "/classify", json.dumps({"features": random_embeddings(1)[0].tolist()}).encode())
+
+        processes = [server.pid] + child_pids(server.pid)
+        memory = {pid: read_memory_kb(pid) for pid in processes}
+        throughput = drive(base + "/classify", args.concurrency or workers * 4, args.duration)
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+    worker_memory = [memory[pid] for pid in processes[1:]]
+    return {
+        "workers": workers,
+        "total_pss_mb": round(sum(m["pss_kb"] for m in memory.values()) / 1024, 1),
+        "parent_rss_mb": round(memory[server.pid]["rss_kb"] / 1024, 1),
+        "worker_rss_mb": [round(m["rss_kb"] / 1024, 1) for m in worker_memory],
+        "worker_private_mb": [round(m["private_kb"] / 1024, 1) for m in worker_memory],
+        **throughput,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--weights", help="Local state dict, random weights are saved to a temp file when omitted")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--concurrency", type=int, default=0, help="Client threads, defaults to 4 per worker")
+    parser.add_argument("--port", type=int, default=7961)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        weights = args.weights
+        if weights is None:
+            weights = os.path.join(tmp, "random_weights.pth")
+            torch.save(build_model().state_dict(), weights)
+        results = [measure(workers, weights, args) for workers in args.workers]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
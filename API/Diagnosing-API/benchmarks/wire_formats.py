@@ -0,0 +1,69 @@
+"""Per-request parse and convert cost of the classifier input formats
+
+Times `wire.decode_features` (body bytes to a float32 (N, 384) array, the
+work done before any tensor is built) for JSON, raw float32 and .npy bodies.
+
+    python benchmarks/wire_formats.py --batch-sizes 1 32 512
+"""
+import argparse
+import io
+import json
+import time
+
+import numpy as np
+from pydantic import BaseModel
+from typing import List
+
+from common import random_embeddings, percentiles
+from wire import JSON, NPY, RAW_FLOAT32, decode_features
+
+
+class BatchInputData(BaseModel):
+    features: List[List[float]]
+
+
+def encode(embeddings, content_type):
+    if content_type == JSON:
+        return json.dumps({"features": embeddings.tolist()}).encode()
+    if content_type == RAW_FLOAT32:
+        return embeddings.astype("<f4").tobytes()
+    buffer = io.BytesIO()
+    np.save(buffer, embeddings.astype("<f4"))
+    return buffer.getvalue()
+
+
+def time_decode(body, content_type, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        decode_features(body, content_type, BatchInputData)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 512])
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    report = []
+    for batch_size in args.batch_sizes:
+        embeddings = random_embeddings(batch_size)
+        for content_type in (JSON, RAW_FLOAT32, NPY):
+            body = encode(embeddings, content_type)
+            samples = time_decode(body, content_type, args.repeats)
+            report.append({
+                "batch_size": batch_size,
+                "content_type": content_type,
+                "body_bytes": len(body),
+                "mean_us": round(float(np.mean(samples)) * 1e6, 2),
+                "us_per_vector": round(float(np.mean(samples)) * 1e6 / batch_size, 3),
+                **percentiles(samples),
+            })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Approximate memory held per cached prediction: the 16-byte key, the
+# (prediction, confidence, created) tuple and the OrderedDict node around them
+ENTRY_BYTES = 240
+
+
+class PredictionCache:
+    """LRU cache of (prediction, confidence) keyed by embedding content
+
+    Keys hash the embedding after rounding it to `decimals` places and casting
+    it to little-endian float32, so re-sent embeddings that only differ by
+    float formatting noise still hit. Entries expire after `ttl` seconds, the
+    least recently used ones are evicted to stay under `max_bytes`, and
+    everything is dropped when the model version changes. With `disk_path` set,
+    entries are also written to a SQLite file so they survive restarts and can
+    be shared by several workers.
+
+    `max_bytes=0` disables the cache.
+    """
+
+    def __init__(self, max_bytes=64 * 2**20, ttl=3600.0, decimals=5, disk_path=None, model_version=""):
+        self.max_entries = max_bytes // ENTRY_BYTES
+        self.ttl = ttl
+        self.decimals = decimals
+        self.model_version = model_version
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.disk_path = disk_path if self.enabled else None
+        self._connection = None
+        self._connection_pid = None
+        self._pruned_at = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @property
+    def _disk(self):
+        """SQLite connection of this process, opened lazily since connections must not cross a fork"""
+        if self.disk_path is None:
+            return None
+        if self._connection_pid != os.getpid():
+            self._connection = sqlite3.connect(self.disk_path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                "version TEXT, key BLOB, prediction TEXT, confidence REAL, created REAL, "
+                "PRIMARY KEY (version, key))"
+            )
+            self._connection_pid = os.getpid()
+            self._prune()
+        return self._connection
+
+    def key(self, embedding):
+        quantized = np.round(np.asarray(embedding, dtype=np.float32), self.decimals).astype("<f4")
+        return hashlib.blake2b(quantized.tobytes(), digest_size=16).digest()
+
+    def set_model_version(self, version):
+        """Drop every cached prediction if `version` differs from the current one"""
+        with self._lock:
+            if version == self.model_version:
+                return
+            self.model_version = version
+            self._entries.clear()
+            self.invalidations += 1
+            if self.disk_path is not None:
+                self._disk.execute("DELETE FROM predictions WHERE version != ?", (version,))
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.disk_path is not None:
+                entry = self._disk_get(key)
+                if entry is not None:
+                    self._insert(key, entry)
+            if entry is not None and now - entry[2] > self.ttl:
+                self._entries.pop(key, None)
+                if self.disk_path is not None:
+                    self._disk.execute("DELETE FROM predictions WHERE version = ? AND key = ?", (self.model_version, key))
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, result, version=None):
+        """Store `result`, unless it was computed by a model `version` that has since been replaced"""
+        if not self.enabled:
+            return
+        entry = (result[0], result[1], time.time())
+        with self._lock:
+            if version is not None and version != self.model_version:
+                return
+            self._insert(key, entry)
+            if self.disk_path is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)",
+                    (self.model_version, key, *entry),
+                )
+                # Rows never looked up again would otherwise stay in the file forever
+                if entry[2] - self._pruned_at > self.ttl:
+                    self._prune()
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune(self):
+        """Delete the rows of every version that are older than `ttl`"""
+        self._pruned_at = time.time()
+        self._connection.execute("DELETE FROM predictions WHERE created < ?", (self._pruned_at - self.ttl,))
+
+    def _disk_get(self, key):
+        row = self._disk.execute(
+            "SELECT prediction, confidence, created FROM predictions WHERE version = ? AND key = ?",
+            (self.model_version, key),
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "model_version": self.model_version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": len(self._entries) * ENTRY_BYTES,
+                "max_bytes": self.max_entries * ENTRY_BYTES,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "disk_path": self.disk_path,
+            }
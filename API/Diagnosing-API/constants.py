@@ -0,0 +1,66 @@
+import os
+
+# Local state dict to serve, skipping the Hugging Face download when set
+MODEL_PATH = os.getenv("MODEL_PATH") or None
+# Checked for the weights before falling back to the Hub, which downloads into it
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "models")
+
+# Classifier variants to load, comma separated: "teacher" (SegResNet) and/or
+# "student" (the MLP written by distill.py). The first one answers requests
+# that do not pick a variant with ?variant=...
+MODEL_VARIANTS = [v.strip() for v in os.getenv("MODEL_VARIANTS", "teacher").split(",") if v.strip()]
+# Local state dict of the student, MODEL_PATH is the teacher's
+STUDENT_MODEL_PATH = os.getenv("STUDENT_MODEL_PATH") or None
+
+# Inference engine: "eager", "torchscript" or "onnx". The last two load the
+# artifacts written by export.py into ARTIFACTS_DIR.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", "artifacts")
+
+# Numeric precision of the eager backend: "fp32", "int8" (dynamic
+# quantization) or "bf16" (autocast). Evaluate with benchmarks/precision.py first.
+PRECISION = os.getenv("PRECISION", "fp32")
+
+# Micro-batching of concurrent /classify requests.
+# A batch is flushed once it holds MAX_BATCH_SIZE requests or the oldest
+# request has waited BATCH_WINDOW_MS milliseconds, whichever comes first.
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "5"))
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "32"))
+
+# /classify_batch runs its embeddings through the model CLASSIFY_CHUNK_SIZE at a
+# time, and streams NDJSON instead of one JSON document above STREAM_THRESHOLD.
+CLASSIFY_CHUNK_SIZE = int(os.getenv("CLASSIFY_CHUNK_SIZE", "64"))
+STREAM_THRESHOLD = int(os.getenv("STREAM_THRESHOLD", "256"))
+
+# Blocking torch calls run on a dedicated thread pool. At most
+# INFERENCE_QUEUE_SIZE calls may be running or waiting, and at most as many
+# /classify requests per variant waiting to be batched or in a running batch,
+# beyond that requests are rejected with 503. Unset thread counts keep torch's
+# own defaults.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "0"))
+
+# In-process LRU cache of predictions keyed by embedding content.
+# PREDICTION_CACHE_BYTES=0 disables it. With PREDICTION_CACHE_PATH set,
+# entries are also kept in a SQLite file that survives restarts.
+PREDICTION_CACHE_BYTES = int(os.getenv("PREDICTION_CACHE_BYTES", str(64 * 2**20)))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))
+PREDICTION_CACHE_DECIMALS = int(os.getenv("PREDICTION_CACHE_DECIMALS", "5"))
+PREDICTION_CACHE_PATH = os.getenv("PREDICTION_CACHE_PATH") or None
+
+# Cosine top-k index over labelled embeddings behind /neighbors, built with
+# `python neighbors.py build`. NEIGHBORS_NPROBE is how many IVF lists a query
+# scans when the index is partitioned, 0 scans everything.
+NEIGHBORS_INDEX_PATH = os.getenv("NEIGHBORS_INDEX_PATH") or None
+NEIGHBORS_NPROBE = int(os.getenv("NEIGHBORS_NPROBE", "16"))
+NEIGHBORS_MAX_K = int(os.getenv("NEIGHBORS_MAX_K", "100"))
+
+# Hot-path latency histograms, counters and gauges behind /metrics and /stats.
+# Set METRICS_ENABLED=0 to turn every observation into a no-op.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+
+# Shared secret for the /admin endpoints (hot model reload), sent in the
+# X-Admin-Token header. The endpoints are disabled while it is unset.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") or None
@@ -0,0 +1,193 @@
+"""Distil the SegResNet classifier into the small StudentMLP variant
+
+The teacher's logits are computed once over the stored embedding shards (the
+`batch_XXXXX.h5` files written during preprocessing, or .npy arrays), then the
+student is fitted to them with a temperature-scaled KL loss. No labels are
+needed. A held-out split measures how often the student agrees with the
+teacher, and both variants are timed through `classify_batch`.
+
+    python distill.py --embeddings data/embeddings/*.h5 --output models/cancer_detector_student.pth
+    MODEL_VARIANTS=teacher,student uvicorn main:app
+
+The report is printed and written next to the weights as JSON.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from model import EMBEDDING_DIM, STUDENT_WEIGHTS_FILENAME, StudentMLP, classify_batch, load_model
+
+
+def read_shards(paths):
+    """Stack embeddings from HDF5 shards (`embeddings` dataset) or .npy files
+
+    Rows that are all zero are dropped, they are images the preprocessing
+    could not embed.
+    """
+    arrays = []
+    for path in paths:
+        if path.endswith(".npy"):
+            array = np.load(path)
+        else:
+            import h5py
+
+            with h5py.File(path, "r") as h5f:
+                array = h5f["embeddings"][:]
+        arrays.append(np.asarray(array, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+    embeddings = np.concatenate(arrays)
+    return embeddings[np.any(embeddings != 0, axis=1)]
+
+
+def teacher_logits(teacher, embeddings, batch_size=256):
+    """Teacher logits for every embedding, one chunk at a time"""
+    chunks = []
+    with torch.no_grad():
+        for start in range(0, len(embeddings), batch_size):
+            x = torch.from_numpy(embeddings[start:start + batch_size]).view(-1, 1, EMBEDDING_DIM, 1)
+            chunks.append(teacher(x).numpy())
+    return np.concatenate(chunks)
+
+
+def distillation_loss(student_logits, teacher_logits, temperature):
+    """KL divergence between the softened distributions, scaled by T^2 to keep gradients comparable"""
+    return F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean",
+    ) * temperature ** 2
+
+
+def train(student, embeddings, logits, args):
+    x_all = torch.from_numpy(embeddings)
+    t_all = torch.from_numpy(logits)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    steps = args.epochs * max(1, -(-len(x_all) // args.batch_size))
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=steps)
+    generator = torch.Generator().manual_seed(args.seed)
+
+    for epoch in range(args.epochs):
+        student.train()
+        order = torch.randperm(len(x_all), generator=generator)
+        total = 0.0
+        for start in range(0, len(order), args.batch_size):
+            index = order[start:start + args.batch_size]
+            loss = distillation_loss(student(x_all[index]), t_all[index], args.temperature)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total += loss.item() * len(index)
+        print(f"epoch {epoch + 1}/{args.epochs} loss={total / len(x_all):.5f}", flush=True)
+    return student.eval()
+
+
+def agreement(student, embeddings, logits):
+    """How closely the student follows the teacher on held-out embeddings"""
+    with torch.no_grad():
+        student_probs = torch.softmax(student(torch.from_numpy(embeddings)), dim=1)
+    teacher_probs = torch.softmax(torch.from_numpy(logits), dim=1)
+    teacher_class = teacher_probs.argmax(dim=1)
+    student_class = student_probs.argmax(dim=1)
+    positives = teacher_class == 1
+    return {
+        "samples": len(embeddings),
+        "agreement": (teacher_class == student_class).float().mean().item(),
+        # Share of the teacher's positive calls the student also flags, what matters when screening
+        "positive_recall": (student_class[positives] == 1).float().mean().item() if positives.any() else None,
+        "mean_abs_prob_diff": (teacher_probs - student_probs).abs().max(dim=1).values.mean().item(),
+        "max_abs_prob_diff": (teacher_probs - student_probs).abs().max().item(),
+    }
+
+
+def time_classify(model, embeddings, batch_size, repeats):
+    batch = embeddings[:batch_size]
+    for _ in range(3):
+        classify_batch(model, batch)
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        classify_batch(model, batch)
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000.0
+
+
+def speed(teacher, student, embeddings, batch_sizes, repeats):
+    report = {}
+    for batch_size in batch_sizes:
+        # Repeat the sample if there are fewer embeddings than the batch size
+        batch = np.resize(embeddings, (batch_size, EMBEDDING_DIM))
+        teacher_ms = time_classify(teacher, batch, batch_size, repeats)
+        student_ms = time_classify(student, batch, batch_size, repeats)
+        report[str(batch_size)] = {
+            "teacher_ms": round(teacher_ms, 3),
+            "student_ms": round(student_ms, 3),
+            "speedup": round(teacher_ms / student_ms, 1),
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embeddings", nargs="+", required=True, help="HDF5 shards or .npy arrays of (N, 384) embeddings")
+    parser.add_argument("--teacher-weights", default=os.getenv("MODEL_PATH"),
+                        help="Teacher state dict, downloaded from the Hub when omitted")
+    parser.add_argument("--output", default=os.path.join("models", STUDENT_WEIGHTS_FILENAME))
+    parser.add_argument("--logits-cache", help="Reuse teacher logits from this .npy, or save them there on first run")
+    parser.add_argument("--hidden", type=int, default=256, help="Student hidden width, read back from the weights when loading")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-4)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--val-fraction", type=float, default=0.1)
+    parser.add_argument("--bench-batch-sizes", type=int, nargs="+", default=[1, 32, 256])
+    parser.add_argument("--bench-repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    embeddings = read_shards(args.embeddings)
+    teacher = load_model(args.teacher_weights)
+
+    if args.logits_cache and os.path.exists(args.logits_cache):
+        logits = np.load(args.logits_cache)
+    else:
+        started = time.perf_counter()
+        logits = teacher_logits(teacher, embeddings)
+        print(f"Teacher logits for {len(embeddings)} embeddings in {time.perf_counter() - started:.1f}s", flush=True)
+        if args.logits_cache:
+            np.save(args.logits_cache, logits)
+
+    order = np.random.default_rng(args.seed).permutation(len(embeddings))
+    val_size = int(len(order) * args.val_fraction)
+    val, fit = order[:val_size], order[val_size:]
+
+    student = StudentMLP(hidden=args.hidden)
+    student = train(student, embeddings[fit], logits[fit], args)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    torch.save(student.state_dict(), args.output)
+
+    report = {
+        "weights": args.output,
+        "hidden": args.hidden,
+        "train_samples": len(fit),
+        "parameters": {
+            "teacher": sum(p.numel() for p in teacher.parameters()),
+            "student": sum(p.numel() for p in student.parameters()),
+        },
+        "validation": agreement(student, embeddings[val], logits[val]) if val_size else None,
+        "latency": speed(teacher, student, embeddings, args.bench_batch_sizes, args.bench_repeats),
+    }
+    with open(os.path.splitext(args.output)[0] + ".json", "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class ExecutorSaturated(Exception):
+    """Raised when the inference admission queue is full"""
+
+
+def configure_torch_threads(num_threads=None, interop_threads=None):
+    """Apply torch intra-op / inter-op thread counts, ignoring unset values"""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work has started
+            pass
+
+
+class InferenceExecutor:
+    """Bounded thread pool that keeps blocking torch calls off the event loop
+
+    At most `max_pending` calls may be running or waiting at once. Beyond that
+    `run` raises ExecutorSaturated straight away, so callers can shed load with
+    a 503 instead of queueing without limit.
+    """
+
+    def __init__(self, max_workers=1, max_pending=64):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = threading.Semaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def saturated(self):
+        return self._pending >= self.max_pending
+
+    def _acquire(self, blocking):
+        if not self._slots.acquire(blocking=blocking):
+            raise ExecutorSaturated(f"Inference queue is full ({self.max_pending} pending)")
+        with self._lock:
+            self._pending += 1
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _call(self, fn, args):
+        try:
+            return fn(*args)
+        finally:
+            self._release()
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and await its result, or raise ExecutorSaturated"""
+        self._acquire(blocking=False)
+        try:
+            future = self._pool.submit(self._call, fn, args)
+        except BaseException:
+            self._release()
+            raise
+        return await asyncio.wrap_future(future)
+
+    def run_sync(self, fn, *args):
+        """Blocking variant for worker threads, waits for a free slot instead of failing"""
+        self._acquire(blocking=True)
+        try:
+            future = self._pool.submit(self._call, fn, args)
+        except BaseException:
+            self._release()
+            raise
+        return future.result()
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,52 @@
+"""Export the cancer classifier to TorchScript and ONNX and check them against eager
+
+    python export.py --output artifacts
+    INFERENCE_BACKEND=onnx ARTIFACTS_DIR=artifacts uvicorn main:app
+
+Each artifact is compared with the eager model on random embeddings. The
+command exits non-zero if any backend is outside the tolerance, so it can gate
+a deployment that switches engines.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from model import (
+    EMBEDDING_DIM, VARIANTS,
+    artifact_filename, check_equivalence, export_onnx, export_torchscript, load_backend, load_model,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model-path", default=os.getenv("MODEL_PATH"),
+                        help="Local state dict, downloaded from the Hub when omitted")
+    parser.add_argument("--variant", default="teacher", choices=list(VARIANTS))
+    parser.add_argument("--output", default="artifacts")
+    parser.add_argument("--backends", nargs="+", default=["torchscript", "onnx"], choices=["torchscript", "onnx"])
+    parser.add_argument("--samples", type=int, default=256, help="Random embeddings used for the equivalence check")
+    parser.add_argument("--atol", type=float, default=1e-4, help="Allowed absolute difference in class probabilities")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    model = load_model(args.model_path, args.variant)
+
+    exporters = {"torchscript": export_torchscript, "onnx": export_onnx}
+    embeddings = np.random.default_rng(0).standard_normal((args.samples, EMBEDDING_DIM), dtype=np.float32)
+
+    report = {}
+    for backend in args.backends:
+        path = exporters[backend](model, os.path.join(args.output, artifact_filename(backend, args.variant)))
+        candidate = load_backend(backend, artifacts_dir=args.output, variant=args.variant)
+        report[backend] = {"path": path, **check_equivalence(model, candidate, embeddings, atol=args.atol)}
+
+    print(json.dumps(report, indent=2))
+    if not all(result["passed"] for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
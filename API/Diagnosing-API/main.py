@@ -1,15 +1,44 @@
-from model import load_model, classify
-from fastapi import FastAPI, HTTPException
+import time
+_import_started = time.perf_counter()
+
+import asyncio
+import hmac
+import os
+from contextlib import asynccontextmanager
+from model import load_backend, backend_version, weights_path, classify_batch, EMBEDDING_DIM
+from batching import MicroBatcher
+from cache import PredictionCache
+from registry import ModelRegistry, VersionDraining
+from neighbors import NeighborIndex
+from executor import InferenceExecutor, ExecutorSaturated, configure_torch_threads
+from constants import (
+    MODEL_PATH, MODEL_CACHE_DIR, MODEL_VARIANTS, STUDENT_MODEL_PATH, INFERENCE_BACKEND, ARTIFACTS_DIR, PRECISION,
+    BATCH_WINDOW_MS, MAX_BATCH_SIZE, CLASSIFY_CHUNK_SIZE, STREAM_THRESHOLD,
+    INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, TORCH_NUM_THREADS, TORCH_INTEROP_THREADS,
+    PREDICTION_CACHE_BYTES, PREDICTION_CACHE_TTL, PREDICTION_CACHE_DECIMALS, PREDICTION_CACHE_PATH,
+    ADMIN_TOKEN, NEIGHBORS_INDEX_PATH, NEIGHBORS_NPROBE, NEIGHBORS_MAX_K,
+)
+from wire import decode_features, openapi_body, WireFormatError, UnsupportedMediaType
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 import numpy as np
 import uvicorn
-from typing import List
-app = FastAPI()
+import json
+import metrics
+
+startup_timings = {"import_s": time.perf_counter() - _import_started}
 
 class InputData(BaseModel):
     features: List[float]
 
+class BatchInputData(BaseModel):
+    features: List[List[float]]
+
+class ReloadRequest(BaseModel):
+    path: Optional[str] = None
+
 # class InputData(BaseModel):
 #     features: List[float]
     
@@ -19,19 +48,430 @@ class InputData(BaseModel):
 #             raise ValueError('Features must be a list of length 384')
 #         return v
 
-global model
+# Requests that do not pick a variant go to the first configured one
+DEFAULT_VARIANT = MODEL_VARIANTS[0]
+MODEL_PATHS = {"teacher": MODEL_PATH, "student": STUDENT_MODEL_PATH}
+
+# Loaded in the background after the app binds, see `load` and `warm_up`.
+# New versions are swapped in while serving through /admin/models/{variant}/reload.
+registry = ModelRegistry()
+reloading = set()
+ready = False
+startup_error = None
+# Loaded in the background too, independently of the classifier
+neighbor_index = None
+neighbor_error = None
+
+configure_torch_threads(TORCH_NUM_THREADS, TORCH_INTEROP_THREADS)
+
+
+def cache_path(variant):
+    """SQLite file of a variant's prediction cache, each variant needs its own"""
+    if PREDICTION_CACHE_PATH is None or variant == DEFAULT_VARIANT:
+        return PREDICTION_CACHE_PATH
+    root, ext = os.path.splitext(PREDICTION_CACHE_PATH)
+    return f"{root}-{variant}{ext}"
+
+
+# Repeat embeddings are answered without running the model again
+caches = {
+    variant: PredictionCache(
+        max_bytes=PREDICTION_CACHE_BYTES,
+        ttl=PREDICTION_CACHE_TTL,
+        decimals=PREDICTION_CACHE_DECIMALS,
+        disk_path=cache_path(variant),
+    )
+    for variant in MODEL_VARIANTS
+}
+
+# Forward passes run here so they never block the event loop
+executor = InferenceExecutor(max_workers=INFERENCE_WORKERS, max_pending=INFERENCE_QUEUE_SIZE)
+
+# Concurrent /classify calls for the same variant are coalesced into one forward pass
+batchers = {
+    variant: MicroBatcher(
+        lambda embeddings, variant=variant: executor.run(classify_current, variant, embeddings),
+        max_batch_size=MAX_BATCH_SIZE,
+        window_ms=BATCH_WINDOW_MS,
+        max_concurrent_batches=INFERENCE_WORKERS,
+        max_queue_size=INFERENCE_QUEUE_SIZE,
+    )
+    for variant in MODEL_VARIANTS
+}
+
+
+parse_stage = metrics.histogram("classify_stage_seconds", metrics.LATENCY_BUCKETS, "Time per classify stage", {"stage": "parse"})
+classify_request_histogram = metrics.histogram(
+    "classify_request_seconds", metrics.LATENCY_BUCKETS, "End-to-end /classify handler time", {"endpoint": "/classify"}
+)
+rejected_counter = metrics.counter("classify_rejected_total", "Requests rejected with 503 because the inference queue was full")
+metrics.gauge("classify_queue_depth", "Requests waiting to be batched", fn=lambda: sum(b.queue_depth for b in batchers.values()))
+metrics.gauge("inference_executor_pending", "Forward passes running or waiting on the executor", fn=lambda: executor.pending)
+for _variant, _cache in caches.items():
+    metrics.counter("prediction_cache_hits_total", "Prediction cache hits", {"variant": _variant}, fn=lambda c=_cache: c.hits)
+    metrics.counter("prediction_cache_misses_total", "Prediction cache misses", {"variant": _variant}, fn=lambda c=_cache: c.misses)
+    metrics.counter("prediction_cache_evictions_total", "Prediction cache LRU evictions", {"variant": _variant}, fn=lambda c=_cache: c.evictions)
+    metrics.counter("prediction_cache_expirations_total", "Prediction cache entries dropped after the TTL", {"variant": _variant}, fn=lambda c=_cache: c.expirations)
+metrics.gauge("model_ready", "1 once the model is loaded and warmed up", fn=lambda: int(ready))
+metrics.counter("model_swaps_total", "Model versions replaced while serving", fn=lambda: registry.swaps)
+
+
+def classify_current(variant, embeddings):
+    """classify_batch on the version of `variant` being served, each result tagged with that version"""
+    with registry.acquire(variant) as handle:
+        return [(prediction, confidence, handle.version) for prediction, confidence in classify_batch(handle.model, embeddings)]
+
+
+def classify_with_cache(embeddings, handle):
+    """classify_batch that only runs the model on embeddings missing from the cache"""
+    cache = caches[handle.variant]
+    if cache.model_version != handle.version:
+        # Pinned to a version that was just replaced, the cache already belongs to the new one
+        return classify_batch(handle.model, embeddings)
+    keys = [cache.key(embedding) for embedding in embeddings]
+    results = [cache.get(key) for key in keys]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        for i, result in zip(misses, classify_batch(handle.model, embeddings[misses])):
+            results[i] = result
+            cache.put(keys[i], result, handle.version)
+    return results
+
+
+def classify_chunks(features, variant):
+    """Classify a whole /classify_batch request on one model version, CLASSIFY_CHUNK_SIZE at a time"""
+    with registry.acquire(variant) as handle:
+        return handle.version, [
+            result
+            for start in range(0, len(features), CLASSIFY_CHUNK_SIZE)
+            for result in classify_with_cache(features[start:start + CLASSIFY_CHUNK_SIZE], handle)
+        ]
+
+
+def resolve_weights(variant, path=None):
+    """Weights path and version of a variant, from `path`, its configured path or MODEL_CACHE_DIR
+
+    The Hub is only a fallback.
+    """
+    # Only the eager backend reads the state dict, the others load exported artifacts
+    model_path = weights_path(path or MODEL_PATHS.get(variant), MODEL_CACHE_DIR, variant) if INFERENCE_BACKEND == "eager" else None
+    return model_path, backend_version(INFERENCE_BACKEND, model_path, ARTIFACTS_DIR, precision=PRECISION, variant=variant)
 
-model = load_model()
 
-@app.post("/classify")
-async def classify_data(data: InputData):
+def load_variant(variant, model_path):
+    return load_backend(INFERENCE_BACKEND, model_path, ARTIFACTS_DIR, num_threads=TORCH_NUM_THREADS,
+                        precision=PRECISION, variant=variant)
+
+
+def load():
+    """Load every variant in MODEL_VARIANTS
+
+    serve.py calls this in the parent before forking, so it must not run a
+    forward pass.
+    """
+    started = time.perf_counter()
+    for variant in MODEL_VARIANTS:
+        model_path, version = resolve_weights(variant)
+        caches[variant].set_model_version(version)
+        registry.install(variant, load_variant(variant, model_path), version)
+    startup_timings["load_s"] = time.perf_counter() - started
+
+
+def warm_up_model(model):
+    """Run the batch sizes the batcher produces most once, so the first requests do not pay for it"""
+    for batch_size in sorted({1, MAX_BATCH_SIZE}):
+        classify_batch(model, np.zeros((batch_size, EMBEDDING_DIM), dtype=np.float32))
+
+
+def warm_up():
+    started = time.perf_counter()
+    for variant in registry:
+        warm_up_model(registry.current(variant).model)
+    startup_timings["warmup_s"] = time.perf_counter() - started
+
+
+async def start_model():
+    global ready, startup_error
     try:
-        # Convert input to numpy array for model
-        features = np.array(data.features)
-        
-        # Get prediction using the imported classify function
-        prediction, confidence = classify(model, features)
+        if not registry:
+            await asyncio.to_thread(load)
+        await executor.run(warm_up)
+    except Exception as e:
+        startup_error = str(e)
+        print(f"Model failed to load: {e}")
+        return
+    startup_timings["total_s"] = sum(startup_timings[k] for k in ("import_s", "load_s", "warmup_s") if k in startup_timings)
+    ready = True
+    print(f"Models {', '.join(registry.versions().values())} ready: " + ", ".join(f"{k}={v:.2f}" for k, v in startup_timings.items()))
+
+
+async def start_neighbors():
+    global neighbor_index, neighbor_error
+    try:
+        started = time.perf_counter()
+        neighbor_index = await asyncio.to_thread(NeighborIndex, NEIGHBORS_INDEX_PATH, NEIGHBORS_NPROBE)
+    except Exception as e:
+        neighbor_error = str(e)
+        print(f"Neighbour index failed to load: {e}")
+        return
+    print(f"Neighbour index with {len(neighbor_index)} vectors loaded in {time.perf_counter() - started:.2f}s")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    for batcher in batchers.values():
+        await batcher.start()
+    # Load in the background so the app binds right away and /live answers during startup
+    loading = [asyncio.create_task(start_model())]
+    if NEIGHBORS_INDEX_PATH is not None:
+        loading.append(asyncio.create_task(start_neighbors()))
+    yield
+    for task in loading:
+        task.cancel()
+    for batcher in batchers.values():
+        await batcher.stop()
+    executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+
+def ensure_ready():
+    if not ready:
+        raise HTTPException(status_code=503, detail=startup_error or "Model is still loading")
+
+
+def resolve_variant(variant):
+    """The variant a request asked for, or the default one"""
+    if variant is None:
+        return DEFAULT_VARIANT
+    if variant not in registry:
+        raise HTTPException(status_code=400, detail=f"Model variant {variant!r} is not loaded, available: {list(registry)}")
+    return variant
+
+
+async def read_features(request, json_model):
+    """Decode a JSON, raw float32 or .npy request body into an (N, 384) float32 array"""
+    body = await request.body()
+    try:
+        with parse_stage.time():
+            return decode_features(body, request.headers.get("content-type"), json_model)
+    except UnsupportedMediaType as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except WireFormatError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.post("/classify", openapi_extra=openapi_body(InputData))
+async def classify_data(request: Request, variant: Optional[str] = None):
+    """Classify one embedding sent as JSON, raw little-endian float32 or .npy
+
+    `?variant=student` routes the call to the distilled model when it is loaded.
+    """
+    ensure_ready()
+    variant = resolve_variant(variant)
+    with classify_request_histogram.time():
+        return await _classify_one(request, variant)
+
+
+async def _classify_one(request, variant):
+    features = await read_features(request, InputData)
+    if len(features) != 1:
+        raise HTTPException(status_code=422, detail=f"Features must be a list of length {EMBEDDING_DIM}")
+
+    cache = caches[variant]
+    key = cache.key(features[0])
+    version = cache.model_version
+    cached = cache.get(key)
+    if cached is not None:
+        prediction, confidence = cached
+        return {"prediction": prediction, "confidence": confidence, "model_version": version}
+
+    try:
+        # Get prediction from the shared batched forward pass
+        prediction, confidence, version = await batchers[variant].submit(features[0])
+        cache.put(key, (prediction, confidence), version)
         
-        return {"prediction": prediction, "confidence": confidence}
+        return {"prediction": prediction, "confidence": confidence, "model_version": version}
+    except ExecutorSaturated as e:
+        rejected_counter.inc()
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during classification: {str(e)}")
+
+
+@app.post("/classify_batch", openapi_extra=openapi_body(BatchInputData))
+async def classify_batch_data(request: Request, variant: Optional[str] = None):
+    """Classify many embeddings in one call, results are returned in input order
+
+    The body is JSON, raw little-endian float32 (N x 384) or an (N, 384) .npy
+    array. Large batches are streamed back as NDJSON, one result per line.
+    """
+    ensure_ready()
+    variant = resolve_variant(variant)
+    # Check every vector up front so a bad row fails the call before any compute
+    features = await read_features(request, BatchInputData)
+
+    if len(features) > STREAM_THRESHOLD:
+        if executor.saturated:
+            rejected_counter.inc()
+            raise HTTPException(status_code=503, detail="Inference queue is full")
+
+        def stream_results():
+            # Runs on Starlette's threadpool, so each chunk can block for a free executor slot
+            # Each chunk runs on the version current when it starts, so a swap can land mid-stream
+            for start in range(0, len(features), CLASSIFY_CHUNK_SIZE):
+                version, results = executor.run_sync(classify_chunks, features[start:start + CLASSIFY_CHUNK_SIZE], variant)
+                for index, (prediction, confidence) in enumerate(results, start):
+                    yield json.dumps({
+                        "index": index, "prediction": prediction, "confidence": confidence, "model_version": version,
+                    }) + "\n"
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    try:
+        version, results = await executor.run(classify_chunks, features, variant)
+        return {
+            "model_version": version,
+            "results": [{"prediction": prediction, "confidence": confidence} for prediction, confidence in results],
+        }
+    except ExecutorSaturated as e:
+        rejected_counter.inc()
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during classification: {str(e)}")
+
+
+@app.post("/neighbors", openapi_extra=openapi_body(InputData))
+async def nearest_neighbors(request: Request, k: int = 10, nprobe: Optional[int] = None):
+    """The `k` labelled training embeddings most similar to one embedding, by cosine similarity
+
+    Takes the same body formats as /classify. `nprobe` overrides how many IVF
+    lists are scanned when the index is partitioned.
+    """
+    if NEIGHBORS_INDEX_PATH is None:
+        raise HTTPException(status_code=404, detail="No neighbour index configured, set NEIGHBORS_INDEX_PATH")
+    if neighbor_index is None:
+        raise HTTPException(status_code=503, detail=neighbor_error or "Neighbour index is still loading")
+    if not 1 <= k <= NEIGHBORS_MAX_K:
+        raise HTTPException(status_code=422, detail=f"k must be between 1 and {NEIGHBORS_MAX_K}")
+
+    features = await read_features(request, InputData)
+    if len(features) != 1:
+        raise HTTPException(status_code=422, detail=f"Features must be a list of length {EMBEDDING_DIM}")
+    try:
+        results = await executor.run(neighbor_index.search, features[0], k, nprobe)
+    except ExecutorSaturated as e:
+        rejected_counter.inc()
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"neighbors": results}
+
+
+@app.get("/live")
+@app.get("/health")
+async def live():
+    """Liveness: the process is up and serving, whether or not the model is loaded"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness():
+    """Readiness: the model is loaded and warmed up, with the startup time breakdown"""
+    if not ready:
+        status = "failed" if startup_error else "loading"
+        return JSONResponse(status_code=503, content={"status": status, "pid": os.getpid(), "error": startup_error, "startup": startup_timings})
+    return {
+        "status": "ready",
+        # Tells the pre-fork workers of serve.py apart
+        "pid": os.getpid(),
+        "model_version": registry.current(DEFAULT_VARIANT).version,
+        "variants": registry.versions(),
+        "startup": startup_timings,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Stage latency histograms, batch size and queue depth in Prometheus text format"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    """Batch size and queue wait distributions for tuning the batching window"""
+    return {
+        "batching": {"max_batch_size": MAX_BATCH_SIZE, "window_ms": BATCH_WINDOW_MS},
+        "prediction_cache": {variant: cache.stats() for variant, cache in caches.items()},
+        "models": registry.stats(),
+        # PRECISION=bf16 drops to fp32 once autocast returns non-finite logits
+        "precision": {variant: getattr(registry.current(variant).model, "precision", PRECISION) for variant in registry},
+        "neighbors": neighbor_index.stats() if neighbor_index is not None else None,
+        "executor": {"workers": executor.max_workers, "pending": executor.pending, "max_pending": executor.max_pending},
+        "metrics": metrics.snapshot(),
+    }
+
+
+def check_admin(token):
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled, set ADMIN_TOKEN to enable them")
+    if token is None or not hmac.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+async def list_models(x_admin_token: Optional[str] = Header(None)):
+    """Served version of each variant, and replaced versions still finishing in-flight calls"""
+    check_admin(x_admin_token)
+    return registry.stats()
+
+
+@app.post("/admin/models/{variant}/reload")
+async def reload_model(variant: str, body: Optional[ReloadRequest] = None, x_admin_token: Optional[str] = Header(None)):
+    """Load a new version of `variant` in the background, warm it up and swap it in
+
+    Without a `path` the variant's configured weights are read again, so a new
+    file moved over the old one is picked up. Requests keep being served
+    throughout; calls already running finish on the old version, which is
+    unloaded once the last of them returns.
+    """
+    check_admin(x_admin_token)
+    ensure_ready()
+    if variant not in registry:
+        raise HTTPException(status_code=404, detail=f"Model variant {variant!r} is not loaded")
+    if variant in reloading:
+        raise HTTPException(status_code=409, detail=f"A reload of {variant!r} is already in progress")
+    # At most one replaced version per variant in memory, checked before loading another
+    if registry.draining(variant):
+        raise HTTPException(status_code=409, detail=f"The previous {variant!r} version is still finishing in-flight calls")
+
+    reloading.add(variant)
+    try:
+        started = time.perf_counter()
+        model_path, version = await asyncio.to_thread(resolve_weights, variant, body.path if body else None)
+        previous = registry.current(variant).version
+        if version == previous:
+            return {"variant": variant, "model_version": version, "swapped": False}
+
+        new_model = await asyncio.to_thread(load_variant, variant, model_path)
+        loaded = time.perf_counter()
+        await executor.run(warm_up_model, new_model)
+        # Switch the cache first, results still coming from the old version are then not cached
+        caches[variant].set_model_version(version)
+        registry.install(variant, new_model, version)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except VersionDraining as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error while reloading {variant}: {str(e)}")
+    finally:
+        reloading.discard(variant)
+
+    print(f"Swapped {variant} model {previous} -> {version}")
+    return {
+        "variant": variant,
+        "previous_version": previous,
+        "model_version": version,
+        "swapped": True,
+        "load_s": loaded - started,
+        "warmup_s": time.perf_counter() - loaded,
+    }
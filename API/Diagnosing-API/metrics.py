@@ -0,0 +1,196 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from constants import METRICS_ENABLED
+
+# Latency buckets in seconds shared by the per-stage histograms
+LATENCY_BUCKETS = [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in items) + "}"
+
+
+class Histogram:
+    """Fixed-bucket histogram that is cheap enough to update on the hot path"""
+
+    kind = "histogram"
+
+    def __init__(self, name, buckets, description="", labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """Observe the wall time spent in the `with` block"""
+        if not METRICS_ENABLED:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it"""
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+        return {
+            "count": total,
+            "sum": value_sum,
+            "mean": value_sum / total if total else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets + ["+Inf"], counts)},
+        }
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            value_sum = self._sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ["+Inf"], counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, {'le': bound})} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(self.labels)} {value_sum}")
+        lines.append(f"{self.name}_count{_format_labels(self.labels)} {total}")
+        return lines
+
+
+class Counter:
+    """Monotonically increasing count, either incremented or read from a callback at scrape time
+
+    A callback exposes totals the owning object already keeps, such as cache
+    hits, without counting them twice.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, description="", labels=None, fn=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0
+        self._fn = fn
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._value += amount
+
+    def snapshot(self):
+        return self._fn() if self._fn is not None else self._value
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labels)} {self.snapshot()}"]
+
+
+class Gauge:
+    """Current value, either set explicitly or read from a callback at scrape time
+
+    A callback keeps the hot path free of gauge updates for values such as
+    queue depth that the owning object already tracks.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, description="", labels=None, fn=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or {}
+        self._value = 0
+        self._fn = fn
+
+    def set(self, value):
+        self._value = value
+
+    def snapshot(self):
+        return self._fn() if self._fn is not None else self._value
+
+    def samples(self):
+        return [f"{self.name}{_format_labels(self.labels)} {self.snapshot()}"]
+
+
+REGISTRY = {}
+
+
+def _register(cls, name, labels, *args, **kwargs):
+    key = (name, tuple(sorted((labels or {}).items())))
+    if key not in REGISTRY:
+        REGISTRY[key] = cls(name, *args, labels=labels, **kwargs)
+    return REGISTRY[key]
+
+
+def histogram(name, buckets, description="", labels=None):
+    """Return the histogram registered under `name` and `labels`, creating it if needed"""
+    return _register(Histogram, name, labels, buckets, description)
+
+
+def counter(name, description="", labels=None, fn=None):
+    return _register(Counter, name, labels, description, fn=fn)
+
+
+def gauge(name, description="", labels=None, fn=None):
+    return _register(Gauge, name, labels, description, fn=fn)
+
+
+def _display_name(metric):
+    return metric.name + _format_labels(metric.labels)
+
+
+def snapshot():
+    return {_display_name(metric): metric.snapshot() for metric in REGISTRY.values()}
+
+
+def render_prometheus():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines, described = [], set()
+    # Samples of one metric family have to be contiguous, whatever order they registered in
+    for metric in sorted(REGISTRY.values(), key=lambda metric: metric.name):
+        if metric.name not in described:
+            described.add(metric.name)
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,5 @@
 import os
+import hashlib
 # import h5py
 import numpy as np
 # import pandas as pd
@@ -9,6 +10,7 @@ import torch.nn.functional as F
 # from torch.utils.data import Dataset, DataLoader
 from monai.networks.nets import SegResNet
 from huggingface_hub import hf_hub_download
+import metrics
 # from tqdm.notebook import tqdm, trange
 
 # class EmbeddingsDataset(Dataset):
@@ -155,29 +157,335 @@ class SelfSupervisedCancerModel(nn.Module):
             return output, proj_features
         return output
 
-def load_model():
-    path = hf_hub_download(repo_id="Arpit-Bansal/Medical-Diagnosing-models", filename="cancer_detector_model.pth",
-                    )
-    model = SelfSupervisedCancerModel(num_classes=2)
-    state_dict = torch.load(path, map_location=torch.device('cpu'))
+EMBEDDING_DIM = 384
+MODEL_REPO_ID = "Arpit-Bansal/Medical-Diagnosing-models"
+WEIGHTS_FILENAME = "cancer_detector_model.pth"
 
-    model.load_state_dict(state_dict=state_dict)
+# Time spent in each stage of `classify_batch`
+tensor_stage = metrics.histogram("classify_stage_seconds", metrics.LATENCY_BUCKETS, "Time per classify stage", {"stage": "tensor"})
+forward_stage = metrics.histogram("classify_stage_seconds", metrics.LATENCY_BUCKETS, "Time per classify stage", {"stage": "forward"})
+postprocess_stage = metrics.histogram("classify_stage_seconds", metrics.LATENCY_BUCKETS, "Time per classify stage", {"stage": "postprocess"})
+
+# Inference engines `load_backend` can serve the classifier with
+BACKENDS = ("eager", "torchscript", "onnx")
+# Numeric precisions the eager model can run at, see `apply_precision`
+PRECISIONS = ("fp32", "int8", "bf16")
+STUDENT_WEIGHTS_FILENAME = "cancer_detector_student.pth"
+
+
+class StudentMLP(nn.Module):
+    """Small MLP distilled from the SelfSupervisedCancerModel logits, see distill.py
+
+    Accepts the same (N, 1, 384, 1) input as the teacher and flattens it, so
+    `classify_batch` and the exporters work with either variant.
+    """
+    def __init__(self, in_features=EMBEDDING_DIM, hidden=256, num_classes=2, dropout=0.1):
+        super(StudentMLP, self).__init__()
+        self.net = nn.Sequential(
+            nn.Linear(in_features, hidden),
+            nn.ReLU(inplace=True),
+            nn.Dropout(dropout),
+            nn.Linear(hidden, hidden // 2),
+            nn.ReLU(inplace=True),
+            nn.Linear(hidden // 2, num_classes),
+        )
+
+    def forward(self, x):
+        return self.net(x.reshape(x.size(0), -1))
+
+
+# Classifier variants by name: the model class and the weights file it loads
+VARIANTS = {
+    "teacher": (SelfSupervisedCancerModel, WEIGHTS_FILENAME),
+    "student": (StudentMLP, STUDENT_WEIGHTS_FILENAME),
+}
+
+
+def _variant(name):
+    if name not in VARIANTS:
+        raise ValueError(f"Unknown model variant {name!r}, expected one of {tuple(VARIANTS)}")
+    return VARIANTS[name]
+
+
+def build_variant(variant="teacher", **kwargs):
+    """Instantiate a variant with freshly initialised weights, `kwargs` go to its constructor"""
+    model_class, _ = _variant(variant)
+    return model_class(num_classes=2, **kwargs)
+
+
+def variant_arguments(variant, state_dict):
+    """Constructor arguments of a variant that follow from its trained weights
+
+    distill.py can train the student at any `--hidden` width, which is read
+    back from the shape of its first layer so every student loads.
+    """
+    if variant == "student":
+        return {"hidden": state_dict["net.0.weight"].shape[0]}
+    return {}
+
+
+def artifact_filename(backend, variant="teacher"):
+    """File name export.py writes a variant's TorchScript or ONNX artifact to"""
+    stem = os.path.splitext(_variant(variant)[1])[0]
+    return stem + {"torchscript": ".ts", "onnx": ".onnx"}[backend]
+
+
+def weights_path(path=None, cache_dir=None, variant="teacher"):
+    """Local path of the classifier weights
+
+    An explicit `path` wins, then a copy already in `cache_dir`. Downloading
+    from the Hub is only the fallback, and it saves into `cache_dir` so the
+    next start is local and works without network.
+    """
+    if path is not None:
+        return path
+    filename = _variant(variant)[1]
+    if cache_dir is not None:
+        local_path = os.path.join(cache_dir, filename)
+        if os.path.exists(local_path):
+            return local_path
+    return hf_hub_download(repo_id=MODEL_REPO_ID, filename=filename, local_dir=cache_dir)
+
+
+def file_digest(path, length=12):
+    """Short content hash of a weights or artifact file, used as a model version"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:length]
+
+
+def load_model(path=None, variant="teacher"):
+    """Load a trained classifier variant, downloading the weights unless a local `path` is given
+
+    The state dict is memory-mapped and assigned to the model without copying,
+    so the weights stay backed by the page cache and are shared between every
+    process that loads the same file, including workers forked after loading.
+    """
+    path = weights_path(path, variant=variant)
+    state_dict = torch.load(path, map_location=torch.device('cpu'), mmap=True, weights_only=True)
+    # Build on the meta device, the real tensors come from the state dict
+    with torch.device('meta'):
+        model = build_variant(variant, **variant_arguments(variant, state_dict))
+
+    model.load_state_dict(state_dict=state_dict, assign=True)
 
     return model.eval()
 
 
-def classify(model, embedding):
-    """Classify a single embedding using the trained model"""
-    # Ensure the model is in evaluation
-    embedding_tensor = torch.tensor(embedding, dtype=torch.float32).view(1, 1, 384, 1)
+class NonFiniteOutput(ValueError):
+    """The classifier produced NaN or infinite logits"""
+
+
+# Normalisation layers kept in fp32 under autocast, their statistics lose too much in bf16
+NORM_LAYERS = (nn.GroupNorm, nn.LayerNorm, nn.modules.batchnorm._BatchNorm)
+
+
+class Float32Norm(nn.Module):
+    """Runs a normalisation layer in fp32 even inside an autocast region"""
+    def __init__(self, norm):
+        super(Float32Norm, self).__init__()
+        self.norm = norm
+
+    def forward(self, x):
+        with torch.autocast("cpu", enabled=False):
+            return self.norm(x.float())
+
+
+class AutocastModel(nn.Module):
+    """Runs the wrapped model under CPU autocast and hands back fp32 logits
+
+    Convolutions and Linear layers run in `dtype`, the normalisation layers
+    in fp32. The low-precision CPU kernels occasionally return NaN for an
+    input that is fine in fp32. With `fallback` set, the first time that
+    happens autocast is switched off for good: that batch and every later one
+    run in fp32, and `precision` says so. Without it the raw output is
+    returned, which is what benchmarks/precision.py measures.
+    """
+    def __init__(self, model, dtype=torch.bfloat16, fallback=True):
+        super(AutocastModel, self).__init__()
+        for module in list(model.modules()):
+            for name, child in module.named_children():
+                if isinstance(child, NORM_LAYERS):
+                    setattr(module, name, Float32Norm(child))
+        self.model = model
+        self.dtype = dtype
+        self.fallback = fallback
+        self.disabled = False
+
+    @property
+    def precision(self):
+        """The precision batches actually run at"""
+        return "fp32" if self.disabled else {torch.bfloat16: "bf16", torch.float16: "fp16"}[self.dtype]
+
+    def forward(self, x):
+        if self.disabled:
+            return self.model(x)
+        with torch.autocast("cpu", dtype=self.dtype):
+            output = self.model(x).float()
+        if self.fallback and not torch.isfinite(output).all():
+            self.disabled = True
+            print(f"{self.dtype} autocast returned non-finite logits, running in fp32 from now on")
+            output = self.model(x)
+        return output
+
+
+def apply_precision(model, precision="fp32"):
+    """Switch the eager model to a reduced-precision inference mode
+
+    "int8" dynamically quantizes the Linear layers in place (eager-mode dynamic
+    quantization has no Conv2d kernels, so the SegResNet convolutions stay fp32).
+    "bf16" runs the convolutions and Linear layers under bfloat16 autocast,
+    see AutocastModel.
+    """
+    if precision == "fp32":
+        return model
+    if precision == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    if precision == "bf16":
+        return AutocastModel(model).eval()
+    raise ValueError(f"Unknown precision {precision!r}, expected one of {PRECISIONS}")
+
+
+class OnnxRuntimeModel:
+    """ONNX Runtime session that can be called like the eager model
+
+    Takes the same (N, 1, 384, 1) float32 tensor and returns logits as a tensor,
+    so `classify_batch` works unchanged on top of it.
+    """
+    def __init__(self, path, num_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x):
+        logits = self.session.run(None, {self.input_name: x.numpy()})[0]
+        return torch.from_numpy(logits)
 
+
+def _example_input(batch_size=2):
+    return torch.randn(batch_size, 1, EMBEDDING_DIM, 1)
+
+
+def export_torchscript(model, path):
+    """Trace the eager model, freeze it for inference and save it to `path`"""
     with torch.no_grad():
-        output = model(embedding_tensor)
-        probs = torch.softmax(output, dim=1)
-        predicted_class = torch.argmax(probs, dim=1).item()
-        confidence = probs[0, predicted_class].item()
-    prediction = "positive" if predicted_class == 1 else "negative"
-    
-    return prediction, confidence
+        traced = torch.jit.trace(model.eval(), _example_input())
+        frozen = torch.jit.freeze(traced)
+    frozen.save(path)
+    return path
+
+
+def export_onnx(model, path, opset_version=17):
+    """Export the eager model to ONNX with a dynamic batch dimension"""
+    with torch.no_grad():
+        torch.onnx.export(
+            model.eval(), (_example_input(),), path,
+            input_names=["embedding"], output_names=["logits"],
+            dynamic_axes={"embedding": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset_version,
+            dynamo=False,
+        )
+    return path
+
 
+def check_equivalence(reference, candidate, embeddings, atol=1e-4):
+    """Compare a backend against the eager model on the same embeddings
+
+    Returns the largest absolute difference in class probabilities, the share
+    of embeddings whose predicted class agrees, and whether the difference is
+    within `atol`.
+    """
+    x = torch.as_tensor(np.asarray(embeddings, dtype=np.float32)).view(-1, 1, EMBEDDING_DIM, 1)
+    with torch.no_grad():
+        expected = torch.softmax(reference(x), dim=1)
+        actual = torch.softmax(candidate(x), dim=1)
+    max_abs_diff = (expected - actual).abs().max().item()
+    agreement = (expected.argmax(dim=1) == actual.argmax(dim=1)).float().mean().item()
+    return {"max_abs_diff": max_abs_diff, "agreement": agreement, "passed": max_abs_diff <= atol}
 
+
+def load_backend(backend="eager", model_path=None, artifacts_dir="artifacts", num_threads=0, precision="fp32",
+                 variant="teacher"):
+    """Load a classifier variant on the chosen inference engine
+
+    "eager" loads the PyTorch model as usual, at the requested `precision`.
+    "torchscript" and "onnx" load the fp32 artifacts written by export.py from
+    `artifacts_dir`.
+    """
+    if backend == "eager":
+        return apply_precision(load_model(model_path, variant), precision)
+    if precision != "fp32":
+        raise ValueError(f"Precision {precision!r} is only supported by the eager backend")
+    if backend == "torchscript":
+        return torch.jit.load(os.path.join(artifacts_dir, artifact_filename(backend, variant)), map_location="cpu")
+    if backend == "onnx":
+        return OnnxRuntimeModel(os.path.join(artifacts_dir, artifact_filename(backend, variant)), num_threads=num_threads)
+    raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+
+
+def backend_version(backend="eager", model_path=None, artifacts_dir="artifacts", precision="fp32", variant="teacher"):
+    """Version string for what `load_backend` serves with the same arguments
+
+    Changes whenever the weights or exported artifact change, or a different
+    variant, engine or precision is picked, so caches keyed on it never mix models.
+    """
+    if backend in ("torchscript", "onnx"):
+        path = os.path.join(artifacts_dir, artifact_filename(backend, variant))
+    else:
+        path = weights_path(model_path, variant=variant)
+    return f"{file_digest(path)}-{variant}-{backend}-{precision}"
+
+
+def classify_batch(model, embeddings):
+    """Classify a batch of embeddings with a single forward pass
+
+    Args:
+        model: The loaded cancer classification model
+        embeddings: Array-like of shape (N, 384)
+
+    Returns:
+        List of (prediction, confidence) tuples in input order
+
+    Raises NonFiniteOutput rather than return a NaN confidence, which would
+    neither serialise to JSON nor mean anything.
+    """
+    with tensor_stage.time():
+        # Zero-copy decoded request bodies are read-only, only those get copied here
+        embeddings = np.require(embeddings, dtype=np.float32, requirements=["C", "W"])
+        embedding_tensor = torch.from_numpy(embeddings).view(-1, 1, EMBEDDING_DIM, 1)
+
+    with torch.no_grad():
+        with forward_stage.time():
+            output = model(embedding_tensor)
+        with postprocess_stage.time():
+            probs = torch.softmax(output, dim=1)
+            if not torch.isfinite(probs).all():
+                rows = (~torch.isfinite(probs).all(dim=1)).nonzero().flatten().tolist()
+                raise NonFiniteOutput(f"Model output is not finite for embeddings at {rows}")
+            confidences, predicted_classes = probs.max(dim=1)
+            return [
+                ("positive" if predicted_class == 1 else "negative", confidence)
+                for predicted_class, confidence in zip(predicted_classes.tolist(), confidences.tolist())
+            ]
+
+
+def iter_classify(model, embeddings, chunk_size=64):
+    """Classify many embeddings chunk by chunk, yielding results in input order
+
+    Only one chunk of activations is alive at a time, so memory stays bounded
+    however many embeddings are passed in.
+    """
+    for start in range(0, len(embeddings), chunk_size):
+        yield from classify_batch(model, embeddings[start:start + chunk_size])
+
+
+def classify(model, embedding):
+    """Classify a single embedding using the trained model"""
+    return classify_batch(model, np.asarray(embedding, dtype=np.float32).reshape(1, EMBEDDING_DIM))[0]
@@ -0,0 +1,193 @@
+"""Cosine k-nearest-neighbour lookup over labelled embeddings
+
+The index is a directory holding the L2-normalised embeddings as a float16
+(N, 384) .npy matrix, which is memory-mapped rather than read into memory, next
+to the file ids and labels of each row. Queries are scored with one matrix
+product against the whole matrix, or with IVF partitioning against just the
+`nprobe` lists whose centroids are closest to the query. The build sorts the
+rows by list, so each list is one contiguous slice of the matrix.
+
+Build an index from the preprocessing shards and their metadata (needs h5py
+and pyarrow, serving does not):
+
+    python neighbors.py build data/embeddings/batch_*.h5 --metadata-dir data/metadata \\
+        --output neighbors-index --ivf-lists 1024
+
+then serve it with NEIGHBORS_INDEX_PATH=neighbors-index.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+
+from model import EMBEDDING_DIM
+
+INDEX_FILENAME = "index.json"
+VECTORS_FILENAME = "vectors.f16.npy"
+IDS_FILENAME = "ids.npy"
+LABELS_FILENAME = "labels.npy"
+CENTROIDS_FILENAME = "centroids.npy"
+OFFSETS_FILENAME = "offsets.npy"
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class NeighborIndex:
+    """Read-only cosine top-k index loaded from a directory written by `build_index`"""
+
+    def __init__(self, path, nprobe=16):
+        with open(os.path.join(path, INDEX_FILENAME)) as f:
+            self.info = json.load(f)
+        self.path = path
+        self.nprobe = nprobe
+        # Copy-on-write mapping: nothing writes to it, but torch only wraps writable arrays.
+        # The pages stay backed by the file and shared between workers.
+        self.vectors = np.load(os.path.join(path, VECTORS_FILENAME), mmap_mode="c")
+        self.ids = np.load(os.path.join(path, IDS_FILENAME), mmap_mode="r")
+        self.labels = np.load(os.path.join(path, LABELS_FILENAME), mmap_mode="r")
+        self._vectors = torch.from_numpy(self.vectors) if len(self.vectors) else None
+        self.centroids = None
+        self.offsets = None
+        if os.path.exists(os.path.join(path, CENTROIDS_FILENAME)):
+            self.centroids = torch.from_numpy(np.load(os.path.join(path, CENTROIDS_FILENAME)))
+            self.offsets = np.load(os.path.join(path, OFFSETS_FILENAME))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _ranges(self, query, nprobe):
+        """Row ranges to scan: everything, or the `nprobe` IVF lists nearest to the query"""
+        if self.centroids is None or nprobe <= 0 or nprobe >= len(self.centroids):
+            return [(0, len(self.vectors))]
+        lists = torch.topk(self.centroids @ query, nprobe).indices.tolist()
+        return [(self.offsets[i], self.offsets[i + 1]) for i in sorted(lists) if self.offsets[i + 1] > self.offsets[i]]
+
+    def search(self, query, k=10, nprobe=None):
+        """The `k` most similar rows to `query` as dicts of file_id, label and cosine score"""
+        if self._vectors is None:
+            return []
+        query = torch.from_numpy(normalize(query)[0])
+        half_query = query.half()
+        scores, rows = [], []
+        for start, stop in self._ranges(query, self.nprobe if nprobe is None else nprobe):
+            block = (self._vectors[start:stop] @ half_query).float()
+            top = torch.topk(block, min(k, len(block)))
+            scores.append(top.values)
+            rows.append(top.indices + int(start))
+        scores, rows = torch.cat(scores), torch.cat(rows)
+        top = torch.topk(scores, min(k, len(scores)))
+        return [
+            {"file_id": self.ids[row].decode(), "label": int(self.labels[row]), "score": score}
+            for score, row in zip(top.values.tolist(), rows[top.indices].tolist())
+        ]
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "vectors": len(self.vectors),
+            "ivf_lists": 0 if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe,
+        }
+
+
+def kmeans(vectors, n_lists, iterations=10, seed=0):
+    """Spherical k-means centroids of normalised `vectors`"""
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.from_numpy(vectors)
+    centroids = x[torch.randperm(len(x), generator=generator)[:n_lists]].clone()
+    for _ in range(iterations):
+        assignment = (x @ centroids.T).argmax(dim=1)
+        sums = torch.zeros_like(centroids).index_add_(0, assignment, x)
+        counts = torch.bincount(assignment, minlength=n_lists)
+        # Empty lists keep their previous centroid
+        sums[counts == 0] = centroids[counts == 0]
+        centroids = torch.nn.functional.normalize(sums, dim=1)
+    return centroids.numpy()
+
+
+def assign_lists(vectors, centroids, chunk_size=65536):
+    centroids = torch.from_numpy(centroids)
+    return np.concatenate([
+        (torch.from_numpy(vectors[start:start + chunk_size]) @ centroids.T).argmax(dim=1).numpy()
+        for start in range(0, len(vectors), chunk_size)
+    ])
+
+
+def build_index(vectors, ids, labels, output, ivf_lists=0, train_size=100_000, seed=0):
+    """Write an index directory from raw embeddings with their file ids and labels"""
+    os.makedirs(output, exist_ok=True)
+    vectors = normalize(vectors)
+    ids = np.asarray(ids, dtype=np.bytes_)
+    labels = np.asarray(labels, dtype=np.int8)
+    info = {"count": len(vectors), "dim": EMBEDDING_DIM, "ivf_lists": 0}
+
+    if ivf_lists:
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(train_size, len(vectors)), replace=False)]
+        centroids = kmeans(sample, min(ivf_lists, len(sample)), seed=seed)
+        assignment = assign_lists(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        vectors, ids, labels = vectors[order], ids[order], labels[order]
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        np.save(os.path.join(output, CENTROIDS_FILENAME), centroids)
+        np.save(os.path.join(output, OFFSETS_FILENAME), offsets)
+        info["ivf_lists"] = len(centroids)
+
+    np.save(os.path.join(output, VECTORS_FILENAME), vectors.astype(np.float16))
+    np.save(os.path.join(output, IDS_FILENAME), ids)
+    np.save(os.path.join(output, LABELS_FILENAME), labels)
+    with open(os.path.join(output, INDEX_FILENAME), "w") as f:
+        json.dump(info, f)
+    return info
+
+
+def read_labelled_shards(shards, metadata_dir):
+    """Embeddings, file ids and labels of every labelled row in the preprocessing shards"""
+    import h5py
+    import pyarrow.parquet as pq
+
+    vectors, ids, labels = [], [], []
+    for shard in shards:
+        name = os.path.splitext(os.path.basename(shard))[0]
+        table = pq.read_table(
+            os.path.join(metadata_dir, f"{name}_metadata.parquet"), columns=["file_id", "embedding_index", "label"]
+        ).to_pydict()
+        rows = [i for i, label in enumerate(table["label"]) if label is not None]
+        if not rows:
+            continue
+        indices = np.asarray([table["embedding_index"][i] for i in rows])
+        with h5py.File(shard, "r") as h5f:
+            # h5py fancy indexing needs increasing indices
+            order = np.argsort(indices)
+            vectors.append(h5f["embeddings"][indices[order]])
+        ids.extend(table["file_id"][rows[i]] for i in order)
+        labels.extend(table["label"][rows[i]] for i in order)
+    return np.concatenate(vectors), ids, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build an index from embedding shards and their metadata")
+    build.add_argument("shards", nargs="+", help="batch_XXXXX.h5 embedding shards")
+    build.add_argument("--metadata-dir", required=True, help="Directory of the *_metadata.parquet files")
+    build.add_argument("--output", required=True)
+    build.add_argument("--ivf-lists", type=int, default=0, help="IVF partitions, 0 for exact search only")
+    build.add_argument("--train-size", type=int, default=100_000, help="Vectors sampled to fit the IVF centroids")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    vectors, ids, labels = read_labelled_shards(args.shards, args.metadata_dir)
+    info = build_index(vectors, ids, labels, args.output, ivf_lists=args.ivf_lists, train_size=args.train_size)
+    print(json.dumps({**info, "seconds": round(time.perf_counter() - started, 2)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class VersionDraining(RuntimeError):
+    """A replaced version of the variant is still finishing in-flight calls"""
+
+
+class ModelHandle:
+    """One loaded version of a classifier variant and the calls currently using it"""
+
+    def __init__(self, variant, model, version):
+        self.variant = variant
+        self.model = model
+        self.version = version
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+
+
+class ModelRegistry:
+    """Versioned classifier handles that can be replaced while serving
+
+    Callers take the current handle of a variant with `acquire` and keep it
+    for the whole forward pass, so a swap never changes the model under a
+    running call. `install` replaces the current handle atomically; the old
+    one is unloaded as soon as its last in-flight call returns. Installing
+    again while that has not happened raises `VersionDraining`, so at most one
+    retired version per variant is held in memory alongside the new one.
+    """
+
+    def __init__(self):
+        self._current = {}
+        self._retired = []
+        self._lock = threading.Lock()
+        self.swaps = 0
+        self.unloads = 0
+
+    def __contains__(self, variant):
+        return variant in self._current
+
+    def __iter__(self):
+        return iter(list(self._current))
+
+    def __bool__(self):
+        return bool(self._current)
+
+    def current(self, variant):
+        return self._current[variant]
+
+    def versions(self):
+        return {variant: handle.version for variant, handle in self._current.items()}
+
+    def draining(self, variant):
+        """Whether a replaced version of `variant` is still in use"""
+        with self._lock:
+            return any(handle.variant == variant for handle in self._retired)
+
+    def install(self, variant, model, version):
+        """Make `model` the version served for `variant` and return the handle it replaced"""
+        handle = ModelHandle(variant, model, version)
+        with self._lock:
+            draining = [retired.version for retired in self._retired if retired.variant == variant]
+            if draining:
+                raise VersionDraining(f"{variant} model {draining[0]} is still finishing in-flight calls")
+            previous = self._current.get(variant)
+            self._current[variant] = handle
+            if previous is not None:
+                previous.retired = True
+                self.swaps += 1
+                if previous.in_flight == 0:
+                    self._unload(previous)
+                else:
+                    self._retired.append(previous)
+        return previous
+
+    @contextmanager
+    def acquire(self, variant):
+        """Pin the current version of `variant` for the duration of the `with` block"""
+        with self._lock:
+            handle = self._current[variant]
+            handle.in_flight += 1
+        try:
+            yield handle
+        finally:
+            with self._lock:
+                handle.in_flight -= 1
+                if handle.retired and handle.in_flight == 0:
+                    self._retired.remove(handle)
+                    self._unload(handle)
+
+    def _unload(self, handle):
+        # Dropping the last reference frees the tensors and unmaps the weights file
+        handle.model = None
+        self.unloads += 1
+        print(f"Unloaded {handle.variant} model {handle.version}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "current": {
+                    variant: {"version": handle.version, "in_flight": handle.in_flight, "loaded_at": handle.loaded_at}
+                    for variant, handle in self._current.items()
+                },
+                "retired": [
+                    {"variant": handle.variant, "version": handle.version, "in_flight": handle.in_flight}
+                    for handle in self._retired
+                ],
+                "swaps": self.swaps,
+                "unloads": self.unloads,
+            }
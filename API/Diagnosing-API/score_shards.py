@@ -0,0 +1,182 @@
+"""Score the preprocessing HDF5 embedding shards offline and write predictions as parquet
+
+Every `batch_XXXXX.h5` shard is scored by a pool of worker processes, each
+with its own copy of the classifier (memory-mapped, so the weight pages are
+shared). A shard is read chunk by chunk and only the rows listed in its
+`batch_XXXXX_metadata.parquet` are scored, in large batches. Results go to
+`<output>/batch_XXXXX_predictions.parquet` keyed by `file_id`.
+
+Each output file is written under a temporary name and renamed into place
+when complete. Re-running the same command after an interruption therefore
+skips the shards that are already done and redoes any partial one.
+
+    python score_shards.py data/embeddings/batch_*.h5 --metadata-dir data/metadata \\
+        --output data/predictions --workers 4
+
+Needs `h5py` and `pyarrow`.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import torch
+
+from constants import MODEL_CACHE_DIR
+from model import VARIANTS, PRECISIONS, backend_version, iter_classify, load_backend, weights_path
+
+# Set in each worker process by `init_worker`
+_model = None
+_model_version = None
+
+
+def init_worker(variant, model_path, precision, model_version, threads):
+    global _model, _model_version
+    torch.set_num_threads(threads)
+    _model = load_backend("eager", model_path, precision=precision, variant=variant)
+    _model_version = model_version
+
+
+def shard_name(shard):
+    return os.path.splitext(os.path.basename(shard))[0]
+
+
+def output_path(output_dir, shard):
+    return os.path.join(output_dir, f"{shard_name(shard)}_predictions.parquet")
+
+
+def metadata_path(shard, metadata_dir=None):
+    """The shard's metadata parquet, in `metadata_dir` or where the preprocessing notebook puts it"""
+    filename = f"{shard_name(shard)}_metadata.parquet"
+    shard_dir = os.path.dirname(os.path.abspath(shard))
+    candidates = [metadata_dir] if metadata_dir else [shard_dir, os.path.join(os.path.dirname(shard_dir), "metadata")]
+    for directory in candidates:
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {filename} in {', '.join(candidates)}")
+
+
+def read_metadata(path):
+    """file_id and embedding_index of every successfully embedded image, sorted by index"""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=["file_id", "embedding_index"]).to_pydict()
+    indices = np.asarray(table["embedding_index"], dtype=np.int64)
+    order = np.argsort(indices, kind="stable")
+    return [table["file_id"][i] for i in order], indices[order]
+
+
+def score_shard(shard, metadata, output, chunk_size, batch_size):
+    """Score one shard in a worker and write its predictions atomically"""
+    import h5py
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    started = time.perf_counter()
+    file_ids, indices = read_metadata(metadata)
+    predictions, confidences = [], []
+    with h5py.File(shard, "r") as h5f:
+        dataset = h5f["embeddings"]
+        for start in range(0, len(dataset), chunk_size):
+            stop = min(start + chunk_size, len(dataset))
+            low, high = np.searchsorted(indices, [start, stop])
+            if low == high:
+                continue
+            # One contiguous read per chunk, then keep the rows that have metadata
+            rows = np.asarray(dataset[start:stop], dtype=np.float32)[indices[low:high] - start]
+            for prediction, confidence in iter_classify(_model, rows, batch_size):
+                predictions.append(prediction)
+                confidences.append(confidence)
+
+    table = pa.table({
+        "file_id": file_ids,
+        "embedding_batch": [shard_name(shard)] * len(file_ids),
+        "embedding_index": indices,
+        "prediction": predictions,
+        "confidence": pa.array(confidences, type=pa.float32()),
+        "model_version": [_model_version] * len(file_ids),
+    })
+    partial = f"{output}.partial-{os.getpid()}"
+    pq.write_table(table, partial)
+    os.replace(partial, output)
+    return {"shard": shard, "rows": len(file_ids), "seconds": time.perf_counter() - started}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("shards", nargs="+", help="batch_XXXXX.h5 embedding shards")
+    parser.add_argument("--metadata-dir", help="Directory of the *_metadata.parquet files, "
+                                               "defaults to the shard directory or a sibling metadata/")
+    parser.add_argument("--output", required=True, help="Directory for the *_predictions.parquet files")
+    parser.add_argument("--variant", default="teacher", choices=list(VARIANTS))
+    parser.add_argument("--model-path", help="Local state dict, otherwise MODEL_CACHE_DIR and then the Hub")
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch intra-op threads per worker, defaults to cores / workers")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="Rows read from a shard at a time")
+    parser.add_argument("--batch-size", type=int, default=256, help="Embeddings per forward pass")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    pending = [shard for shard in args.shards if not os.path.exists(output_path(args.output, shard))]
+    skipped = len(args.shards) - len(pending)
+    if skipped:
+        print(f"Skipping {skipped} shards that are already scored", flush=True)
+    if not pending:
+        return
+
+    # Resolve the weights once here so workers never race to download them
+    model_path = weights_path(args.model_path, MODEL_CACHE_DIR, args.variant)
+    model_version = backend_version("eager", model_path, precision=args.precision, variant=args.variant)
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+
+    started = time.perf_counter()
+    total_rows, failed = 0, []
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=init_worker,
+        initargs=(args.variant, model_path, args.precision, model_version, threads),
+    ) as pool:
+        futures = {}
+        for shard in pending:
+            try:
+                metadata = metadata_path(shard, args.metadata_dir)
+            except FileNotFoundError as e:
+                failed.append({"shard": shard, "error": str(e)})
+                continue
+            future = pool.submit(score_shard, shard, metadata, output_path(args.output, shard),
+                                 args.chunk_size, args.batch_size)
+            futures[future] = shard
+
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                result = future.result()
+            except Exception as e:
+                failed.append({"shard": futures[future], "error": f"{type(e).__name__}: {e}"})
+                continue
+            total_rows += result["rows"]
+            elapsed = time.perf_counter() - started
+            print(f"[{done}/{len(futures)}] {result['shard']}: {result['rows']} rows in {result['seconds']:.1f}s, "
+                  f"{total_rows / elapsed:.0f} rows/s overall", flush=True)
+
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        "model_version": model_version,
+        "shards_scored": len(pending) - len(failed),
+        "shards_skipped": skipped,
+        "rows": total_rows,
+        "seconds": round(elapsed, 2),
+        "rows_per_s": round(total_rows / elapsed, 1) if elapsed else None,
+        "failed": failed,
+    }, indent=2))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Pre-fork server for the Diagnosing-API
+
+The parent process binds the listening socket and imports `main`, which loads
+the SelfSupervisedCancerModel weights exactly once. Workers are then forked
+and serve the same app object, so the weight pages stay shared copy-on-write
+(and, because the state dict is memory-mapped, backed by the page cache)
+instead of every uvicorn worker downloading and holding its own copy.
+
+    python serve.py --workers 4 --port 7860
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+
+import torch
+import uvicorn
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, threads, log_level):
+    # Forget the parent's handlers, uvicorn installs its own for graceful shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    torch.set_num_threads(threads)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=0,
+                        help="torch intra-op threads per worker, defaults to cores / workers")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    sock = bind_socket(args.host, args.port)
+
+    # Load the weights in the parent. No forward pass may run before forking,
+    # torch's thread pools do not survive fork, so each worker warms up itself.
+    import main as service
+    service.load()
+
+    # Keep the garbage collector from writing to the shared pages of every
+    # object that already exists, which would un-share them in each worker
+    gc.freeze()
+
+    workers = {}
+    shutting_down = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(service.app, sock, threads, args.log_level)
+            finally:
+                os._exit(0)
+        workers[pid] = True
+        return pid
+
+    def stop(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(args.workers):
+        spawn()
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers x {threads} torch threads", flush=True)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.pop(pid, None)
+        if not shutting_down:
+            print(f"Worker {pid} exited with status {status}, restarting", file=sys.stderr, flush=True)
+            spawn()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Run the service offline on random weights
+
+The environment is set before anything imports constants.py, so the app under
+test reads a temporary MODEL_PATH and never reaches the Hub. Small queue and
+batch sizes make back-pressure easy to trigger.
+"""
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+WEIGHTS_DIR = tempfile.mkdtemp(prefix="diagnosing-api-tests-")
+os.environ.update({
+    "MODEL_PATH": os.path.join(WEIGHTS_DIR, "cancer_detector_model.pth"),
+    "MODEL_CACHE_DIR": WEIGHTS_DIR,
+    "MODEL_VARIANTS": "teacher",
+    "INFERENCE_BACKEND": "eager",
+    "PRECISION": "fp32",
+    "MAX_BATCH_SIZE": "4",
+    "INFERENCE_QUEUE_SIZE": "4",
+    "PREDICTION_CACHE_BYTES": "0",
+})
+
+import numpy as np  # noqa: E402
+import torch  # noqa: E402
+
+from model import EMBEDDING_DIM, build_variant  # noqa: E402
+
+torch.manual_seed(0)
+torch.save(build_variant("teacher").state_dict(), os.environ["MODEL_PATH"])
+
+
+def embeddings(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, EMBEDDING_DIM), dtype=np.float32)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app.app) as client:
+        deadline = time.time() + 120
+        while (ready := client.get("/ready")).status_code != 200:
+            assert ready.json()["status"] != "failed", ready.json()["error"]
+            assert time.time() < deadline, "model did not load"
+            time.sleep(0.1)
+        yield client
@@ -0,0 +1,107 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from batching import MicroBatcher
+from conftest import embeddings
+from executor import ExecutorSaturated
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_concurrent_requests_share_one_batch():
+    calls = []
+
+    async def predict(batch):
+        calls.append(len(batch))
+        return [float(row[0]) for row in batch]
+
+    async def scenario():
+        batcher = MicroBatcher(predict, max_batch_size=8, window_ms=50)
+        await batcher.start()
+        rows = embeddings(5)
+        results = await asyncio.gather(*(batcher.submit(row) for row in rows))
+        await batcher.stop()
+        return rows, results
+
+    rows, results = run(scenario())
+    assert calls == [5]
+    assert results == [float(row[0]) for row in rows]
+
+
+def test_submit_refuses_beyond_max_queue_size():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def predict(batch):
+            await gate.wait()
+            return [0] * len(batch)
+
+        batcher = MicroBatcher(predict, max_batch_size=2, window_ms=0, max_queue_size=3)
+        await batcher.start()
+        admitted = [asyncio.create_task(batcher.submit(row)) for row in embeddings(3)]
+        await asyncio.sleep(0.01)
+        # Two rows are in a running batch and one is waiting, all count against the bound
+        assert batcher.pending == 3
+        with pytest.raises(ExecutorSaturated):
+            await batcher.submit(embeddings(1)[0])
+        gate.set()
+        await asyncio.gather(*admitted)
+        pending = batcher.pending
+        await batcher.stop()
+        return pending
+
+    assert run(scenario()) == 0
+
+
+def test_cancelled_callers_are_not_computed_and_free_their_slot():
+    calls = []
+
+    async def predict(batch):
+        calls.append(len(batch))
+        return [0] * len(batch)
+
+    async def scenario():
+        batcher = MicroBatcher(predict, max_batch_size=8, window_ms=50, max_queue_size=2)
+        await batcher.start()
+        gone = asyncio.create_task(batcher.submit(embeddings(1)[0]))
+        await asyncio.sleep(0)
+        gone.cancel()
+        result = await batcher.submit(embeddings(1, seed=1)[0])
+        pending = batcher.pending
+        await batcher.stop()
+        return result, pending
+
+    assert run(scenario()) == (0, 0)
+    assert calls == [1]
+
+
+def test_classify_sheds_load_with_503(app, client):
+    # INFERENCE_QUEUE_SIZE is 4, so most of a burst of 64 has to be refused rather than queued
+    bodies = [row.tobytes() for row in embeddings(64, seed=2)]
+
+    def post(body):
+        return client.post("/classify", content=body, headers={"content-type": "application/octet-stream"})
+
+    with ThreadPoolExecutor(max_workers=64) as pool:
+        statuses = [response.status_code for response in pool.map(post, bodies)]
+
+    assert set(statuses) <= {200, 503}
+    assert statuses.count(200) >= 1
+    assert statuses.count(503) >= 1
+    assert app.batchers["teacher"].pending == 0
+    assert post(bodies[0]).status_code == 200
+
+
+def test_classify_returns_prediction(client):
+    row = embeddings(1, seed=3)[0]
+    response = client.post("/classify", json={"features": row.tolist()})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["prediction"] in ("positive", "negative")
+    assert 0.5 <= body["confidence"] <= 1.0
+    assert np.isfinite(body["confidence"])
@@ -0,0 +1,73 @@
+import sqlite3
+import time
+
+from cache import ENTRY_BYTES, PredictionCache
+from conftest import embeddings
+
+
+def test_near_identical_embeddings_share_a_key():
+    cache = PredictionCache(decimals=4)
+    row = embeddings(1)[0]
+    assert cache.key(row) == cache.key(row + 1e-7)
+    assert cache.key(row) != cache.key(row + 1e-2)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_bytes=2 * ENTRY_BYTES)
+    first, second, third = (cache.key(row) for row in embeddings(3))
+    cache.put(first, ("negative", 0.9))
+    cache.put(second, ("positive", 0.8))
+    assert cache.get(first) == ("negative", 0.9)
+    cache.put(third, ("positive", 0.7))
+    assert cache.get(second) is None
+    assert cache.get(first) is not None
+    assert cache.evictions == 1
+
+
+def test_entries_expire_after_ttl():
+    cache = PredictionCache(ttl=0.05)
+    key = cache.key(embeddings(1)[0])
+    cache.put(key, ("negative", 0.9))
+    time.sleep(0.1)
+    assert cache.get(key) is None
+    assert cache.expirations == 1
+
+
+def test_model_version_change_drops_entries_and_stale_results():
+    cache = PredictionCache(model_version="v1")
+    key = cache.key(embeddings(1)[0])
+    cache.put(key, ("negative", 0.9), "v1")
+    cache.set_model_version("v2")
+    assert cache.get(key) is None
+    # A result still coming from the replaced model is not stored
+    cache.put(key, ("positive", 0.6), "v1")
+    assert cache.get(key) is None
+
+
+def test_disabled_cache_stores_nothing():
+    cache = PredictionCache(max_bytes=0)
+    key = cache.key(embeddings(1)[0])
+    cache.put(key, ("negative", 0.9))
+    assert not cache.enabled
+    assert cache.get(key) is None
+
+
+def test_disk_entries_survive_a_restart_and_expired_rows_are_deleted(tmp_path):
+    path = str(tmp_path / "predictions.sqlite")
+    rows = embeddings(3)
+    cache = PredictionCache(ttl=0.2, disk_path=path, model_version="v1")
+    keys = [cache.key(row) for row in rows]
+    for key in keys:
+        cache.put(key, ("negative", 0.9))
+
+    restarted = PredictionCache(ttl=0.2, disk_path=path, model_version="v1")
+    assert restarted.get(keys[0]) == ("negative", 0.9)
+
+    time.sleep(0.3)
+    assert restarted.get(keys[0]) is None
+    count = sqlite3.connect(path).execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+    assert count == 2
+    # Opening the file again prunes the rows nobody looked up
+    PredictionCache(ttl=0.2, disk_path=path, model_version="v1").get(keys[1])
+    count = sqlite3.connect(path).execute("SELECT COUNT(*) FROM predictions").fetchone()[0]
+    assert count == 0
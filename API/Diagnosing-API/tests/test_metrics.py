@@ -0,0 +1,30 @@
+import metrics
+
+
+def test_counter_callback_is_read_at_scrape_time():
+    totals = {"hits": 0}
+    counter = metrics.counter("test_hits_total", "Hits", {"cache": "test"}, fn=lambda: totals["hits"])
+    totals["hits"] = 7
+    assert counter.snapshot() == 7
+
+    text = metrics.render_prometheus()
+    assert "# TYPE test_hits_total counter" in text
+    assert 'test_hits_total{cache="test"} 7' in text
+
+
+def test_histogram_quantiles_and_prometheus_buckets():
+    histogram = metrics.histogram("test_latency_seconds", (0.1, 1.0), "Latency")
+    for value in (0.05, 0.05, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) <= 0.1
+
+    text = metrics.render_prometheus()
+    assert 'test_latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "test_latency_seconds_count 4" in text
+
+
+def test_metrics_endpoint_exposes_cache_totals_as_counters(client):
+    text = client.get("/metrics").text
+    assert "# TYPE prediction_cache_hits_total counter" in text
+    assert "# TYPE model_swaps_total counter" in text
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from conftest import embeddings
+from model import AutocastModel, NonFiniteOutput, build_variant, classify_batch, load_model
+
+
+class NanUnderAutocast(nn.Module):
+    """Linear classifier whose output turns NaN whenever autocast is on, like a bad bf16 kernel"""
+    def __init__(self):
+        super().__init__()
+        self.linear = nn.Linear(384, 2)
+        self.autocast_calls = 0
+
+    def forward(self, x):
+        output = self.linear(x.reshape(x.size(0), -1))
+        if torch.is_autocast_enabled("cpu"):
+            self.autocast_calls += 1
+            return torch.full_like(output, float("nan"))
+        return output
+
+
+def test_autocast_falls_back_to_fp32_for_good_on_non_finite_output():
+    inner = NanUnderAutocast()
+    model = AutocastModel(inner).eval()
+    assert model.precision == "bf16"
+
+    results = classify_batch(model, embeddings(3))
+    assert model.disabled
+    assert model.precision == "fp32"
+    assert all(np.isfinite(confidence) for _, confidence in results)
+
+    classify_batch(model, embeddings(3, seed=1))
+    assert inner.autocast_calls == 1
+
+
+def test_autocast_without_fallback_returns_raw_output():
+    model = AutocastModel(NanUnderAutocast(), fallback=False).eval()
+    with pytest.raises(NonFiniteOutput, match=r"\[0, 1\]"):
+        classify_batch(model, embeddings(2))
+    assert model.precision == "bf16"
+
+
+def test_student_loads_at_any_hidden_width(tmp_path):
+    path = str(tmp_path / "student.pth")
+    torch.save(build_variant("student", hidden=64).state_dict(), path)
+    model = load_model(path, variant="student")
+    assert model.net[0].out_features == 64
+    assert len(classify_batch(model, embeddings(2))) == 2
+
+
+def test_unknown_variant_is_rejected():
+    with pytest.raises(ValueError, match="Unknown model variant"):
+        build_variant("giant")
@@ -0,0 +1,46 @@
+import pytest
+
+from registry import ModelRegistry, VersionDraining
+
+
+def test_install_swaps_and_unloads_an_idle_version():
+    registry = ModelRegistry()
+    registry.install("teacher", "model-1", "v1")
+    previous = registry.install("teacher", "model-2", "v2")
+    assert previous.version == "v1"
+    assert previous.model is None
+    assert registry.current("teacher").version == "v2"
+    assert registry.stats()["unloads"] == 1
+
+
+def test_running_calls_keep_their_version_until_they_return():
+    registry = ModelRegistry()
+    registry.install("teacher", "model-1", "v1")
+    with registry.acquire("teacher") as handle:
+        registry.install("teacher", "model-2", "v2")
+        assert handle.model == "model-1"
+        assert registry.draining("teacher")
+    assert handle.model is None
+    assert not registry.draining("teacher")
+
+
+def test_at_most_one_retired_version_per_variant():
+    registry = ModelRegistry()
+    registry.install("teacher", "model-1", "v1")
+    with registry.acquire("teacher"):
+        registry.install("teacher", "model-2", "v2")
+        with pytest.raises(VersionDraining):
+            registry.install("teacher", "model-3", "v3")
+        assert registry.current("teacher").version == "v2"
+        assert len(registry.stats()["retired"]) == 1
+    registry.install("teacher", "model-3", "v3")
+    assert registry.current("teacher").version == "v3"
+
+
+def test_reload_returns_409_while_the_previous_version_drains(app, client, monkeypatch):
+    monkeypatch.setattr(app, "ADMIN_TOKEN", "secret")
+    with app.registry.acquire("teacher"):
+        app.registry.install("teacher", app.registry.current("teacher").model, "draining-test")
+        response = client.post("/admin/models/teacher/reload", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 409
+    assert not app.registry.draining("teacher")
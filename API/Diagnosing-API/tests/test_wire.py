@@ -0,0 +1,89 @@
+import io
+from typing import List
+
+import numpy as np
+import pytest
+from pydantic import BaseModel
+
+from conftest import embeddings
+from model import EMBEDDING_DIM
+from wire import UnsupportedMediaType, WireFormatError, decode_features
+
+
+class Features(BaseModel):
+    features: List[float]
+
+
+class BatchFeatures(BaseModel):
+    features: List[List[float]]
+
+
+def npy(array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def test_encodings_decode_to_the_same_array():
+    rows = embeddings(3)
+    json_body = BatchFeatures(features=rows.tolist()).model_dump_json()
+    for body, content_type in (
+        (json_body, "application/json"),
+        (rows.astype("<f4").tobytes(), "application/octet-stream"),
+        (npy(rows), "application/x-npy"),
+        (npy(rows.astype(">f8")), "application/x-npy"),
+    ):
+        decoded = decode_features(body, content_type, BatchFeatures)
+        assert decoded.shape == (3, EMBEDDING_DIM)
+        np.testing.assert_allclose(decoded, rows, rtol=1e-6)
+
+
+@pytest.mark.parametrize("value", [np.nan, np.inf, -np.inf])
+def test_non_finite_values_are_rejected_in_binary_bodies(value):
+    rows = embeddings(2)
+    rows[1, 7] = value
+    with pytest.raises(WireFormatError, match="finite"):
+        decode_features(rows.astype("<f4").tobytes(), "application/octet-stream", BatchFeatures)
+    with pytest.raises(WireFormatError, match="finite"):
+        decode_features(npy(rows), "application/x-npy", BatchFeatures)
+
+
+@pytest.mark.parametrize("literal", ["NaN", "Infinity", "1e39"])
+def test_non_finite_values_are_rejected_in_json(literal):
+    body = '{"features": [' + ", ".join([literal] + ["0.5"] * (EMBEDDING_DIM - 1)) + "]}"
+    with pytest.raises(WireFormatError, match="finite"):
+        decode_features(body, "application/json", Features)
+
+
+def test_shape_and_media_type_errors():
+    with pytest.raises(WireFormatError):
+        decode_features(b"\0" * 12, "application/octet-stream", Features)
+    with pytest.raises(WireFormatError):
+        decode_features(npy(np.zeros((2, 10), np.float32)), "application/x-npy", Features)
+    with pytest.raises(UnsupportedMediaType):
+        decode_features(b"", "text/csv", Features)
+
+
+def test_endpoints_answer_422_for_non_finite_features(client):
+    row = embeddings(1)[0]
+    row[0] = np.nan
+    response = client.post("/classify", content=row.tobytes(), headers={"content-type": "application/octet-stream"})
+    assert response.status_code == 422
+
+    rows = embeddings(4)
+    rows[2, 3] = np.inf
+    response = client.post("/classify_batch", content=npy(rows), headers={"content-type": "application/x-npy"})
+    assert response.status_code == 422
+
+    response = client.post("/classify", content=b"1,2,3", headers={"content-type": "text/csv"})
+    assert response.status_code == 415
+
+
+def test_classify_batch_keeps_input_order(client):
+    rows = embeddings(6, seed=4)
+    batch = client.post("/classify_batch", content=rows.tobytes(), headers={"content-type": "application/octet-stream"})
+    assert batch.status_code == 200
+    singles = [client.post("/classify", json={"features": row.tolist()}).json() for row in rows]
+    results = batch.json()["results"]
+    assert [r["prediction"] for r in results] == [s["prediction"] for s in singles]
+    np.testing.assert_allclose([r["confidence"] for r in results], [s["confidence"] for s in singles], atol=1e-5)
@@ -0,0 +1,102 @@
+import io
+
+import numpy as np
+from pydantic import ValidationError
+
+from model import EMBEDDING_DIM
+
+JSON = "application/json"
+RAW_FLOAT32 = "application/octet-stream"
+NPY = "application/x-npy"
+CONTENT_TYPES = (JSON, RAW_FLOAT32, NPY)
+
+
+class WireFormatError(ValueError):
+    """The request body could not be decoded into feature vectors"""
+
+
+class UnsupportedMediaType(ValueError):
+    """The request Content-Type is not one of CONTENT_TYPES"""
+
+
+def media_type(content_type):
+    return (content_type or JSON).split(";")[0].strip().lower()
+
+
+def _decode_raw(body):
+    if not body or len(body) % (4 * EMBEDDING_DIM):
+        raise WireFormatError(f"Raw float32 body length must be a multiple of {4 * EMBEDDING_DIM} bytes")
+    return np.frombuffer(body, dtype="<f4").reshape(-1, EMBEDDING_DIM)
+
+
+def _decode_npy(body):
+    stream = io.BytesIO(body)
+    try:
+        version = np.lib.format.read_magic(stream)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(stream)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(stream)
+    except ValueError as e:
+        raise WireFormatError(f"Invalid .npy body: {e}")
+    if dtype.hasobject or dtype.kind != "f":
+        raise WireFormatError(f".npy body must hold floating point data, got {dtype}")
+
+    count = int(np.prod(shape))
+    if len(body) - stream.tell() < count * dtype.itemsize:
+        raise WireFormatError(".npy body is shorter than its header says")
+    array = np.frombuffer(body, dtype=dtype, count=count, offset=stream.tell())
+    array = array.reshape(shape, order="F" if fortran_order else "C")
+    # Only copies when the sender used another float width or byte order
+    return array.astype(np.float32, copy=False)
+
+
+def decode_features(body, content_type, json_model):
+    """Decode a request body into a float32 array of shape (N, 384)
+
+    JSON bodies are validated with `json_model` (a pydantic model with a
+    `features` field) as before. Raw little-endian float32 and .npy bodies are
+    wrapped with np.frombuffer without copying, so the result may be read-only.
+    Values that are NaN or infinite, including JSON numbers beyond the float32
+    range, are rejected.
+    """
+    kind = media_type(content_type)
+    if kind == JSON:
+        try:
+            features = json_model.model_validate_json(body).features
+        except ValidationError as e:
+            raise WireFormatError(str(e))
+        try:
+            # Out of range values become inf and are rejected below
+            with np.errstate(over="ignore"):
+                array = np.asarray(features, dtype=np.float32)
+        except ValueError:
+            raise WireFormatError(f"Every feature vector must have length {EMBEDDING_DIM}")
+    elif kind == RAW_FLOAT32:
+        array = _decode_raw(body)
+    elif kind == NPY:
+        array = _decode_npy(body)
+    else:
+        raise UnsupportedMediaType(f"Unsupported Content-Type {kind!r}, expected one of {CONTENT_TYPES}")
+
+    if array.ndim not in (1, 2) or array.size == 0 or array.shape[-1] != EMBEDDING_DIM:
+        raise WireFormatError(f"Every feature vector must have length {EMBEDDING_DIM}")
+    # NaN or inf would only come back out of the model as a non-finite confidence
+    if not np.isfinite(array).all():
+        raise WireFormatError("Feature vectors must be finite, got NaN or infinity")
+    return array.reshape(-1, EMBEDDING_DIM)
+
+
+def openapi_body(json_model):
+    """OpenAPI requestBody listing the JSON schema alongside the binary formats"""
+    binary = {"schema": {"type": "string", "format": "binary"}}
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {
+                JSON: {"schema": json_model.model_json_schema()},
+                RAW_FLOAT32: binary,
+                NPY: binary,
+            },
+        }
+    }
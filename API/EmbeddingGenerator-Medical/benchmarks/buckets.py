@@ -0,0 +1,103 @@
+"""Startup cost and steady-state latency of the bucketed Path Foundation model
+
+For each --jit setting, loads the model through `load_model` and reports the
+SavedModel load, trace and first-call time of every bucket, then the latency
+of --repeats calls per bucket and of a mixed workload of random batch sizes.
+--baseline runs the same workloads on the bare serving signature, the way the
+service called the model before buckets, where each new batch size retraces.
+
+Needs TensorFlow and access to google/path-foundation (HF_TOKEN).
+
+    python benchmarks/buckets.py --buckets 1 8 32 --jit off on --baseline
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+import tensorflow as tf  # noqa: E402
+
+from embedding_generator import INPUT_SHAPE, MODEL_ID, load_model  # noqa: E402
+from huggingface_hub import snapshot_download  # noqa: E402
+
+
+def percentiles(samples):
+    samples = np.asarray(samples) * 1000.0
+    return {f"p{q}_ms": round(float(np.percentile(samples, q)), 2) for q in (50, 95, 99)}
+
+
+def images(count, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (count,) + INPUT_SHAPE, dtype=np.uint8)
+
+
+def time_calls(embed, batches):
+    samples = []
+    for batch in batches:
+        started = time.perf_counter()
+        embed(batch)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def workloads(embed, buckets, repeats, mixed_sizes):
+    report = {}
+    for bucket in buckets:
+        batch = images(bucket)
+        samples = time_calls(embed, [batch] * repeats)
+        report[str(bucket)] = {**percentiles(samples), "ms_per_image": round(float(np.median(samples)) * 1000.0 / bucket, 3)}
+    mixed = [images(size, seed) for seed, size in enumerate(mixed_sizes)]
+    samples = time_calls(embed, mixed)
+    report["mixed"] = {**percentiles(samples), "ms_per_image": round(sum(samples) * 1000.0 / sum(mixed_sizes), 3)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buckets", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--jit", choices=["off", "on"], nargs="+", default=["off", "on"])
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--mixed", type=int, default=100, help="Calls in the mixed batch size workload")
+    parser.add_argument("--baseline", action="store_true", help="Also time the bare serving signature")
+    args = parser.parse_args()
+
+    mixed_sizes = np.random.default_rng(1).integers(1, max(args.buckets) + 1, args.mixed).tolist()
+    report = {}
+    for jit in args.jit:
+        model = load_model(args.buckets, jit_compile=jit == "on")
+        stats = model.stats()
+        report[f"jit_{jit}"] = {
+            "startup": {
+                "load_s": round(stats["load_s"], 2),
+                "total_s": round(stats["startup_s"], 2),
+                **{bucket: {"trace_s": round(values["prepare_s"], 2), "first_call_s": round(values["warmup_s"], 2)}
+                   for bucket, values in stats["buckets"].items()},
+            },
+            "latency": workloads(model.embed, args.buckets, args.repeats, mixed_sizes),
+        }
+        del model
+
+    if args.baseline:
+        signature = tf.saved_model.load(snapshot_download(repo_id=MODEL_ID)).signatures["serving_default"]
+
+        def embed(batch):
+            return signature(tf.constant(batch / np.float32(255.0)))['output_0'].numpy()
+
+        first_calls = {}
+        for bucket in args.buckets:
+            started = time.perf_counter()
+            embed(images(bucket))
+            first_calls[str(bucket)] = {"first_call_s": round(time.perf_counter() - started, 2)}
+        report["baseline"] = {"startup": first_calls, "latency": workloads(embed, args.buckets, args.repeats, mixed_sizes)}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
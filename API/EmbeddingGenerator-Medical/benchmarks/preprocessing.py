@@ -0,0 +1,142 @@
+"""Throughput and peak memory of image preprocessing, original path versus optimised
+
+"baseline" repeats what `process_image` used to do: full-resolution decode,
+`convert('RGB')`, resize, `np.array`, then a float32 copy divided by 255.
+"optimised" is `preprocessing.load_image` (draft-mode JPEG decode and
+`Image.reduce`) normalising into a reused InputBuffer. Each mode runs in its
+own process, so peak RSS is measured in isolation. TensorFlow is not needed.
+
+Point --images at a folder of test images, or leave it out to generate a
+mixed set of large JPEG, PNG, TIFF and BMP files in a temporary directory.
+
+    python benchmarks/preprocessing.py --images data/test-patches --batch-size 32
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from preprocessing import IMAGE_SIZE, InputBuffer, load_image  # noqa: E402
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+# (format, extension, size) of the generated test set
+GENERATED = [
+    ("JPEG", ".jpg", (4000, 3000)),
+    ("JPEG", ".jpg", (1024, 1024)),
+    ("PNG", ".png", (2048, 2048)),
+    ("TIFF", ".tif", (3000, 3000)),
+    ("BMP", ".bmp", (512, 512)),
+    ("PNG", ".png", (224, 224)),
+]
+
+
+def generate_images(directory, count, seed=0):
+    rng = np.random.default_rng(seed)
+    for i in range(count):
+        fmt, ext, (width, height) = GENERATED[i % len(GENERATED)]
+        # Smooth gradients plus noise compress like real tissue rather than pure noise
+        y, x = np.mgrid[0:height, 0:width]
+        base = (np.stack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)], axis=-1))
+        noise = rng.integers(0, 32, size=(height, width, 3))
+        Image.fromarray((base + noise).clip(0, 255).astype(np.uint8)).save(os.path.join(directory, f"{i:04d}{ext}"), fmt)
+
+
+def baseline_batch(paths):
+    arrays = []
+    for path in paths:
+        img = Image.open(path).convert('RGB')
+        if img.size != IMAGE_SIZE:
+            img = img.resize(IMAGE_SIZE)
+        arrays.append(np.array(img).astype(np.float32) / 255.0)
+    return np.stack(arrays)
+
+
+def optimised_batch(paths, buffer):
+    batch = buffer.get(len(paths))
+    for i, path in enumerate(paths):
+        load_image(path, out=batch[i])
+    return batch
+
+
+def run_one(mode, paths, batch_size, repeats):
+    buffer = InputBuffer(batch_size)
+    process = baseline_batch if mode == "baseline" else lambda chunk: optimised_batch(chunk, buffer)
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for start in range(0, len(paths), batch_size):
+            process(paths[start:start + batch_size])
+    elapsed = time.perf_counter() - started
+    images = len(paths) * repeats
+    return {
+        "mode": mode,
+        "images": images,
+        "seconds": round(elapsed, 3),
+        "images_per_s": round(images / elapsed, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Folder of test images, a mixed set is generated when omitted")
+    parser.add_argument("--generate", type=int, default=24, help="Images to generate without --images")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--write-images", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.write_images:
+        generate_images(args.write_images, args.generate)
+        return
+
+    if args.run_one:
+        config = json.loads(args.run_one)
+        print(json.dumps(run_one(config["mode"], config["paths"], args.batch_size, args.repeats)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = args.images
+        if directory is None:
+            directory = tmp
+            # Generated in a child as well: Linux carries the peak RSS of a process over fork and exec
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--write-images", tmp,
+                            "--generate", str(args.generate)], check=True)
+        paths = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(EXTENSIONS)
+        )
+
+        results = []
+        for mode in ("baseline", "optimised"):
+            # A fresh process per mode keeps the peak RSS of one from hiding the other
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--batch-size", str(args.batch_size),
+                 "--repeats", str(args.repeats), "--run-one", json.dumps({"mode": mode, "paths": paths})],
+                capture_output=True, text=True,
+            )
+            lines = completed.stdout.strip().splitlines()
+            if completed.returncode != 0 or not lines:
+                results.append({"mode": mode, "error": completed.stderr.strip().splitlines()[-1:]})
+            else:
+                results.append(json.loads(lines[-1]))
+
+    baseline, optimised = results
+    report = {"images": len(paths), "batch_size": args.batch_size, "results": results}
+    if "images_per_s" in baseline and "images_per_s" in optimised:
+        report["speedup"] = round(optimised["images_per_s"] / baseline["images_per_s"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
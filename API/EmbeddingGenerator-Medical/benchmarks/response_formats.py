@@ -0,0 +1,97 @@
+"""Payload size and serialise/parse CPU of the /embeddings response formats
+
+Follows one embedding through both hops of a diagnosis:
+
+1. embedding service: `response_formats.embedding_response` renders the body
+2. Django backend: parses the body and builds the classifier request. JSON is
+   loaded and dumped again as `{"features": [...]}`, the binary formats are
+   turned into raw float32 bytes (passed through untouched for `float32`)
+3. classifier: parses its request body into a float32 array, `json.loads`
+   plus `np.asarray` for JSON and `np.frombuffer` for raw float32
+
+Times are per request, and TensorFlow is not needed.
+
+    python benchmarks/response_formats.py --repeats 2000
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+from embedding_cache import EMBEDDING_DIM  # noqa: E402
+from response_formats import FORMATS, UnsupportedFormat, embedding_response  # noqa: E402
+
+BASE64_DTYPES = {"float32": "<f4", "float16": "<f2"}
+
+
+def backend_hop(body, format):
+    """Body of the classifier request the backend sends, and its Content-Type"""
+    if format == "json":
+        return json.dumps({"features": json.loads(body)["embedding"]}).encode(), "json"
+    if format == "float32":
+        return body, "raw"
+    if format == "msgpack":
+        import msgpack
+
+        return msgpack.unpackb(body)["embedding"], "raw"
+    content = json.loads(body)
+    vector = np.frombuffer(base64.b64decode(content["embedding"]), dtype=BASE64_DTYPES[content["dtype"]])
+    return vector.astype("<f4").tobytes(), "raw"
+
+
+def classifier_hop(body, kind):
+    if kind == "json":
+        return np.asarray(json.loads(body)["features"], dtype=np.float32)
+    return np.frombuffer(body, dtype="<f4")
+
+
+def mean_us(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return round((time.perf_counter() - start) * 1e6 / repeats, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=2000)
+    args = parser.parse_args()
+
+    embedding = np.random.default_rng(0).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    report = []
+    for format in FORMATS:
+        try:
+            body = embedding_response("patch.png", embedding, format).body
+        except UnsupportedFormat:
+            # msgpack not installed
+            continue
+        forwarded, kind = backend_hop(body, format)
+        parsed = classifier_hop(forwarded, kind)
+        encode_us = mean_us(lambda: embedding_response("patch.png", embedding, format), args.repeats)
+        backend_us = mean_us(lambda: backend_hop(body, format), args.repeats)
+        classifier_us = mean_us(lambda: classifier_hop(forwarded, kind), args.repeats)
+        report.append({
+            "format": format,
+            "response_bytes": len(body),
+            "classifier_request_bytes": len(forwarded),
+            "encode_us": encode_us,
+            "backend_us": backend_us,
+            "classifier_parse_us": classifier_us,
+            "total_us": round(encode_us + backend_us + classifier_us, 2),
+            "max_abs_error": float(np.abs(parsed - embedding).max()),
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+
+# /embeddings/batch embeds EMBED_BATCH_SIZE images per model call. Requests
+# with more than MAX_BATCH_FILES images, or an image above MAX_IMAGE_BYTES,
+# are rejected.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "256"))
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(64 * 2**20)))
+
+# Single-image /embeddings requests are gathered into one model call of up to
+# EMBED_BATCH_SIZE images, waiting at most BATCH_WINDOW_MS for the batch to
+# fill. Beyond MAX_QUEUE_SIZE waiting images requests get 503.
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "10"))
+MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "256"))
+
+# Uploads are decoded in DECODE_WORKERS processes and every model call runs on
+# one dedicated thread, so neither blocks the event loop. At most
+# DECODE_QUEUE_SIZE images and MODEL_QUEUE_SIZE model calls may be running or
+# waiting, beyond that requests get 503.
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", str(os.cpu_count() or 1)))
+DECODE_QUEUE_SIZE = int(os.getenv("DECODE_QUEUE_SIZE", "1024"))
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE", "16"))
+
+# TensorFlow intra-op / inter-op thread pools, TensorFlow's defaults when unset
+TF_INTRA_OP_THREADS = int(os.getenv("TF_INTRA_OP_THREADS", "0"))
+TF_INTER_OP_THREADS = int(os.getenv("TF_INTER_OP_THREADS", "0"))
+
+# Embeddings are cached by the SHA-256 of the upload bytes and MODEL_VERSION,
+# which must change whenever the model or preprocessing does. CACHE_MAX_BYTES
+# bounds the in-memory LRU, 0 disables it. With CACHE_DIR set, embeddings are
+# also kept in a memory-mapped store of at most CACHE_DISK_MAX_BYTES there,
+# which survives restarts.
+MODEL_VERSION = os.getenv("MODEL_VERSION", "google/path-foundation")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 2**20)))
+CACHE_DIR = os.getenv("CACHE_DIR") or None
+CACHE_DISK_MAX_BYTES = int(os.getenv("CACHE_DISK_MAX_BYTES", str(2**30)))
+
+# /embeddings/slide cuts whole-slide images into 224x224 tiles every
+# SLIDE_STRIDE pixels and skips tiles with less than SLIDE_MIN_TISSUE tissue.
+# Slides are read SLIDE_REGION_SIZE pixels square at a time. Without
+# OpenSlide, slides that cannot be read region by region are only accepted up
+# to MAX_SLIDE_PIXELS. At most SLIDE_CONCURRENCY slides are tiled at once,
+# more get 503.
+MAX_SLIDE_BYTES = int(os.getenv("MAX_SLIDE_BYTES", str(4 * 2**30)))
+MAX_SLIDE_PIXELS = int(os.getenv("MAX_SLIDE_PIXELS", str(100_000_000)))
+SLIDE_STRIDE = int(os.getenv("SLIDE_STRIDE", "224"))
+SLIDE_MIN_TISSUE = float(os.getenv("SLIDE_MIN_TISSUE", "0.25"))
+SLIDE_REGION_SIZE = int(os.getenv("SLIDE_REGION_SIZE", "2048"))
+SLIDE_CONCURRENCY = int(os.getenv("SLIDE_CONCURRENCY", "2"))
+
+# Batch sizes the model is compiled and warmed for at startup. Every model
+# call is padded to the nearest one, so keep EMBED_BATCH_SIZE equal to the
+# largest. XLA_JIT_COMPILE=1 compiles the graph with XLA, which takes longer
+# to start but is usually faster per call.
+MODEL_BATCH_BUCKETS = tuple(int(size) for size in os.getenv("MODEL_BATCH_BUCKETS", "1,8,32").split(","))
+XLA_JIT_COMPILE = os.getenv("XLA_JIT_COMPILE", "0").lower() in ("1", "true", "yes")
+
+# Inference runtime: "tensorflow" runs the SavedModel from the Hub, "tflite"
+# and "onnx" the artifacts written by convert.py into RUNTIME_ARTIFACTS_DIR,
+# their int8 versions with RUNTIME_INT8=1. RUNTIME_NUM_THREADS sets the
+# TFLite / ONNX Runtime thread count, their default when 0.
+EMBEDDING_RUNTIME = os.getenv("EMBEDDING_RUNTIME", "tensorflow")
+RUNTIME_ARTIFACTS_DIR = os.getenv("RUNTIME_ARTIFACTS_DIR", "artifacts")
+RUNTIME_INT8 = os.getenv("RUNTIME_INT8", "0").lower() in ("1", "true", "yes")
+RUNTIME_NUM_THREADS = int(os.getenv("RUNTIME_NUM_THREADS", "0"))
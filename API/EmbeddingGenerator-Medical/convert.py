@@ -0,0 +1,132 @@
+"""Export Path Foundation to TFLite and ONNX for the lighter CPU runtimes
+
+    python convert.py --output artifacts --formats tflite onnx --int8 --calibration data/test-patches
+    python validate.py --images data/test-patches --artifacts artifacts --int8
+    EMBEDDING_RUNTIME=onnx RUNTIME_INT8=1 RUNTIME_ARTIFACTS_DIR=artifacts uvicorn main:app
+
+The fp32 artifacts are always written. --int8 adds post-training quantized
+ones next to them:
+
+- TFLite: full integer quantization of weights and activations, calibrated on
+  the --calibration images, with float32 input and output kept. Ops without an
+  int8 kernel stay in float.
+- ONNX: dynamic quantization, int8 weights and activations quantized at run
+  time, so no calibration is needed.
+
+Needs TensorFlow, plus tf2onnx, onnx and onnxruntime for ONNX. Serving the
+artifacts does not need TensorFlow.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from preprocessing import IMAGE_EXTENSIONS, load_image
+from runtime import INPUT_SHAPE, artifact_filename
+
+
+def calibration_images(directory, limit):
+    """Up to `limit` images from `directory`, normalised like the service input"""
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not paths:
+        raise SystemExit(f"No images found in {directory}")
+    return [load_image(path).astype(np.float32) / 255.0 for path in paths]
+
+
+def convert_tflite(model_path, path, calibration=None):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(model_path, signature_keys=["serving_default"])
+    if calibration is not None:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([image[np.newaxis]] for image in calibration)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+    return path
+
+
+def convert_onnx(model_path, path, opset=17):
+    import tensorflow as tf
+    import tf2onnx
+
+    saved_model = tf.saved_model.load(model_path)
+    signature = saved_model.signatures["serving_default"]
+
+    @tf.function
+    def infer(image):
+        return signature(image)['output_0']
+
+    tf2onnx.convert.from_function(
+        infer,
+        input_signature=[tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name="image")],
+        opset=opset,
+        output_path=path,
+    )
+    return path
+
+
+def quantize_onnx(fp32_path, path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(fp32_path, path, weight_type=QuantType.QInt8)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="artifacts")
+    parser.add_argument("--formats", nargs="+", default=["tflite", "onnx"], choices=["tflite", "onnx"])
+    parser.add_argument("--int8", action="store_true", help="Also write post-training int8 quantized artifacts")
+    parser.add_argument("--calibration", help="Image folder used to calibrate int8 TFLite activations")
+    parser.add_argument("--calibration-size", type=int, default=200)
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+    if args.int8 and "tflite" in args.formats and not args.calibration:
+        parser.error("--int8 TFLite needs --calibration images")
+
+    # Logs in to the Hub with HF_TOKEN, the model is gated
+    from embedding_generator import MODEL_ID, snapshot_download
+
+    model_path = snapshot_download(repo_id=MODEL_ID)
+    os.makedirs(args.output, exist_ok=True)
+    calibration = calibration_images(args.calibration, args.calibration_size) if args.int8 and args.calibration else None
+
+    jobs = []
+    if "tflite" in args.formats:
+        jobs.append(("tflite", False, lambda path: convert_tflite(model_path, path)))
+        if args.int8:
+            jobs.append(("tflite", True, lambda path: convert_tflite(model_path, path, calibration)))
+    if "onnx" in args.formats:
+        fp32_path = os.path.join(args.output, artifact_filename("onnx"))
+        jobs.append(("onnx", False, lambda path: convert_onnx(model_path, path, args.opset)))
+        if args.int8:
+            jobs.append(("onnx", True, lambda path: quantize_onnx(fp32_path, path)))
+
+    report = {}
+    for runtime, int8, convert in jobs:
+        path = os.path.join(args.output, artifact_filename(runtime, int8))
+        started = time.perf_counter()
+        try:
+            convert(path)
+        except Exception as e:
+            report[os.path.basename(path)] = {"error": str(e)}
+            continue
+        report[os.path.basename(path)] = {
+            "path": path,
+            "bytes": os.path.getsize(path),
+            "seconds": round(time.perf_counter() - started, 1),
+        }
+
+    print(json.dumps(report, indent=2))
+    if any("error" in result for result in report.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Content-addressed cache of Path Foundation embeddings
+
+Keys are the SHA-256 of the raw upload bytes together with the model version,
+so the same patch uploaded twice is only embedded once, and embeddings from a
+replaced model or preprocessing can never be returned.
+
+Two tiers:
+
+- memory: an LRU of recently used embeddings, bounded by `max_bytes`
+- disk (optional): a fixed-size ring of slots in two memory-mapped files, the
+  float32 (capacity, 384) vectors and a record of (key, sequence number) per
+  slot. Entries are only ever appended at the head, and once the ring is full
+  the oldest entry is overwritten. A dict from key to slot is rebuilt from the
+  records at startup, so hits survive restarts and cost one dict lookup and a
+  1.5 KB copy.
+
+The disk store belongs to one process. Run one store per worker, or leave
+CACHE_DIR unset when running several.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+EMBEDDING_DIM = 384
+# Approximate memory held per in-memory entry: the embedding, the 32-byte key
+# and the OrderedDict node around them
+ENTRY_BYTES = EMBEDDING_DIM * 4 + 200
+# Disk bytes per slot: the embedding plus its record
+SLOT_BYTES = EMBEDDING_DIM * 4 + 40
+
+INFO_FILENAME = "cache.json"
+VECTORS_FILENAME = "vectors.f32"
+RECORDS_FILENAME = "records.bin"
+RECORD_DTYPE = np.dtype([("key", "S32"), ("seq", "<u8")])
+
+
+class DiskStore:
+    """Append-only ring of embeddings in memory-mapped files, see the module docstring"""
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.capacity = max(1, max_bytes // SLOT_BYTES)
+        os.makedirs(path, exist_ok=True)
+        info = {"dim": EMBEDDING_DIM, "capacity": self.capacity}
+        info_path = os.path.join(path, INFO_FILENAME)
+        existing = None
+        if os.path.exists(info_path):
+            with open(info_path) as f:
+                existing = json.load(f)
+        # A store of another shape is started over rather than migrated
+        mode = "r+" if existing == info else "w+"
+        self.vectors = np.memmap(os.path.join(path, VECTORS_FILENAME), dtype=np.float32, mode=mode,
+                                 shape=(self.capacity, EMBEDDING_DIM))
+        self.records = np.memmap(os.path.join(path, RECORDS_FILENAME), dtype=RECORD_DTYPE, mode=mode,
+                                 shape=(self.capacity,))
+        if mode == "w+":
+            with open(info_path, "w") as f:
+                json.dump(info, f)
+
+        # Sequence 0 marks an empty slot. A slot whose write was interrupted keeps
+        # sequence 0 too, the record is only written once the vector is in place.
+        used = np.flatnonzero(self.records["seq"])
+        self.index = {bytes(self.records["key"][slot]): int(slot) for slot in used}
+        self.seq = int(self.records["seq"].max()) if len(used) else 0
+        self.head = (int(self.records["seq"].argmax()) + 1) % self.capacity if len(used) else 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, key):
+        slot = self.index.get(key)
+        return None if slot is None else np.array(self.vectors[slot])
+
+    def append(self, key, embedding):
+        """Write `embedding` at the head, overwriting the oldest entry once the ring is full
+
+        Returns whether an entry was evicted.
+        """
+        if key in self.index:
+            return False
+        slot = self.head
+        evicted = False
+        if self.records["seq"][slot]:
+            self.index.pop(bytes(self.records["key"][slot]), None)
+            self.records["seq"][slot] = 0
+            evicted = True
+        self.vectors[slot] = embedding
+        self.seq += 1
+        self.records[slot] = (key, self.seq)
+        self.index[key] = slot
+        self.head = (slot + 1) % self.capacity
+        return evicted
+
+    def flush(self):
+        self.vectors.flush()
+        self.records.flush()
+
+
+class EmbeddingCache:
+    """Two-tier cache of (384,) embeddings keyed by upload content and model version
+
+    `max_bytes=0` disables the memory tier, `disk_path=None` the disk tier.
+    """
+
+    def __init__(self, model_version, max_bytes=64 * 2**20, disk_path=None, disk_max_bytes=2**30):
+        self.model_version = model_version
+        self.max_entries = max_bytes // ENTRY_BYTES
+        self.disk = DiskStore(disk_path, disk_max_bytes) if disk_path else None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 or self.disk is not None
+
+    def key(self, data):
+        """SHA-256 of the model version and the raw image bytes"""
+        digest = hashlib.sha256(self.model_version.encode())
+        digest.update(b"\0")
+        digest.update(data)
+        return digest.digest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+            embedding = self.disk.get(key) if self.disk is not None else None
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._insert(key, embedding)
+            return embedding
+
+    def put(self, key, embedding):
+        if not self.enabled:
+            return
+        embedding = np.asarray(embedding, dtype=np.float32).reshape(EMBEDDING_DIM)
+        with self._lock:
+            self._insert(key, embedding)
+            if self.disk is not None and self.disk.append(key, embedding):
+                self.disk_evictions += 1
+
+    def _insert(self, key, embedding):
+        if not self.max_entries:
+            return
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def flush(self):
+        if self.disk is not None:
+            with self._lock:
+                self.disk.flush()
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "model_version": self.model_version,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "disk_entries": len(self.disk) if self.disk is not None else 0,
+                "disk_capacity": self.disk.capacity if self.disk is not None else 0,
+                "disk_evictions": self.disk_evictions,
+                "disk_path": self.disk.path if self.disk is not None else None,
+            }
+
+    def render_prometheus(self, prefix="embedding_cache"):
+        """Hit, miss and eviction counters in the Prometheus text exposition format"""
+        stats = self.stats()
+        return "\n".join([
+            f"# HELP {prefix}_hits_total Embeddings served from the cache",
+            f"# TYPE {prefix}_hits_total counter",
+            f'{prefix}_hits_total{{tier="memory"}} {stats["memory_hits"]}',
+            f'{prefix}_hits_total{{tier="disk"}} {stats["disk_hits"]}',
+            f"# HELP {prefix}_misses_total Lookups that had to run the model",
+            f"# TYPE {prefix}_misses_total counter",
+            f"{prefix}_misses_total {stats['misses']}",
+            f"# HELP {prefix}_evictions_total Entries dropped to stay within the size bounds",
+            f"# TYPE {prefix}_evictions_total counter",
+            f'{prefix}_evictions_total{{tier="memory"}} {stats["evictions"]}',
+            f'{prefix}_evictions_total{{tier="disk"}} {stats["disk_evictions"]}',
+            f"# HELP {prefix}_entries Embeddings held in each tier",
+            f"# TYPE {prefix}_entries gauge",
+            f'{prefix}_entries{{tier="memory"}} {stats["entries"]}',
+            f'{prefix}_entries{{tier="disk"}} {stats["disk_entries"]}',
+        ]) + "\n"
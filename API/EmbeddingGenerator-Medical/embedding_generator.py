@@ -1,4 +1,4 @@
-from huggingface_hub import login, from_pretrained_keras
+from huggingface_hub import login, snapshot_download
 
 import os
 import glob
@@ -10,6 +10,8 @@ from PIL import Image
 from tqdm import tqdm
 import tensorflow as tf
 from dotenv import load_dotenv
+from preprocessing import load_image
+from runtime import BATCH_BUCKETS, INPUT_SHAPE, BucketedRuntime
 
 load_dotenv()
 
@@ -18,69 +20,77 @@ if hf_token is None:
     print("Hugging Face token not found. Please set the HF_TOKEN environment variable.")
 login(token=hf_token)
 
-def load_model():
-    """Load PathFoundation model from Hugging Face"""
-    print("Loading PathFoundation model...")
-    model = from_pretrained_keras("google/path-foundation")
-    infer = model.signatures["serving_default"]
-    print("Model loaded!")
-    return infer
+MODEL_ID = "google/path-foundation"
+
+
+class BucketedModel(BucketedRuntime):
+    """Path Foundation compiled once for each batch size in `buckets`
+
+    The serving signature is wrapped in a single tf.function, optionally XLA
+    compiled, and traced up front for a fixed (bucket, 224, 224, 3) input per
+    bucket, so calls never retrace.
+    """
+
+    def __init__(self, signature, buckets=BATCH_BUCKETS, jit_compile=False, saved_model=None):
+        self.jit_compile = jit_compile
+        # The signature's variables belong to the loaded SavedModel
+        self._saved_model = saved_model
+
+        @tf.function(jit_compile=jit_compile)
+        def infer(images):
+            return signature(images)['output_0']
+
+        self._infer = infer
+        self._functions = {}
+        super().__init__(buckets, version="tensorflow-xla" if jit_compile else "tensorflow")
+
+    def _prepare(self, bucket):
+        self._functions[bucket] = self._infer.get_concrete_function(tf.TensorSpec((bucket,) + INPUT_SHAPE, tf.float32))
+
+    def _run(self, bucket, batch):
+        # tf.constant takes its own copy of the reused buffer
+        return self._functions[bucket](tf.constant(batch)).numpy()
 
-def load_model():
-    """Load PathFoundation model from Hugging Face"""
+
+def load_model(buckets=BATCH_BUCKETS, jit_compile=False):
+    """Load PathFoundation model from Hugging Face, compiled and warmed for every batch bucket"""
     print("Loading PathFoundation model...")
-    import tensorflow as tf
-    import keras
-    from huggingface_hub import snapshot_download
-    
-    # Download the model from HuggingFace
-    model_path = snapshot_download(repo_id="google/path-foundation")
-    
-    # Load as TFSMLayer
-    model = keras.layers.TFSMLayer(
-        model_path,
-        call_endpoint='serving_default'
-    )
+    model_path = snapshot_download(repo_id=MODEL_ID)
+    started = time.perf_counter()
+    saved_model = tf.saved_model.load(model_path)
+    load_seconds = time.perf_counter() - started
+    model = BucketedModel(saved_model.signatures["serving_default"], buckets, jit_compile, saved_model=saved_model)
+    model.load_seconds = load_seconds
+    model.warm_up()
     print("Model loaded!")
     return model
 
 
-def process_image(image_input, infer_function):
+def embed_batch(images, model):
+    """Embed a stack of preprocessed images with as few model calls as the buckets allow
+
+    Args:
+        images: uint8 array of shape (N, 224, 224, 3), as returned by `load_image`
+        model: A runtime from `load_model` or `runtime.load_runtime`
+
+    Returns:
+        float32 array of shape (N, 384), in input order
+    """
+    return model.embed(images)
+
+
+def process_image(image_input, model):
     """Process a single image and get embedding
     
     Args:
         image_input: Either a file path (str) or image data (bytes/BytesIO/numpy array)
-        infer_function: The model inference function
+        model: A runtime from `load_model` or `runtime.load_runtime`
     
     Returns:
         Embedding vector or None if processing fails
     """
     try:
-        # Handle different input types
-        if isinstance(image_input, str):
-            # It's a file path
-            img = Image.open(image_input).convert('RGB')
-        elif isinstance(image_input, bytes) or hasattr(image_input, 'read'):
-            # It's image data from frontend (bytes or BytesIO)
-            img = Image.open(image_input).convert('RGB')
-        elif isinstance(image_input, np.ndarray):
-            # It's already a numpy array
-            img = Image.fromarray(image_input.astype('uint8')).convert('RGB')
-        else:
-            raise ValueError(f"Unsupported image input type: {type(image_input)}")
-        
-        # Resize to 224x224 if needed
-        if img.size != (224, 224):
-            img = img.resize((224, 224))
-        # Convert to tensor and normalize
-        tensor = tf.cast(tf.expand_dims(np.array(img), axis=0), tf.float32) / 255.0
-        
-        # Get embedding
-        embeddings = infer_function(tf.constant(tensor))
-
-        embedding_vector = embeddings['output_0'].numpy().flatten()
-   
-        return embedding_vector
+        return model.embed(load_image(image_input)[np.newaxis])[0]
     except Exception as e:
         print(f"Error processing image: {e}")
         return None
@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class ExecutorBusy(Exception):
+    """Raised when an executor already has `max_pending` calls running or waiting"""
+
+
+def configure_tf_threads(intra_op_threads=0, inter_op_threads=0):
+    """Apply TensorFlow thread counts, ignoring unset values
+
+    Has to run before the model is loaded, TensorFlow fixes its thread pools
+    when the runtime starts.
+    """
+    import tensorflow as tf
+
+    if intra_op_threads:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    if inter_op_threads:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+class BoundedExecutor:
+    """Admission-limited wrapper around a concurrent.futures executor
+
+    At most `max_pending` calls may be running or waiting at once. Beyond that
+    `run` and `map` raise ExecutorBusy straight away, so the endpoints can shed
+    load with a 503 instead of queueing without limit and stalling every
+    request behind them.
+    """
+
+    def __init__(self, pool, name, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self._pool = pool
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    @property
+    def saturated(self):
+        return self._pending >= self.max_pending
+
+    def _admit(self, count):
+        with self._lock:
+            if self._pending + count > self.max_pending:
+                raise ExecutorBusy(f"The {self.name} queue is full ({self._pending} of {self.max_pending} pending)")
+            self._pending += count
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._pending -= 1
+
+    def _submit(self, fn, args):
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        # Released when the call finishes, wherever it ran
+        future.add_done_callback(self._release)
+        return asyncio.wrap_future(future)
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` on the pool and await its result, or raise ExecutorBusy"""
+        self._admit(1)
+        return await self._submit(fn, args)
+
+    async def map(self, fn, items):
+        """Run `fn` on every item, admitting all of them or none, and return results in order"""
+        items = list(items)
+        self._admit(len(items))
+        futures = []
+        for index, item in enumerate(items):
+            try:
+                futures.append(self._submit(fn, (item,)))
+            except BaseException:
+                # Slots of the items that were never submitted
+                for _ in items[index + 1:]:
+                    self._release()
+                raise
+        return await asyncio.gather(*futures)
+
+    def stats(self):
+        return {"pending": self._pending, "max_pending": self.max_pending}
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def decode_executor(processes, max_pending):
+    """Process pool for CPU-bound image decoding, off the GIL of the serving process
+
+    Workers are spawned rather than forked, so they never inherit the
+    TensorFlow runtime. They only import `preprocessing`.
+    """
+    pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+    return BoundedExecutor(pool, "decode", max_pending)
+
+
+def model_executor(max_pending):
+    """Single thread that owns every TensorFlow model call"""
+    return BoundedExecutor(ThreadPoolExecutor(max_workers=1, thread_name_prefix="tf-model"), "model", max_pending)
+
+
+def render_executors_prometheus(executors, prefix="embedding"):
+    """Pending calls of each executor in the Prometheus text exposition format"""
+    lines = [
+        f"# HELP {prefix}_executor_pending Calls running or waiting on each executor",
+        f"# TYPE {prefix}_executor_pending gauge",
+    ]
+    lines.extend(f'{prefix}_executor_pending{{executor="{executor.name}"}} {executor.pending}' for executor in executors)
+    return "\n".join(lines) + "\n"
@@ -1,46 +1,322 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from contextlib import aclosing, asynccontextmanager
 import uvicorn
-from typing import List
+from typing import List, Optional
+import asyncio
+import json
 import os
+import shutil
+import tempfile
+import zipfile
 import numpy as np
 from PIL import Image
 import io
-from embedding_generator import load_model, process_image
+from config import (
+    EMBED_BATCH_SIZE, DECODE_WORKERS, MAX_BATCH_FILES, MAX_IMAGE_BYTES, BATCH_WINDOW_MS, MAX_QUEUE_SIZE,
+    DECODE_QUEUE_SIZE, MODEL_QUEUE_SIZE, TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS,
+    MODEL_VERSION, CACHE_MAX_BYTES, CACHE_DIR, CACHE_DISK_MAX_BYTES,
+    MAX_SLIDE_BYTES, MAX_SLIDE_PIXELS, SLIDE_STRIDE, SLIDE_MIN_TISSUE, SLIDE_REGION_SIZE, SLIDE_CONCURRENCY,
+    MODEL_BATCH_BUCKETS, XLA_JIT_COMPILE, EMBEDDING_RUNTIME, RUNTIME_ARTIFACTS_DIR, RUNTIME_INT8, RUNTIME_NUM_THREADS,
+)
+from embedding_cache import EmbeddingCache
+from response_formats import UnsupportedFormat, batch_response, embedding_response, negotiate, vector_fields
+from executors import ExecutorBusy, configure_tf_threads, decode_executor, model_executor, render_executors_prometheus
 
-app = FastAPI(title="Medical Image Embedding Generator")
+# Before the model load starts the TensorFlow runtime
+if EMBEDDING_RUNTIME == "tensorflow":
+    configure_tf_threads(TF_INTRA_OP_THREADS, TF_INTER_OP_THREADS)
+
+from runtime import load_runtime
+from preprocessing import is_image, load_image, try_load_image
+from scheduler import BatchScheduler, QueueFull
+from tiling import MIN_STRIDE, SlideError, SlideTooLarge, embed_slide, open_slide
 
 
 global infer
-infer = load_model()
+# Compiled and warmed for every batch bucket before the first request
+infer = load_runtime(
+    EMBEDDING_RUNTIME, MODEL_BATCH_BUCKETS, jit_compile=XLA_JIT_COMPILE,
+    artifacts_dir=RUNTIME_ARTIFACTS_DIR, int8=RUNTIME_INT8, num_threads=RUNTIME_NUM_THREADS,
+)
+
+# CPU-bound decoding runs in worker processes, model calls on one thread that owns the model
+decoder = decode_executor(DECODE_WORKERS, DECODE_QUEUE_SIZE)
+model_thread = model_executor(MODEL_QUEUE_SIZE)
+
+# Re-uploaded images are answered without decoding or running the model
+# Keyed on the runtime too, converted and quantized models give slightly different embeddings
+cache = EmbeddingCache(f"{MODEL_VERSION}/{infer.version}", max_bytes=CACHE_MAX_BYTES, disk_path=CACHE_DIR, disk_max_bytes=CACHE_DISK_MAX_BYTES)
+
+# Concurrent /embeddings requests share one model call
+scheduler = BatchScheduler(
+    lambda images: model_thread.run(infer.embed, images),
+    max_batch_size=EMBED_BATCH_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    max_queue_size=MAX_QUEUE_SIZE,
+    buckets=infer.buckets,
+)
+
+# Slides being tiled, each holds a couple of regions and a batch of tiles
+slide_slots = asyncio.Semaphore(SLIDE_CONCURRENCY)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await scheduler.start()
+    yield
+    await scheduler.stop()
+    decoder.shutdown()
+    model_thread.shutdown()
+    cache.flush()
+
+app = FastAPI(title="Medical Image Embedding Generator", lifespan=lifespan)
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+
+
+def is_zip(filename, content_type=None):
+    return content_type in ZIP_CONTENT_TYPES or (filename or "").lower().endswith(".zip")
+
+
+def expand_uploads(uploads):
+    """Flatten uploaded images and zip archives of images into (filename, data, error) items"""
+    items = []
+    for filename, content_type, data in uploads:
+        if is_zip(filename, content_type):
+            try:
+                archive = zipfile.ZipFile(io.BytesIO(data))
+            except zipfile.BadZipFile:
+                items.append((filename, None, "Not a valid zip archive"))
+                continue
+            for member in archive.infolist():
+                if member.is_dir() or not is_image(member.filename):
+                    continue
+                name = f"{filename}/{member.filename}"
+                if member.file_size > MAX_IMAGE_BYTES:
+                    items.append((name, None, f"Image is larger than {MAX_IMAGE_BYTES} bytes"))
+                else:
+                    items.append((name, archive.read(member), None))
+        elif not is_image(filename, content_type):
+            items.append((filename, None, "File must be an image (JPEG, PNG, BMP) or TIFF format"))
+        elif len(data) > MAX_IMAGE_BYTES:
+            items.append((filename, None, f"Image is larger than {MAX_IMAGE_BYTES} bytes"))
+        else:
+            items.append((filename, data, None))
+        if len(items) > MAX_BATCH_FILES:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_FILES} images per request")
+    return items
+
+
+async def embed_items(items):
+    """Embed every decodable item, EMBED_BATCH_SIZE images per model call, keeping input order
+
+    Cached images are neither decoded nor embedded again.
+    """
+    keys = [cache.key(data) if error is None else None for _, data, error in items]
+    cached = [cache.get(key) if key is not None else None for key in keys]
+    to_decode = [index for index, (_, _, error) in enumerate(items) if error is None and cached[index] is None]
+    decoded = [(None, error) for _, _, error in items]
+    for index, result in zip(to_decode, await decoder.map(try_load_image, [items[i][1] for i in to_decode])):
+        decoded[index] = result
+    results = [
+        {"index": index, "filename": filename, "error": error}
+        for index, ((filename, _, _), (_, error)) in enumerate(zip(items, decoded))
+    ]
+    for index, embedding in enumerate(cached):
+        if embedding is not None:
+            del results[index]["error"]
+            results[index]["embedding"] = embedding
+    valid = [index for index, (image, _) in enumerate(decoded) if image is not None]
+    for start in range(0, len(valid), EMBED_BATCH_SIZE):
+        chunk = valid[start:start + EMBED_BATCH_SIZE]
+        try:
+            embeddings = await model_thread.run(infer.embed, np.stack([decoded[index][0] for index in chunk]))
+        except ExecutorBusy:
+            raise
+        except Exception as e:
+            for index in chunk:
+                results[index]["error"] = f"Error generating embedding: {str(e)}"
+            continue
+        for index, embedding in zip(chunk, embeddings):
+            cache.put(keys[index], embedding)
+            del results[index]["error"]
+            results[index]["embedding"] = embedding
+    return results
+
+
+def response_format(format, accept):
+    try:
+        return negotiate(format, accept)
+    except UnsupportedFormat as e:
+        raise HTTPException(status_code=406, detail=str(e))
 
 
 @app.post("/embeddings")
-async def generate_embeddings(file: UploadFile = File(...)):
+async def generate_embeddings(file: UploadFile = File(...), format: Optional[str] = None,
+                              accept: Optional[str] = Header(None)):
     """
     Upload a medical image (JPEG, PNG, TIFF) and get embeddings
+
+    The embedding is a JSON number list unless `?format=` or `Accept` asks for
+    a compact encoding, see response_formats.py.
     """
+    format = response_format(format, accept)
     content_type = file.content_type
     if not (content_type.startswith("image/") or 
             file.filename.endswith((".tif", ".tiff", ".jpg", ".jpeg", ".png", ".bmp"))):
         raise HTTPException(status_code=400, detail="File must be an image (JPEG, PNG, BMP) or TIFF format")
+    if file.size is not None and file.size > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_IMAGE_BYTES} bytes")
     
+    data = await file.read()
+    if len(data) > MAX_IMAGE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Image is larger than {MAX_IMAGE_BYTES} bytes")
+    key = cache.key(data)
+    embedding = cache.get(key)
+    if embedding is not None:
+        return embedding_response(file.filename, embedding, format)
+
     try:
-        # Read the file content
-        embedding = process_image(file.file, infer)
-        if embedding is None:
-            raise HTTPException(status_code=500, detail="Error processing image")
-        
-        return_content = {
-            "filename": file.filename,
-            "embedding": embedding.tolist(),
-        }
-        
-        return JSONResponse(content=return_content)
-    
+        image = await decoder.run(load_image, data)
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
+    try:
+        # Embedded together with whatever other requests are waiting
+        embedding = await scheduler.submit(image)
+        cache.put(key, embedding)
+
+        return embedding_response(file.filename, embedding, format)
+
+    except (QueueFull, ExecutorBusy) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
+
+@app.post("/embeddings/batch")
+async def generate_batch_embeddings(files: List[UploadFile] = File(...), format: Optional[str] = None,
+                                    accept: Optional[str] = Header(None)):
+    """
+    Upload many medical images, or zip archives of them, and get one embedding per image
+
+    Results are returned in upload order (zip members in archive order). A file
+    that cannot be decoded or embedded gets an `error` instead of an `embedding`
+    and does not fail the rest of the batch. `?format=` and `Accept` pick the
+    encoding as for /embeddings.
+    """
+    format = response_format(format, accept)
+    uploads = [(file.filename, file.content_type, await file.read()) for file in files]
+    items = expand_uploads(uploads)
+    if not items:
+        raise HTTPException(status_code=400, detail="No images found in the upload")
+
+    try:
+        results = await embed_items(items)
+    except ExecutorBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return batch_response(results, format)
+
+
+async def embed_tiles(images):
+    """Model call for a slide batch, waiting for room on the model thread rather than failing mid-stream"""
+    while True:
+        try:
+            return await model_thread.run(infer.embed, images)
+        except ExecutorBusy:
+            await asyncio.sleep(0.05)
+
+
+def save_upload(file, path):
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file, f, 2**20)
+
+
+@app.post("/embeddings/slide")
+async def generate_slide_embeddings(file: UploadFile = File(...), stride: int = SLIDE_STRIDE,
+                                    min_tissue: float = SLIDE_MIN_TISSUE, format: Optional[str] = None):
+    """
+    Upload a whole-slide image and stream an embedding per 224x224 tissue tile
+
+    The response is newline-delimited JSON: one `{"x", "y", "tissue",
+    "embedding"}` line per tile, then a summary line with the tile counts and
+    the mean slide `embedding`. `?format=base64-float32` or `base64-float16`
+    packs the vectors as for /embeddings.
+    """
+    format = response_format(format, None)
+    if format not in ("json", "base64-float32", "base64-float16"):
+        raise HTTPException(status_code=406, detail="Slides are streamed as JSON lines, use json or a base64 format")
+    if not 0.0 <= min_tissue <= 1.0:
+        raise HTTPException(status_code=400, detail="min_tissue must be between 0 and 1")
+    if stride < MIN_STRIDE:
+        # Tiles grow as (TILE_SIZE / stride)**2, below this a slide is mostly recomputed overlap
+        raise HTTPException(status_code=422, detail=f"stride must be at least {MIN_STRIDE} pixels")
+    if file.size is not None and file.size > MAX_SLIDE_BYTES:
+        raise HTTPException(status_code=413, detail=f"Slide is larger than {MAX_SLIDE_BYTES} bytes")
+    if slide_slots.locked():
+        raise HTTPException(status_code=503, detail=f"{SLIDE_CONCURRENCY} slides are already being tiled")
+
+    await slide_slots.acquire()
+    reader = None
+    # OpenSlide reads from a path, so the upload goes to a named file first
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(file.filename or "")[1])
+    os.close(fd)
+    try:
+        await asyncio.to_thread(save_upload, file.file, path)
+        reader = await asyncio.to_thread(open_slide, path, MAX_SLIDE_PIXELS)
+    except SlideError as e:
+        os.unlink(path)
+        slide_slots.release()
+        raise HTTPException(status_code=413 if isinstance(e, SlideTooLarge) else 400, detail=str(e))
+    except BaseException:
+        os.unlink(path)
+        slide_slots.release()
+        raise
+
+    async def stream():
+        try:
+            # Closed before the reader below, even when the client goes away mid-slide
+            async with aclosing(embed_slide(reader, embed_tiles, stride=stride, min_tissue=min_tissue,
+                                            batch_size=EMBED_BATCH_SIZE, region_size=SLIDE_REGION_SIZE)) as items:
+                async for item in items:
+                    if item["embedding"] is not None:
+                        item.update(vector_fields(item["embedding"], format))
+                    yield json.dumps(item) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"Error tiling slide: {str(e)}"}) + "\n"
+        finally:
+            reader.close()
+            os.unlink(path)
+            slide_slots.release()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.get("/stats")
+async def stats():
+    """Queue depth and batch size distribution of the /embeddings scheduler, executor and cache counters"""
+    return {
+        "scheduler": scheduler.stats(),
+        "decoder": decoder.stats(),
+        "model": model_thread.stats(),
+        "inference": infer.stats(),
+        "cache": cache.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    body = "".join([
+        scheduler.render_prometheus(),
+        render_executors_prometheus([decoder, model_thread]),
+        cache.render_prometheus(),
+        infer.render_prometheus(),
+    ])
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Medical Image Embedding Generator API. Use /embeddings endpoint to upload images."}
\ No newline at end of file
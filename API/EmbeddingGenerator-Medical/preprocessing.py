@@ -0,0 +1,130 @@
+"""Image decoding and normalisation for Path Foundation
+
+Kept free of TensorFlow so decode worker processes start quickly and stay small.
+
+Large inputs are never decoded or resized at full resolution. JPEGs are
+decoded in draft mode, where libjpeg downscales by 1/2, 1/4 or 1/8 during the
+DCT. Other formats are shrunk with the cheap box filter of `Image.reduce`.
+Both stop at twice the model input size, so the final bicubic resize still
+has enough pixels to work with.
+"""
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Input size of Path Foundation
+IMAGE_SIZE = (224, 224)
+# Cheap downscaling stops once the image is within this factor of IMAGE_SIZE
+REDUCING_GAP = 2
+# Modes Image.reduce can average, anything else is converted first
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "I", "F")
+# Uploads accepted as images when their Content-Type is not image/*
+IMAGE_EXTENSIONS = (".tif", ".tiff", ".jpg", ".jpeg", ".png", ".bmp")
+
+
+def is_image(filename, content_type=None):
+    return bool(content_type and content_type.startswith("image/")) or (filename or "").lower().endswith(IMAGE_EXTENSIONS)
+
+
+def open_image(image_input):
+    """Open an image lazily, nothing is decoded until the pixels are needed
+
+    Args:
+        image_input: Either a file path (str) or image data (bytes/BytesIO/numpy array)
+    """
+    if isinstance(image_input, (str, bytes)) or hasattr(image_input, 'read'):
+        return Image.open(io.BytesIO(image_input) if isinstance(image_input, bytes) else image_input)
+    if isinstance(image_input, np.ndarray):
+        return Image.fromarray(image_input.astype('uint8'))
+    raise ValueError(f"Unsupported image input type: {type(image_input)}")
+
+
+def _downscale(img, size=IMAGE_SIZE):
+    """Shrink `img` to no more than REDUCING_GAP times `size`, then convert it to RGB and resize to `size`
+
+    The cheap shrinking runs in the image's own mode, so greyscale and palette
+    uploads are only expanded to RGB once they are small. Palette indices
+    cannot be averaged, those images are subsampled with nearest neighbour.
+    """
+    target = (size[0] * REDUCING_GAP, size[1] * REDUCING_GAP)
+    if img.format == "JPEG":
+        img.draft(img.mode, target)
+    factor = min(img.width // target[0], img.height // target[1])
+    if factor >= 2:
+        if img.mode in ("P", "PA"):
+            img = img.resize((img.width // factor, img.height // factor), Image.Resampling.NEAREST)
+        else:
+            if img.mode not in REDUCIBLE_MODES:
+                img = img.convert("L" if img.mode == "1" else "RGB")
+            img = img.reduce(factor)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    if img.size != size:
+        img = img.resize(size)
+    return img
+
+
+def load_image(image_input, out=None):
+    """Decode an image and resize it to the model input size
+
+    Args:
+        image_input: Either a file path (str) or image data (bytes/BytesIO/numpy array)
+        out: Optional float32 (224, 224, 3) array. When given, the pixels are
+            normalised to [0, 1] straight into it and it is returned.
+
+    Returns:
+        uint8 array of shape (224, 224, 3), or `out`
+    """
+    pixels = np.asarray(_downscale(open_image(image_input)), dtype=np.uint8)
+    if out is None:
+        return pixels
+    return np.divide(pixels, np.float32(255.0), out=out)
+
+
+def try_load_image(data):
+    """`load_image` for batch uploads: (image, None) on success, (None, error message) otherwise"""
+    try:
+        return load_image(data), None
+    except Exception as e:
+        return None, f"Could not decode image: {str(e)}"
+
+
+class InputBuffer:
+    """Reusable float32 model input, grown when a larger batch arrives
+
+    Normalising into the same buffer for every batch avoids allocating a
+    fresh (N, 224, 224, 3) float32 array, and the intermediate float copies,
+    per model call. A buffer must only be used by one thread at a time, see
+    `thread_buffer`.
+    """
+
+    def __init__(self, capacity=1):
+        self._array = np.empty((capacity, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+
+    def get(self, count):
+        """A (count, 224, 224, 3) view of the buffer"""
+        if count > len(self._array):
+            self._array = np.empty((count,) + self._array.shape[1:], dtype=np.float32)
+        return self._array[:count]
+
+    def normalize(self, images, size=None):
+        """Scale uint8 (N, 224, 224, 3) images to [0, 1] into the buffer and return the view
+
+        With `size`, the view holds `size` rows and the ones after the images are zero.
+        """
+        batch = self.get(max(len(images), size or 0))
+        np.divide(images, np.float32(255.0), out=batch[:len(images)])
+        batch[len(images):] = 0.0
+        return batch
+
+
+_local = threading.local()
+
+
+def thread_buffer():
+    """The InputBuffer of the calling thread"""
+    if not hasattr(_local, "buffer"):
+        _local.buffer = InputBuffer()
+    return _local.buffer
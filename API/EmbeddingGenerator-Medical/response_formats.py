@@ -0,0 +1,126 @@
+"""Embedding response encodings, picked per request
+
+JSON number lists stay the default. The compact formats carry the vector as
+little-endian bytes instead of 384 decimal strings:
+
+- `float32`: the raw bytes as an `application/octet-stream` body, ready to be
+  forwarded as is to the classifier's `/classify`
+- `base64-float32`, `base64-float16`: JSON with the bytes base64 encoded
+- `msgpack`: the JSON fields as msgpack, with the vector as a bin field
+
+The format comes from `?format=`, or else from the first supported type in
+`Accept`. msgpack is an optional dependency, only needed when it is requested.
+"""
+import base64
+
+import numpy as np
+from fastapi.responses import JSONResponse, Response
+
+from embedding_cache import EMBEDDING_DIM
+
+JSON = "application/json"
+RAW_FLOAT32 = "application/octet-stream"
+MSGPACK = "application/x-msgpack"
+
+FORMATS = ("json", "float32", "base64-float32", "base64-float16", "msgpack")
+ACCEPT_FORMATS = {
+    JSON: "json",
+    RAW_FLOAT32: "float32",
+    MSGPACK: "msgpack",
+    "application/msgpack": "msgpack",
+    "application/*": "json",
+    "*/*": "json",
+}
+DTYPES = {"base64-float32": "<f4", "base64-float16": "<f2", "msgpack": "<f4"}
+
+
+class UnsupportedFormat(ValueError):
+    """Neither `?format=` nor `Accept` names a supported encoding"""
+
+
+def negotiate(format=None, accept=None):
+    """The response format for a request, see FORMATS"""
+    format = _negotiate(format, accept)
+    if format == "msgpack":
+        _msgpack()
+    return format
+
+
+def _negotiate(format, accept):
+    if format:
+        if format not in FORMATS:
+            raise UnsupportedFormat(f"Unknown format {format!r}, expected one of {FORMATS}")
+        return format
+    if not accept:
+        return "json"
+    offers = []
+    for position, part in enumerate(accept.split(",")):
+        kind, *params = [piece.strip() for piece in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0 and kind.lower() in ACCEPT_FORMATS:
+            offers.append((-quality, position, ACCEPT_FORMATS[kind.lower()]))
+    if not offers:
+        raise UnsupportedFormat(f"None of {accept!r} is supported, expected one of {sorted(ACCEPT_FORMATS)}")
+    return min(offers)[2]
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise UnsupportedFormat("The msgpack format needs the msgpack package installed")
+    return msgpack
+
+
+def vector_fields(embedding, format):
+    """`embedding` as the JSON or msgpack fields of the given format"""
+    if format == "json":
+        return {"embedding": embedding.tolist()}
+    data = np.asarray(embedding).astype(DTYPES[format]).tobytes()
+    if format == "msgpack":
+        return {"embedding": data, "dtype": "float32"}
+    return {"embedding": base64.b64encode(data).decode("ascii"), "dtype": format.split("-")[1]}
+
+
+def _render(content, format):
+    if format == "msgpack":
+        return Response(_msgpack().packb(content, use_bin_type=True), media_type=MSGPACK)
+    return JSONResponse(content=content)
+
+
+def embedding_response(filename, embedding, format="json"):
+    """Response for /embeddings: `{"filename", "embedding"}` or the raw float32 body"""
+    if format == "float32":
+        return Response(np.asarray(embedding).astype("<f4").tobytes(), media_type=RAW_FLOAT32)
+    return _render({"filename": filename, **vector_fields(embedding, format)}, format)
+
+
+def batch_response(results, format="json"):
+    """Response for /embeddings/batch
+
+    `results` are dicts holding index, filename and either an `embedding`
+    array or an `error`. In the float32 format the body is a (count, 384)
+    matrix in input order, with NaN rows for the failed images, whose indices
+    are listed in the X-Failed-Indices header.
+    """
+    failed = [result["index"] for result in results if "error" in result]
+    if format == "float32":
+        matrix = np.full((len(results), EMBEDDING_DIM), np.nan, dtype="<f4")
+        for row, result in enumerate(results):
+            if "embedding" in result:
+                matrix[row] = result["embedding"]
+        return Response(matrix.tobytes(), media_type=RAW_FLOAT32,
+                        headers={"X-Failed-Indices": ",".join(map(str, failed))})
+    encoded = [
+        {key: value for key, value in result.items() if key != "embedding"}
+        | (vector_fields(result["embedding"], format) if "embedding" in result else {})
+        for result in results
+    ]
+    return _render({"count": len(results), "failed": len(failed), "results": encoded}, format)
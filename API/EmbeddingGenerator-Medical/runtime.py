@@ -0,0 +1,224 @@
+"""Path Foundation inference runtimes, picked at startup with EMBEDDING_RUNTIME
+
+- "tensorflow": the SavedModel from the Hub, compiled per batch bucket
+  (`embedding_generator.BucketedModel`)
+- "tflite": a TFLite model written by convert.py, on the LiteRT interpreter
+  (`ai-edge-litert` or `tflite-runtime`, TensorFlow's own when neither is
+  installed)
+- "onnx": an ONNX model written by convert.py, on ONNX Runtime
+
+Every runtime takes uint8 (N, 224, 224, 3) images and returns float32 (N, 384)
+embeddings from `embed`, padding each call to the nearest batch bucket. With a
+standalone interpreter installed, TFLite and ONNX never import TensorFlow.
+Check a converted model with validate.py before serving it.
+"""
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from preprocessing import IMAGE_SIZE, thread_buffer
+
+RUNTIMES = ("tensorflow", "tflite", "onnx")
+# Batch sizes each runtime is prepared for, see BucketedRuntime
+BATCH_BUCKETS = (1, 8, 32)
+INPUT_SHAPE = (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+ARTIFACT_EXTENSIONS = {"tflite": ".tflite", "onnx": ".onnx"}
+
+
+def artifact_filename(runtime, int8=False):
+    return "path_foundation" + ("_int8" if int8 else "") + ARTIFACT_EXTENSIONS[runtime]
+
+
+def file_digest(path, length=12):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+class BucketedRuntime:
+    """Fixed batch shapes for any runtime
+
+    Subclasses set up one fixed-shape function per bucket in `_prepare(bucket)`
+    and run a normalised float32 (bucket, 224, 224, 3) batch in
+    `_run(bucket, batch)`. `embed` zero-pads every call to the nearest bucket
+    and splits batches above the largest. Prepare, warm-up and per-bucket call
+    times are kept for `stats`.
+    """
+
+    def __init__(self, buckets=BATCH_BUCKETS, version=""):
+        self.buckets = sorted(set(buckets))
+        self.version = version
+        self.load_seconds = 0.0
+        self._lock = threading.Lock()
+        self._stats = {}
+        for bucket in self.buckets:
+            started = time.perf_counter()
+            self._prepare(bucket)
+            self._stats[bucket] = {
+                "prepare_s": time.perf_counter() - started,
+                "warmup_s": None,
+                "calls": 0,
+                "images": 0,
+                "seconds": 0.0,
+            }
+
+    def _prepare(self, bucket):
+        pass
+
+    def _run(self, bucket, batch):
+        raise NotImplementedError
+
+    def bucket(self, count):
+        """Smallest bucket that holds `count` images"""
+        return next(bucket for bucket in self.buckets if bucket >= count)
+
+    def warm_up(self):
+        """Run every bucket once, so the first requests do not pay for compilation or allocation"""
+        for bucket in self.buckets:
+            started = time.perf_counter()
+            self._run(bucket, np.zeros((bucket,) + INPUT_SHAPE, dtype=np.float32))
+            self._stats[bucket]["warmup_s"] = time.perf_counter() - started
+            print(f"Bucket {bucket}: prepared in {self._stats[bucket]['prepare_s']:.2f}s, "
+                  f"first call {self._stats[bucket]['warmup_s']:.2f}s")
+
+    def embed(self, images):
+        """Embed uint8 (N, 224, 224, 3) images, returning float32 (N, 384) in input order"""
+        largest = self.buckets[-1]
+        if len(images) > largest:
+            return np.concatenate([self.embed(images[start:start + largest]) for start in range(0, len(images), largest)])
+        bucket = self.bucket(len(images))
+        # Normalised and zero-padded in the calling thread's reused buffer
+        batch = thread_buffer().normalize(images, bucket)
+        started = time.perf_counter()
+        embeddings = np.asarray(self._run(bucket, batch))
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[bucket]
+            stats["calls"] += 1
+            stats["images"] += len(images)
+            stats["seconds"] += elapsed
+        return embeddings[:len(images)].reshape(len(images), -1)
+
+    def stats(self):
+        with self._lock:
+            buckets = {}
+            for bucket, stats in self._stats.items():
+                buckets[str(bucket)] = {
+                    **stats,
+                    "mean_ms": stats["seconds"] * 1000.0 / stats["calls"] if stats["calls"] else None,
+                    "padding": 1.0 - stats["images"] / (stats["calls"] * bucket) if stats["calls"] else None,
+                }
+        return {
+            "runtime": self.version,
+            "load_s": self.load_seconds,
+            "startup_s": self.load_seconds + sum(
+                stats["prepare_s"] + (stats["warmup_s"] or 0.0) for stats in self._stats.values()
+            ),
+            "buckets": buckets,
+        }
+
+    def render_prometheus(self, prefix="embedding_model"):
+        """Calls, images and time per bucket in the Prometheus text exposition format"""
+        stats = self.stats()["buckets"]
+        lines = []
+        for name, help_text, field in (
+            ("calls_total", "Model calls per batch bucket", "calls"),
+            ("images_total", "Images embedded per batch bucket, padding excluded", "images"),
+            ("seconds_total", "Time spent in model calls per batch bucket", "seconds"),
+        ):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            lines.extend(f'{prefix}_{name}{{bucket="{bucket}"}} {values[field]}' for bucket, values in stats.items())
+        return "\n".join(lines) + "\n"
+
+
+def _tflite_interpreter():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel(BucketedRuntime):
+    """TFLite model with one interpreter per bucket
+
+    Each interpreter is allocated once for its batch shape. The weights are
+    read from the memory-mapped model file, so only the activation arenas are
+    per bucket.
+    """
+
+    def __init__(self, path, buckets=BATCH_BUCKETS, num_threads=0, version=""):
+        self.path = path
+        self.num_threads = num_threads
+        self._interpreters = {}
+        super().__init__(buckets, version)
+
+    def _prepare(self, bucket):
+        interpreter = _tflite_interpreter()(model_path=self.path, num_threads=self.num_threads or None)
+        input_index = interpreter.get_input_details()[0]["index"]
+        interpreter.resize_input_tensor(input_index, (bucket,) + INPUT_SHAPE)
+        interpreter.allocate_tensors()
+        self._interpreters[bucket] = (interpreter, input_index, interpreter.get_output_details()[0]["index"])
+
+    def _run(self, bucket, batch):
+        interpreter, input_index, output_index = self._interpreters[bucket]
+        interpreter.set_tensor(input_index, batch)
+        interpreter.invoke()
+        return interpreter.get_tensor(output_index)
+
+
+class OnnxModel(BucketedRuntime):
+    """ONNX Runtime session, run with fixed bucket shapes so its memory plans are reused"""
+
+    def __init__(self, path, buckets=BATCH_BUCKETS, num_threads=0, version=""):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        super().__init__(buckets, version)
+
+    def _run(self, bucket, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def load_runtime(runtime="tensorflow", buckets=BATCH_BUCKETS, jit_compile=False, artifacts_dir="artifacts",
+                 int8=False, num_threads=0):
+    """Load Path Foundation on the chosen runtime and warm every bucket
+
+    "tensorflow" downloads the SavedModel from the Hub. "tflite" and "onnx"
+    load the artifacts written by convert.py from `artifacts_dir`, the int8
+    ones with `int8`.
+    """
+    if runtime == "tensorflow":
+        from embedding_generator import load_model
+
+        return load_model(buckets, jit_compile=jit_compile)
+    if runtime not in ARTIFACT_EXTENSIONS:
+        raise ValueError(f"Unknown embedding runtime {runtime!r}, expected one of {RUNTIMES}")
+
+    path = os.path.join(artifacts_dir, artifact_filename(runtime, int8))
+    print(f"Loading PathFoundation model from {path}...")
+    version = f"{runtime}{'-int8' if int8 else ''}-{file_digest(path)}"
+    model_class = TFLiteModel if runtime == "tflite" else OnnxModel
+    started = time.perf_counter()
+    model = model_class(path, buckets, num_threads=num_threads, version=version)
+    # Session or interpreter creation, the per-bucket part is in prepare_s
+    model.load_seconds = time.perf_counter() - started - sum(stats["prepare_s"] for stats in model._stats.values())
+    model.warm_up()
+    print("Model loaded!")
+    return model
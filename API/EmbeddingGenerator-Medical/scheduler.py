@@ -0,0 +1,177 @@
+import asyncio
+import collections
+import threading
+import time
+
+import numpy as np
+
+# Upper bounds of the batch size histogram reported by `stats`
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+
+class QueueFull(Exception):
+    """Raised by `submit` when `max_queue_size` images are already waiting"""
+
+
+class BatchScheduler:
+    """Gather concurrent single-image requests into Path Foundation calls sized to the batch buckets
+
+    Every model call runs on the one model thread and is padded to the nearest
+    compiled bucket (see runtime.BucketedRuntime), so a call of 5 images costs
+    as much as one of 8. The scheduler aims for bucket sizes instead of a fixed
+    batch size:
+
+    - While a call is running nothing is dispatched, there is only one model
+      thread. Images arriving meanwhile form the next batch, so under load
+      batches fill up without any waiting.
+    - Once the model is free, the waiting images go out at once when their
+      count is a bucket, or at least `max_batch_size`. Otherwise the scheduler
+      waits, at most `window_ms` after the oldest image arrived, for the count
+      to reach the next bucket, since those images would ride in padding for free.
+
+    This is the opposite trade-off to the Diagnosing-API MicroBatcher, which
+    keeps several fixed-size batches in flight on a thread pool. Beyond
+    `max_queue_size` waiting images `submit` raises QueueFull instead of
+    letting latency grow without bound.
+    """
+
+    def __init__(self, embed_batch, max_batch_size=32, window_ms=10.0, max_queue_size=256, buckets=None):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_queue_size = max_queue_size
+        self.buckets = sorted({bucket for bucket in buckets or () if bucket < self.max_batch_size} | {self.max_batch_size})
+        self._pending = collections.deque()
+        self._arrived = None
+        self._task = None
+        self._lock = threading.Lock()
+        self._batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self.batches = 0
+        self.images = 0
+        self.rejected = 0
+        self.last_batch_size = 0
+        self.queue_wait_seconds = 0.0
+
+    async def start(self):
+        self._arrived = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def queue_depth(self):
+        """Images waiting for the model"""
+        return len(self._pending)
+
+    async def submit(self, image):
+        """Queue one preprocessed image and wait for its (384,) embedding"""
+        if self.max_queue_size and self.queue_depth >= self.max_queue_size:
+            self.rejected += 1
+            raise QueueFull(f"{self.queue_depth} images are already waiting for the model")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((image, future, time.perf_counter()))
+        self._arrived.set()
+        return await future
+
+    def _ready(self, count):
+        """Whether `count` waiting images fill a bucket, so waiting for more gains nothing"""
+        return count >= self.max_batch_size or count in self.buckets
+
+    async def _next_batch(self):
+        while True:
+            # Requests whose caller went away are dropped before they count towards a bucket
+            while self._pending and self._pending[0][1].done():
+                self._pending.popleft()
+            if not self._pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+                continue
+            timeout = self._pending[0][2] + self.window - time.perf_counter()
+            if self._ready(len(self._pending)) or timeout <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        batch = [self._pending.popleft() for _ in range(min(len(self._pending), self.max_batch_size))]
+        return [item for item in batch if not item[1].done()]
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            self._record(batch)
+            # Awaited here, the next batch gathers while the model thread is busy
+            try:
+                embeddings = await self.embed_batch(np.stack([image for image, _, _ in batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future, _), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def _record(self, batch):
+        started = time.perf_counter()
+        bucket = next((i for i, bound in enumerate(BATCH_SIZE_BUCKETS) if len(batch) <= bound), len(BATCH_SIZE_BUCKETS))
+        with self._lock:
+            self._batch_sizes[bucket] += 1
+            self.batches += 1
+            self.images += len(batch)
+            self.last_batch_size = len(batch)
+            self.queue_wait_seconds += sum(started - enqueued for _, _, enqueued in batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "max_queue_size": self.max_queue_size,
+                "max_batch_size": self.max_batch_size,
+                "buckets": self.buckets,
+                "window_ms": self.window * 1000.0,
+                "batches": self.batches,
+                "images": self.images,
+                "rejected": self.rejected,
+                "last_batch_size": self.last_batch_size,
+                "mean_batch_size": self.images / self.batches if self.batches else None,
+                "mean_queue_wait_ms": self.queue_wait_seconds * 1000.0 / self.images if self.images else None,
+                "batch_sizes": {str(bound): count for bound, count in zip(BATCH_SIZE_BUCKETS + ["+Inf"], self._batch_sizes)},
+            }
+
+    def render_prometheus(self, prefix="embedding"):
+        """Queue depth and batch size in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = [
+            f"# HELP {prefix}_queue_depth Images waiting to be batched",
+            f"# TYPE {prefix}_queue_depth gauge",
+            f"{prefix}_queue_depth {stats['queue_depth']}",
+            f"# HELP {prefix}_last_batch_size Size of the most recent model call",
+            f"# TYPE {prefix}_last_batch_size gauge",
+            f"{prefix}_last_batch_size {stats['last_batch_size']}",
+            f"# HELP {prefix}_rejected_total Images rejected because the queue was full",
+            f"# TYPE {prefix}_rejected_total counter",
+            f"{prefix}_rejected_total {stats['rejected']}",
+            f"# HELP {prefix}_batch_size Images per model call",
+            f"# TYPE {prefix}_batch_size histogram",
+        ]
+        cumulative = 0
+        for bound, count in stats["batch_sizes"].items():
+            cumulative += count
+            lines.append(f'{prefix}_batch_size_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{prefix}_batch_size_sum {stats['images']}")
+        lines.append(f"{prefix}_batch_size_count {stats['batches']}")
+        lines.append(f"# HELP {prefix}_queue_wait_seconds_total Time images spent waiting for their batch")
+        lines.append(f"# TYPE {prefix}_queue_wait_seconds_total counter")
+        lines.append(f"{prefix}_queue_wait_seconds_total {self.queue_wait_seconds}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,6 @@
+"""The tests cover the TensorFlow-free modules, so they run without the model"""
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
@@ -0,0 +1,53 @@
+import numpy as np
+
+from embedding_cache import EMBEDDING_DIM, ENTRY_BYTES, SLOT_BYTES, EmbeddingCache
+
+
+def vector(value):
+    return np.full(EMBEDDING_DIM, value, dtype=np.float32)
+
+
+def test_keys_depend_on_content_and_model_version():
+    cache = EmbeddingCache("v1")
+    assert cache.key(b"patch") == cache.key(b"patch")
+    assert cache.key(b"patch") != cache.key(b"other")
+    assert cache.key(b"patch") != EmbeddingCache("v2").key(b"patch")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = EmbeddingCache("v1", max_bytes=2 * ENTRY_BYTES)
+    keys = [cache.key(bytes([i])) for i in range(3)]
+    cache.put(keys[0], vector(0))
+    cache.put(keys[1], vector(1))
+    cache.get(keys[0])
+    cache.put(keys[2], vector(2))
+    assert cache.get(keys[1]) is None
+    np.testing.assert_array_equal(cache.get(keys[0]), vector(0))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_disk_tier_survives_a_restart_and_wraps_around(tmp_path):
+    path = str(tmp_path / "cache")
+    cache = EmbeddingCache("v1", max_bytes=0, disk_path=path, disk_max_bytes=3 * SLOT_BYTES)
+    keys = [cache.key(bytes([i])) for i in range(4)]
+    for i, key in enumerate(keys[:3]):
+        cache.put(key, vector(i))
+    cache.flush()
+
+    restarted = EmbeddingCache("v1", max_bytes=0, disk_path=path, disk_max_bytes=3 * SLOT_BYTES)
+    np.testing.assert_array_equal(restarted.get(keys[1]), vector(1))
+    restarted.put(keys[3], vector(3))
+    # The ring is full, the oldest entry made room
+    assert restarted.get(keys[0]) is None
+    np.testing.assert_array_equal(restarted.get(keys[3]), vector(3))
+    stats = restarted.stats()
+    assert stats["disk_hits"] == 2 and stats["disk_evictions"] == 1
+    assert 'embedding_cache_hits_total{tier="disk"} 2' in restarted.render_prometheus()
+
+
+def test_disabled_cache_stores_nothing():
+    cache = EmbeddingCache("v1", max_bytes=0)
+    key = cache.key(b"patch")
+    cache.put(key, vector(1))
+    assert not cache.enabled
+    assert cache.get(key) is None
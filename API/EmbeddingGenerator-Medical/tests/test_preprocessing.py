@@ -0,0 +1,74 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from preprocessing import IMAGE_SIZE, _downscale, InputBuffer, is_image, load_image, try_load_image
+
+
+def encode(image, format):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def test_is_image_accepts_image_content_types_and_extensions():
+    assert is_image("upload", "image/png")
+    assert is_image("SLIDE.TIFF", "application/octet-stream")
+    assert is_image("scan.jpeg")
+    assert not is_image("notes.txt", "text/plain")
+    assert not is_image(None)
+
+
+@pytest.mark.parametrize("mode", ["RGB", "RGBA", "L", "LA", "P", "1", "I;16", "CMYK"])
+@pytest.mark.parametrize("size", [(100, 60), (2000, 1500)])
+def test_every_mode_loads_as_224_rgb(mode, size):
+    image = Image.new(mode, size)
+    format = "JPEG" if mode == "CMYK" else "TIFF" if mode == "I;16" else "PNG"
+    pixels = load_image(encode(image, format))
+    assert pixels.shape == (IMAGE_SIZE[1], IMAGE_SIZE[0], 3)
+    assert pixels.dtype == np.uint8
+
+
+def test_large_palette_image_keeps_its_colours():
+    image = Image.new("P", (3000, 3000))
+    image.putpalette([200, 30, 40] + [0, 0, 0] * 255)
+    pixels = load_image(encode(image, "PNG"))
+    assert (pixels == [200, 30, 40]).all()
+
+
+def test_large_greyscale_image_is_downscaled_in_its_own_mode():
+    gradient = np.tile(np.linspace(0, 255, 4000, dtype=np.uint8), (2000, 1))
+    pixels = load_image(encode(Image.fromarray(gradient, "L"), "PNG"))
+    assert (pixels[..., 0] == pixels[..., 2]).all()
+    assert pixels[:, 0, 0].max() < 10 and pixels[:, -1, 0].min() > 245
+
+
+def test_large_jpeg_is_decoded_in_draft_mode():
+    image = Image.open(io.BytesIO(encode(Image.new("RGB", (4000, 4000), (10, 120, 200)), "JPEG")))
+    pixels = np.asarray(_downscale(image))
+    assert image.size[0] < 4000
+    assert np.abs(pixels.astype(int) - [10, 120, 200]).max() <= 3
+
+
+def test_load_image_normalises_into_out():
+    out = np.empty((IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32)
+    result = load_image(encode(Image.new("RGB", (300, 300), (255, 0, 51)), "PNG"), out=out)
+    assert result is out
+    np.testing.assert_allclose(out[0, 0], [1.0, 0.0, 0.2], atol=1e-6)
+
+
+def test_try_load_image_reports_undecodable_data():
+    image, error = try_load_image(b"not an image")
+    assert image is None
+    assert error.startswith("Could not decode image")
+
+
+def test_input_buffer_pads_to_the_requested_size_and_grows():
+    buffer = InputBuffer()
+    images = np.full((2, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), 255, dtype=np.uint8)
+    batch = buffer.normalize(images, size=4)
+    assert batch.shape[0] == 4
+    assert (batch[:2] == 1.0).all() and (batch[2:] == 0.0).all()
+    assert buffer.get(3).base is batch.base
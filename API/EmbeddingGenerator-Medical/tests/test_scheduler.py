@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import numpy as np
+import pytest
+
+from scheduler import BatchScheduler, QueueFull
+
+
+def images(n):
+    return [np.full((2, 2, 3), i, dtype=np.uint8) for i in range(n)]
+
+
+def recording_embed(calls, gate=None):
+    async def embed_batch(batch):
+        calls.append(len(batch))
+        if gate is not None:
+            await gate.wait()
+        return batch.reshape(len(batch), -1)[:, :1].astype(np.float32)
+    return embed_batch
+
+
+def test_a_full_bucket_goes_out_without_waiting_for_the_window():
+    calls = []
+
+    async def scenario():
+        scheduler = BatchScheduler(recording_embed(calls), max_batch_size=8, window_ms=1000, buckets=[1, 2, 4, 8])
+        await scheduler.start()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(scheduler.submit(image) for image in images(4)))
+        elapsed = time.perf_counter() - started
+        await scheduler.stop()
+        return results, elapsed
+
+    results, elapsed = asyncio.run(scenario())
+    assert calls == [4]
+    assert elapsed < 0.5
+    assert [float(result[0]) for result in results] == [0, 1, 2, 3]
+
+
+def test_a_partial_bucket_waits_for_the_window():
+    calls = []
+
+    async def scenario():
+        scheduler = BatchScheduler(recording_embed(calls), max_batch_size=8, window_ms=100, buckets=[1, 2, 4, 8])
+        await scheduler.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(scheduler.submit(image) for image in images(3)))
+        elapsed = time.perf_counter() - started
+        await scheduler.stop()
+        return elapsed, scheduler.stats()
+
+    elapsed, stats = asyncio.run(scenario())
+    assert calls == [3]
+    assert elapsed >= 0.09
+    assert stats["batches"] == 1 and stats["images"] == 3
+
+
+def test_images_arriving_during_a_call_form_the_next_batch():
+    calls = []
+
+    async def scenario():
+        gate = asyncio.Event()
+        scheduler = BatchScheduler(recording_embed(calls, gate), max_batch_size=8, window_ms=0, buckets=[1, 2, 4, 8])
+        await scheduler.start()
+        first = asyncio.create_task(scheduler.submit(images(1)[0]))
+        await asyncio.sleep(0.01)
+        rest = [asyncio.create_task(scheduler.submit(image)) for image in images(5)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.gather(first, *rest)
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert calls == [1, 5]
+
+
+def test_submit_raises_queue_full_beyond_max_queue_size():
+    calls = []
+
+    async def scenario():
+        gate = asyncio.Event()
+        scheduler = BatchScheduler(recording_embed(calls, gate), max_batch_size=8, window_ms=0, max_queue_size=2)
+        await scheduler.start()
+        # The first image is with the model, the next two wait
+        admitted = [asyncio.create_task(scheduler.submit(images(1)[0]))]
+        await asyncio.sleep(0.01)
+        admitted += [asyncio.create_task(scheduler.submit(image)) for image in images(2)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFull):
+            await scheduler.submit(images(1)[0])
+        gate.set()
+        await asyncio.gather(*admitted)
+        await scheduler.stop()
+        return scheduler
+
+    scheduler = asyncio.run(scenario())
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.stats()["images"] == 3
+    assert "embedding_rejected_total 1" in scheduler.render_prometheus()
+
+
+def test_cancelled_images_are_not_embedded():
+    calls = []
+
+    async def scenario():
+        scheduler = BatchScheduler(recording_embed(calls), max_batch_size=8, window_ms=50)
+        await scheduler.start()
+        gone = asyncio.create_task(scheduler.submit(images(1)[0]))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await scheduler.submit(images(2)[1])
+        await scheduler.stop()
+
+    asyncio.run(scenario())
+    assert calls == [1]
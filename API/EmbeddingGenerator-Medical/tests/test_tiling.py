@@ -0,0 +1,116 @@
+import asyncio
+import contextlib
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from tiling import (MIN_STRIDE, TILE_SIZE, DecodedImageReader, RawTiffReader, SlideTooLarge, embed_slide,
+                    open_slide, read_block, region_blocks)
+
+
+def slide_pixels(width=3 * TILE_SIZE, height=2 * TILE_SIZE, tissue_width=2 * TILE_SIZE):
+    """Random coloured tissue on the left, white glass on the right"""
+    pixels = np.full((height, width, 3), 255, dtype=np.uint8)
+    pixels[:, :tissue_width] = np.random.default_rng(0).integers(0, 256, (height, tissue_width, 3), dtype=np.uint8)
+    return pixels
+
+
+async def mean_colour(batch):
+    return batch.reshape(len(batch), -1, 3).mean(axis=1).astype(np.float32)
+
+
+def run_slide(reader, **kwargs):
+    async def collect():
+        return [item async for item in embed_slide(reader, mean_colour, **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_background_tiles_are_skipped_and_the_mean_covers_tissue_tiles():
+    pixels = slide_pixels()
+    *tiles, summary = run_slide(DecodedImageReader(Image.fromarray(pixels)), batch_size=3, region_size=TILE_SIZE)
+
+    assert sorted((tile["x"], tile["y"]) for tile in tiles) == [(0, 0), (0, 224), (224, 0), (224, 224)]
+    assert summary["tiles"] == 4
+    assert summary["background_tiles"] == 2
+    expected = np.mean([tile["embedding"] for tile in tiles], axis=0)
+    np.testing.assert_allclose(summary["embedding"], expected, rtol=1e-5)
+    np.testing.assert_allclose(tiles[0]["embedding"], pixels[:224, :224].reshape(-1, 3).mean(axis=0), rtol=1e-5)
+
+
+def test_overlapping_tiles_cover_the_grid_at_the_stride():
+    reader = DecodedImageReader(Image.fromarray(slide_pixels(tissue_width=3 * TILE_SIZE)))
+    *tiles, summary = run_slide(reader, stride=112)
+    assert summary["tiles"] == len(tiles) == 5 * 3
+    assert summary["stride"] == 112
+
+
+def test_tiles_are_views_into_their_region():
+    reader = DecodedImageReader(Image.fromarray(slide_pixels(tissue_width=3 * TILE_SIZE)))
+    xs, ys = next(region_blocks(reader.size, MIN_STRIDE, 2048))
+    tiles, background = read_block(reader, xs, ys, min_tissue=0.25)
+    assert background == 0
+    assert not tiles[0][3].flags.owndata
+    assert np.shares_memory(tiles[0][3], tiles[1][3])
+
+
+def test_min_stride_is_a_quarter_tile():
+    assert MIN_STRIDE == 56
+
+
+def test_uncompressed_tiff_is_read_region_by_region(tmp_path):
+    pixels = slide_pixels()
+    path = str(tmp_path / "slide.tiff")
+    Image.fromarray(pixels).save(path, compression="raw")
+
+    reader = open_slide(path, max_pixels=1)
+    try:
+        assert isinstance(reader, RawTiffReader)
+        assert reader.size == (pixels.shape[1], pixels.shape[0])
+        np.testing.assert_array_equal(reader.read_region(100, 50, 300, 200), pixels[50:250, 100:400])
+    finally:
+        reader.close()
+
+
+def test_compressed_images_above_max_pixels_are_refused(tmp_path):
+    path = str(tmp_path / "slide.png")
+    Image.fromarray(slide_pixels()).save(path)
+    with pytest.raises(SlideTooLarge):
+        open_slide(path, max_pixels=1000)
+    reader = open_slide(path, max_pixels=10 ** 7)
+    assert isinstance(reader, DecodedImageReader)
+
+
+class SlowReader:
+    """Reader whose regions take a while, tracking reads still in progress"""
+    def __init__(self):
+        self.size = (3 * TILE_SIZE, 3 * TILE_SIZE)
+        self.pixels = slide_pixels(*self.size, tissue_width=self.size[0])
+        self.reading = 0
+        self._lock = threading.Lock()
+
+    def read_region(self, x, y, width, height):
+        with self._lock:
+            self.reading += 1
+        time.sleep(0.1)
+        with self._lock:
+            self.reading -= 1
+        return self.pixels[y:y + height, x:x + width]
+
+
+def test_closing_early_waits_for_the_prefetched_region():
+    reader = SlowReader()
+
+    async def first_tile():
+        async with contextlib.aclosing(embed_slide(reader, mean_colour, batch_size=1, region_size=TILE_SIZE)) as tiles:
+            tile = await tiles.__anext__()
+            await asyncio.sleep(0.02)
+            assert reader.reading == 1
+        # The next region was being read when the generator closed
+        return tile, reader.reading
+
+    tile, reading = asyncio.run(first_tile())
+    assert (tile["x"], tile["y"]) == (0, 0)
+    assert reading == 0
@@ -0,0 +1,243 @@
+"""Tile whole-slide images into 224x224 patches and embed them
+
+A slide is never decoded as a whole. Tile origins are laid out on a grid at
+`stride`, and the grid is walked in blocks of about `region_size` pixels: each
+block reads one region of the slide, cuts its tiles, drops background tiles
+with a saturation mask and queues the rest for embedding. Tiles are views into
+their region and only copied `batch_size` at a time into the array sent to the
+model, so a region costs the same at any stride. At most a few regions are held
+while the previous batch is embedded, so memory stays flat however big the
+slide is, as long as it can be read by region. The slide vector is the mean of
+the tile embeddings, kept as a running sum.
+
+Regions are read with, in order of preference:
+
+- OpenSlide (optional, `openslide-python`) for every format it detects: SVS,
+  NDPI, MRXS, tiled and pyramidal TIFF, ...
+- uncompressed RGB TIFFs, stripped or tiled, by reading the rows of each
+  region straight from the file
+- Pillow for anything else, decoded once as a whole. This is not streaming:
+  the decoded image is held until the slide is done, so only images of at
+  most `max_pixels` are accepted this way, larger ones need OpenSlide.
+"""
+import asyncio
+import threading
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import IMAGE_SIZE
+
+TILE_SIZE = IMAGE_SIZE[0]
+# Smallest stride accepted, every pixel is then in at most 16 tiles
+MIN_STRIDE = TILE_SIZE // 4
+# A pixel is tissue when its channels differ by more than this, background
+# (glass, white or black padding) is grey
+TISSUE_SATURATION = 20
+
+
+class SlideError(ValueError):
+    """The upload cannot be opened as a slide"""
+
+
+class SlideTooLarge(SlideError):
+    """The slide would have to be decoded whole and is above the pixel limit"""
+
+
+_open_lock = threading.Lock()
+
+
+def _open_image(path):
+    """Image.open without Pillow's decompression bomb check
+
+    Slides are far above its limit. Regions are read a bounded size at a time,
+    and whole decodes are capped by `max_pixels` instead. Everything else in
+    the serving process decodes in the worker processes, which keep the check.
+    """
+    with _open_lock:
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            return Image.open(path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+class OpenSlideReader:
+    def __init__(self, slide):
+        self.slide = slide
+        self.size = slide.dimensions
+
+    def read_region(self, x, y, width, height):
+        region = np.asarray(self.slide.read_region((x, y), 0, (width, height)))
+        rgb = region[..., :3].copy()
+        # Pixels outside the scanned area are transparent black, show them as glass
+        rgb[region[..., 3] == 0] = 255
+        return rgb
+
+    def close(self):
+        self.slide.close()
+
+
+class RawTiffReader:
+    """Uncompressed 8-bit RGB TIFF, stripped or tiled, read straight from the file
+
+    Only the rows of the strips or tiles a region overlaps are read, nothing
+    goes through a decoder.
+    """
+
+    def __init__(self, path, image):
+        self.size = image.size
+        # (extents, file offset, bytes per row) of each strip or tile
+        self.chunks = [
+            (tile.extents, tile.offset, tile.args[1] or (tile.extents[2] - tile.extents[0]) * 3)
+            for tile in image.tile
+        ]
+        self.file = open(path, "rb")
+        self._lock = threading.Lock()
+
+    def read_region(self, x, y, width, height):
+        region = np.empty((height, width, 3), dtype=np.uint8)
+        for (left, top, right, bottom), offset, row_bytes in self.chunks:
+            x0, y0 = max(x, left), max(y, top)
+            x1, y1 = min(x + width, right), min(y + height, bottom)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            with self._lock:
+                self.file.seek(offset + (y0 - top) * row_bytes)
+                rows = np.fromfile(self.file, dtype=np.uint8, count=(y1 - y0) * row_bytes)
+            rows = rows.reshape(y1 - y0, row_bytes)[:, (x0 - left) * 3:(x1 - left) * 3]
+            region[y0 - y:y1 - y, x0 - x:x1 - x] = rows.reshape(y1 - y0, x1 - x0, 3)
+        return region
+
+    def close(self):
+        self.file.close()
+
+
+class DecodedImageReader:
+    def __init__(self, image):
+        self.pixels = np.asarray(image.convert("RGB") if image.mode != "RGB" else image)
+        self.size = image.size
+
+    def read_region(self, x, y, width, height):
+        return self.pixels[y:y + height, x:x + width]
+
+    def close(self):
+        self.pixels = None
+
+
+def _is_raw_tiff(image):
+    return image.format == "TIFF" and image.mode == "RGB" and all(
+        tile.codec_name == "raw" and tile.args[0] == "RGB" for tile in image.tile
+    )
+
+
+def open_slide(path, max_pixels):
+    """A reader of `path` with `size` and `read_region(x, y, width, height)` -> uint8 RGB array"""
+    try:
+        import openslide
+    except ImportError:
+        openslide = None
+    if openslide is not None and openslide.OpenSlide.detect_format(path):
+        return OpenSlideReader(openslide.OpenSlide(path))
+
+    try:
+        image = _open_image(path)
+    except Exception:
+        raise SlideError("Could not open slide: not a format OpenSlide or Pillow can read")
+    if _is_raw_tiff(image):
+        reader = RawTiffReader(path, image)
+        image.close()
+        return reader
+    if image.width * image.height > max_pixels:
+        image.close()
+        raise SlideTooLarge(
+            f"{image.width}x{image.height} image is larger than {max_pixels} pixels and cannot be read "
+            "region by region, install openslide-python or send a tiled or uncompressed TIFF"
+        )
+    with image:
+        return DecodedImageReader(image)
+
+
+def tissue_fraction(tile):
+    """Share of tissue pixels in a tile, estimated on every 4th pixel"""
+    sample = tile[::4, ::4].astype(np.int16)
+    return float(np.mean(sample.max(axis=-1) - sample.min(axis=-1) > TISSUE_SATURATION))
+
+
+def tile_origins(length, stride):
+    return list(range(0, length - TILE_SIZE + 1, stride))
+
+
+def region_blocks(size, stride, region_size):
+    """Groups of tile origins, (xs, ys), each covered by one region read"""
+    per_region = max(1, (region_size - TILE_SIZE) // stride + 1)
+    xs, ys = tile_origins(size[0], stride), tile_origins(size[1], stride)
+    for row in range(0, len(ys), per_region):
+        for column in range(0, len(xs), per_region):
+            yield xs[column:column + per_region], ys[row:row + per_region]
+
+
+def read_block(reader, xs, ys, min_tissue):
+    """Read the region under one block and cut it into (x, y, tissue, tile), background dropped
+
+    Returns the tissue tiles and the number of background tiles. Tiles are
+    views into the region, overlapping ones share its memory.
+    """
+    left, top = xs[0], ys[0]
+    region = reader.read_region(left, top, xs[-1] - left + TILE_SIZE, ys[-1] - top + TILE_SIZE)
+    tiles, background = [], 0
+    for y in ys:
+        for x in xs:
+            tile = region[y - top:y - top + TILE_SIZE, x - left:x - left + TILE_SIZE]
+            tissue = tissue_fraction(tile)
+            if tissue < min_tissue:
+                background += 1
+            else:
+                tiles.append((x, y, tissue, tile))
+    return tiles, background
+
+
+async def embed_slide(reader, embed, stride=TILE_SIZE, min_tissue=0.25, batch_size=32, region_size=2048):
+    """Yield one dict per tissue tile, then a summary with the mean slide embedding
+
+    `embed` is a coroutine taking a uint8 (N, 224, 224, 3) array and
+    returning (N, 384) embeddings. The next region is read in a thread while
+    the current batch is embedded. Close the generator (`contextlib.aclosing`)
+    before closing `reader`, it waits for a prefetch still reading from it.
+    """
+    blocks = list(region_blocks(reader.size, stride, region_size))
+    pending, total, tiles, background = [], None, 0, 0
+    next_read = asyncio.create_task(asyncio.to_thread(read_block, reader, *blocks[0], min_tissue)) if blocks else None
+    try:
+        for index in range(len(blocks)):
+            # Shielded, cancelling the task would only detach it from the read thread
+            block_tiles, block_background = await asyncio.shield(next_read)
+            next_read = None
+            if index + 1 < len(blocks):
+                next_read = asyncio.create_task(asyncio.to_thread(read_block, reader, *blocks[index + 1], min_tissue))
+            background += block_background
+            pending.extend(block_tiles)
+            while len(pending) >= batch_size or (pending and next_read is None):
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                embeddings = await embed(np.stack([tile for _, _, _, tile in batch]))
+                total = embeddings.sum(axis=0, dtype=np.float64) + (0 if total is None else total)
+                tiles += len(batch)
+                for (x, y, tissue, _), embedding in zip(batch, embeddings):
+                    yield {"x": x, "y": y, "tissue": round(tissue, 3), "embedding": embedding}
+    finally:
+        # Closed early (client gone, error): a read thread cannot be interrupted, so
+        # wait for the prefetch to finish before the caller may close the reader
+        if next_read is not None:
+            await asyncio.wait([next_read])
+            if not next_read.cancelled():
+                next_read.exception()
+
+    yield {
+        "width": reader.size[0],
+        "height": reader.size[1],
+        "tile_size": TILE_SIZE,
+        "stride": stride,
+        "tiles": tiles,
+        "background_tiles": background,
+        "embedding": (total / tiles).astype(np.float32) if tiles else None,
+    }
@@ -0,0 +1,118 @@
+"""Compare converted runtimes with the TensorFlow reference before switching to one
+
+Embeds the --images sample with the SavedModel and with every converted
+artifact found in --artifacts, then reports for each:
+
+- cosine similarity of its embeddings to the reference ones (mean, minimum
+  and 1st percentile)
+- milliseconds per image on this machine, for the reference as well
+- with --classifier-url (the Diagnosing API's /classify_batch), the share of
+  images that get the same prediction from both embeddings
+
+Exits non-zero when any runtime is below --min-cosine or --min-agreement.
+
+    python validate.py --images data/test-patches --int8 --classifier-url http://localhost:8000/classify_batch
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+import numpy as np
+
+from preprocessing import IMAGE_EXTENSIONS, load_image
+from runtime import BATCH_BUCKETS, artifact_filename, load_runtime
+
+
+def sample_images(directory, limit):
+    paths = sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not paths:
+        raise SystemExit(f"No images found in {directory}")
+    return np.stack([load_image(path) for path in paths])
+
+
+def embed_all(model, images):
+    """Embeddings of every image and the mean milliseconds per image"""
+    batch_size = model.buckets[-1]
+    started = time.perf_counter()
+    embeddings = np.concatenate([model.embed(images[start:start + batch_size]) for start in range(0, len(images), batch_size)])
+    return embeddings, (time.perf_counter() - started) * 1000.0 / len(images)
+
+
+def cosine(a, b):
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return np.sum(a * b, axis=1)
+
+
+def classify(url, embeddings):
+    """Predictions of the Diagnosing API for each embedding, sent as raw float32"""
+    request = urllib.request.Request(
+        url, data=embeddings.astype("<f4").tobytes(), headers={"Content-Type": "application/octet-stream"}
+    )
+    with urllib.request.urlopen(request) as response:
+        body = response.read().decode()
+    if response.headers.get("Content-Type", "").startswith("application/x-ndjson"):
+        rows = sorted((json.loads(line) for line in body.splitlines() if line), key=lambda row: row["index"])
+        return [row["prediction"] for row in rows]
+    return [row["prediction"] for row in json.loads(body)["results"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Folder of sample patches")
+    parser.add_argument("--limit", type=int, default=512, help="Images taken from --images")
+    parser.add_argument("--artifacts", default="artifacts")
+    parser.add_argument("--runtimes", nargs="+", default=["tflite", "onnx"], choices=["tflite", "onnx"])
+    parser.add_argument("--int8", action="store_true", help="Also validate the int8 artifacts")
+    parser.add_argument("--buckets", type=int, nargs="+", default=list(BATCH_BUCKETS))
+    parser.add_argument("--num-threads", type=int, default=0)
+    parser.add_argument("--classifier-url", help="Diagnosing API /classify_batch, agreement is skipped without it")
+    parser.add_argument("--min-cosine", type=float, default=0.99, help="Lowest allowed mean cosine similarity")
+    parser.add_argument("--min-agreement", type=float, default=0.99, help="Lowest allowed classifier agreement")
+    args = parser.parse_args()
+
+    images = sample_images(args.images, args.limit)
+    reference, reference_ms = embed_all(load_runtime("tensorflow", args.buckets), images)
+    reference_predictions = classify(args.classifier_url, reference) if args.classifier_url else None
+    report = {"images": len(images), "tensorflow": {"ms_per_image": round(reference_ms, 2)}}
+
+    passed = True
+    for runtime in args.runtimes:
+        for int8 in (False, True) if args.int8 else (False,):
+            name = artifact_filename(runtime, int8)
+            if not os.path.exists(os.path.join(args.artifacts, name)):
+                report[name] = {"error": "not found, run convert.py first"}
+                passed = False
+                continue
+            model = load_runtime(runtime, args.buckets, artifacts_dir=args.artifacts, int8=int8,
+                                 num_threads=args.num_threads)
+            embeddings, ms = embed_all(model, images)
+            similarity = cosine(reference, embeddings)
+            result = {
+                "runtime": model.version,
+                "ms_per_image": round(ms, 2),
+                "speedup": round(reference_ms / ms, 2),
+                "cosine_mean": round(float(similarity.mean()), 5),
+                "cosine_min": round(float(similarity.min()), 5),
+                "cosine_p1": round(float(np.percentile(similarity, 1)), 5),
+            }
+            result["passed"] = result["cosine_mean"] >= args.min_cosine
+            if reference_predictions is not None:
+                predictions = classify(args.classifier_url, embeddings)
+                result["classifier_agreement"] = float(np.mean([a == b for a, b in zip(reference_predictions, predictions)]))
+                result["passed"] = result["passed"] and result["classifier_agreement"] >= args.min_agreement
+            passed = passed and result["passed"]
+            report[name] = result
+
+    print(json.dumps(report, indent=2))
+    if not passed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
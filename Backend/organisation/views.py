@@ -6,9 +6,18 @@ from organisation.serializers import DiagnosingImageSerializer
 from drf_yasg.utils import swagger_auto_schema
 import requests
 import mimetypes
+import os
+import struct
 
 EMBEDDING_API_URL = "https://arpit-bansal-EmbeddingGenerator-Medical.hf.space/embeddings"
 RESULT_API_URL = "https://arpit-bansal-Diagnosing-API.hf.space/classify"
+# Both APIs speak raw little-endian float32, which is passed through without parsing
+RAW_FLOAT32 = "application/octet-stream"
+EMBEDDING_BYTES = 384 * 4
+# Returned by a result API that only takes JSON, the embedding is then resent as JSON
+RAW_REJECTED_STATUSES = (415, 422)
+# Combined embed-and-classify service (API/Diagnose-Pipeline), one call instead of two when set
+DIAGNOSE_API_URL = os.getenv("DIAGNOSE_API_URL") or None
 
 
 class DiagnoseImageAndGetResultView(generics.CreateAPIView):
@@ -28,25 +37,43 @@ class DiagnoseImageAndGetResultView(generics.CreateAPIView):
             image_path = serializer.instance.image.path
 
             try:
+                if DIAGNOSE_API_URL:
+                    with open(image_path, 'rb') as f:
+                        mime_type, _ = mimetypes.guess_type(image_path)
+                        files = {'file': (f.name, f, mime_type or 'application/octet-stream')}
+                        result_response = requests.post(DIAGNOSE_API_URL, files=files)
+                    if result_response.status_code != 200:
+                        return Response({'error': 'Failed to get result from diagnose API.', 'details': result_response.text},
+                                        status=result_response.status_code)
+                    return Response({'result': result_response.json()}, status=200)
+
                 # Step 1: Get embedding
                 with open(image_path, 'rb') as f:
                     mime_type, _ = mimetypes.guess_type(image_path)
                     files = {'file': (f.name, f, mime_type or 'application/octet-stream')}
-                    embedding_response = requests.post(EMBEDDING_API_URL, files=files)
+                    embedding_response = requests.post(EMBEDDING_API_URL, files=files,
+                                                       headers={'Accept': RAW_FLOAT32})
                     print(embedding_response)
 
                 if embedding_response.status_code != 200:
                     return Response({'error': 'Failed to get embedding.', 'details': embedding_response.text},
                                     status=embedding_response.status_code)
 
-                embedding = embedding_response.json().get('embedding')
-                print(embedding)
-                if not embedding:
-                    return Response({'error': 'No embedding found in response from embedding API.'}, status=500)
-
                 # Step 2: Send to result API
-                result_payload = {"features": embedding}
-                result_response = requests.post(RESULT_API_URL, json=result_payload)
+                if embedding_response.headers.get('Content-Type', '').startswith(RAW_FLOAT32):
+                    if len(embedding_response.content) != EMBEDDING_BYTES:
+                        return Response({'error': 'No embedding found in response from embedding API.'}, status=500)
+                    result_response = requests.post(RESULT_API_URL, data=embedding_response.content,
+                                                    headers={'Content-Type': RAW_FLOAT32})
+                    if result_response.status_code in RAW_REJECTED_STATUSES:
+                        embedding = list(struct.unpack('<384f', embedding_response.content))
+                        result_response = requests.post(RESULT_API_URL, json={"features": embedding})
+                else:
+                    # Embedding API without binary responses
+                    embedding = embedding_response.json().get('embedding')
+                    if not embedding:
+                        return Response({'error': 'No embedding found in response from embedding API.'}, status=500)
+                    result_response = requests.post(RESULT_API_URL, json={"features": embedding})
 
                 if result_response.status_code != 200:
                     return Response({'error': 'Failed to get result from result API.', 'details': result_response.text},